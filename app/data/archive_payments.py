@@ -0,0 +1,39 @@
+import argparse
+from datetime import datetime, timedelta
+
+from app.data.repositories.archive_repository import ARCHIVE_AFTER_DAYS
+from app.data.repositories.payment_repository import (
+    SessionLocal,
+    archive_payments,
+    users_with_payments_before,
+)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Move payments older than the retention period, in whole "
+        "months, from the payments table to the Parquet archive."
+    )
+    parser.add_argument(
+        "--user-id", type=int, default=None, help="Only archive this user (optional)"
+    )
+    parser.add_argument(
+        "--days",
+        type=int,
+        default=ARCHIVE_AFTER_DAYS,
+        help=f"Archive payments older than this (default {ARCHIVE_AFTER_DAYS})",
+    )
+    args = parser.parse_args()
+
+    cutoff = datetime.now() - timedelta(days=args.days)
+    before = datetime(cutoff.year, cutoff.month, 1)
+    db = SessionLocal()
+    try:
+        if args.user_id is not None:
+            user_ids = [args.user_id]
+        else:
+            user_ids = users_with_payments_before(db, before)
+        for user_id in user_ids:
+            count = archive_payments(db, user_id, before)
+            print(f"User {user_id}: archived {count} payments before {before:%Y-%m-%d}")
+    finally:
+        db.close()
@@ -1,13 +1,107 @@
 import os
+import threading
+import time
+from typing import Dict, Optional
 
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import declarative_base
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
 
 load_dotenv()
-DATABASE_URL = os.getenv("DATABASE_URL")
-if not DATABASE_URL:
-    raise RuntimeError("DATABASE_URL environment variable is not set")
 
 Base = declarative_base()
-engine = create_engine(DATABASE_URL)
+
+# Reads stay on the primary for this long after a user's write, so they see
+# it even while the replica lags behind
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+
+_engines: Dict[str, Engine] = {}
+_engines_lock = threading.Lock()
+# user_id -> time.monotonic() of the last committed write, in this process
+_last_writes: Dict[int, float] = {}
+
+
+def _create_engine(name: str, env_var: str) -> Optional[Engine]:
+    engine = _engines.get(name)
+    if engine is None:
+        with _engines_lock:
+            if name not in _engines:
+                database_url = os.getenv(env_var)
+                if not database_url:
+                    return None
+                _engines[name] = create_engine(database_url)
+            engine = _engines[name]
+    return engine
+
+
+def get_engine() -> Engine:
+    """
+    Create the engine on first use, so importing models and repositories
+    needs neither DATABASE_URL nor the database driver.
+    """
+    engine = _create_engine("primary", "DATABASE_URL")
+    if engine is None:
+        raise RuntimeError("DATABASE_URL environment variable is not set")
+    return engine
+
+
+def get_replica_engine() -> Optional[Engine]:
+    """
+    Engine of the read-only replica at DATABASE_REPLICA_URL, None without one.
+    """
+    return _create_engine("replica", "DATABASE_REPLICA_URL")
+
+
+def created_engines() -> Dict[str, Engine]:
+    return dict(_engines)
+
+
+class LazySession(Session):
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.info.get("replica"):
+            return get_replica_engine() or get_engine()
+        return get_engine()
+
+
+SessionLocal = sessionmaker(class_=LazySession, autocommit=False, autoflush=False)
+
+
+def mark_written(db: Session, user_id: int) -> None:
+    """
+    Note that the session writes data of the user, which keeps the user's
+    reads on the primary for REPLICA_STICKY_SECONDS once it commits.
+    """
+    db.info.setdefault("written_users", set()).add(user_id)
+
+
+@event.listens_for(LazySession, "after_commit")
+def _record_writes(db: Session) -> None:
+    written = db.info.pop("written_users", None)
+    if written:
+        now = time.monotonic()
+        for user_id in written:
+            _last_writes[user_id] = now
+        if len(_last_writes) > 10000:
+            for user_id, written_at in list(_last_writes.items()):
+                if now - written_at >= REPLICA_STICKY_SECONDS:
+                    _last_writes.pop(user_id, None)
+
+
+@event.listens_for(LazySession, "after_rollback")
+def _forget_writes(db: Session) -> None:
+    db.info.pop("written_users", None)
+
+
+def read_session(user_id: int) -> Session:
+    """
+    Session for read-only work on the user's data: on the replica if there is
+    one and the user has not written in the last REPLICA_STICKY_SECONDS.
+    """
+    written_at = _last_writes.get(user_id)
+    recent = (
+        written_at is not None
+        and time.monotonic() - written_at < REPLICA_STICKY_SECONDS
+    )
+    replica = not recent and get_replica_engine() is not None
+    return SessionLocal(info={"replica": replica})
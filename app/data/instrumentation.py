@@ -0,0 +1,122 @@
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+from prometheus_client import REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.data.base import created_engines
+
+logger = logging.getLogger("app.performance")
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    sql_ms: float = 0.0
+    rows: int = 0
+    spans: Dict[str, float] = field(default_factory=dict)
+
+    def server_timing(self, total_ms: float) -> str:
+        metrics = [
+            f"total;dur={total_ms:.1f}",
+            f'db;dur={self.sql_ms:.1f};desc="{self.queries} queries"',
+        ]
+        metrics += [f"{name};dur={ms:.1f}" for name, ms in self.spans.items()]
+        metrics.append(f'rows;desc="{self.rows} rows"')
+        return ", ".join(metrics)
+
+
+_current_stats: ContextVar[Optional[RequestStats]] = ContextVar(
+    "request_stats", default=None
+)
+
+
+def start_request_stats() -> Tuple[RequestStats, Token]:
+    stats = RequestStats()
+    return stats, _current_stats.set(stats)
+
+
+def reset_request_stats(token: Token) -> None:
+    _current_stats.reset(token)
+
+
+def record_rows_loaded(count: int) -> None:
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.rows += count
+
+
+@contextmanager
+def timed(name: str):
+    """
+    Add the duration of the block to the current request's Server-Timing.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = _current_stats.get()
+        if stats is not None:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            stats.spans[name] = stats.spans.get(name, 0.0) + elapsed_ms
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - context._query_started) * 1000
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.sql_ms += elapsed_ms
+    if elapsed_ms >= SLOW_QUERY_MS:
+        logger.warning(
+            json.dumps(
+                {
+                    "event": "slow_query",
+                    "duration_ms": round(elapsed_ms, 1),
+                    "statement": " ".join(statement.split())[:500],
+                }
+            )
+        )
+
+
+class PoolCollector:
+    """
+    Report connection pool usage of every created engine at scrape time. Pools
+    without a fixed size (e.g. SQLite in-memory) only report what they track.
+    """
+
+    def collect(self):
+        gauges = {
+            "size": "Configured pool size",
+            "checkedout": "Connections currently in use",
+            "checkedin": "Idle connections in the pool",
+            "overflow": "Connections opened beyond the pool size",
+        }
+        for attr, doc in gauges.items():
+            family = GaugeMetricFamily(f"db_pool_{attr}", doc, labels=["engine"])
+            for name, target_engine in created_engines().items():
+                value = getattr(target_engine.pool, attr, None)
+                if value is not None:
+                    family.add_metric([name], value())
+            yield family
+
+
+REGISTRY.register(PoolCollector())
+
+# Listening on the Engine class covers engines created later on first use
+event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
@@ -0,0 +1,22 @@
+import argparse
+
+from app.data.repositories.payment_repository import (
+    SessionLocal,
+    rebuild_monthly_summary,
+)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recompute the payment_monthly_summary table from payments."
+    )
+    parser.add_argument(
+        "--user-id", type=int, default=None, help="Only rebuild this user (optional)"
+    )
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        count = rebuild_monthly_summary(db, args.user_id)
+        print(f"Rebuilt monthly summary: {count} rows")
+    finally:
+        db.close()
@@ -0,0 +1,252 @@
+import glob
+import itertools
+import os
+import tempfile
+import threading
+from datetime import datetime, time, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select
+
+from app.data.instrumentation import record_rows_loaded
+from app.data.repositories.payment_repository import (
+    SERIES_PERIODS,
+    PaymentORM,
+    get_category_sums,
+    get_data_versions,
+    iter_archived_batches,
+    sum_payments_by_period,
+)
+from app.domain.models.payment import PaymentSource, PaymentType
+
+# "sql" runs aggregations in the primary database, "duckdb" in an embedded
+# DuckDB over a per-user Parquet snapshot (needs duckdb and pyarrow)
+ANALYTICS_BACKEND = os.getenv("ANALYTICS_BACKEND", "sql").lower()
+ANALYTICS_SNAPSHOT_DIR = os.getenv("ANALYTICS_SNAPSHOT_DIR") or os.path.join(
+    tempfile.gettempdir(), "payments-analytics"
+)
+SNAPSHOT_BATCH_ROWS = 100_000
+
+
+class SqlAnalytics:
+    """
+    Aggregations as SQL queries on the payments table and monthly summary.
+    """
+
+    name = "sql"
+
+    def category_sums(
+        self,
+        db,
+        user_id: int,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+    ) -> List[Tuple[str, int]]:
+        return get_category_sums(db, user_id, start_date, end_date)
+
+    def sums_by_period(
+        self,
+        db,
+        user_id: int,
+        period: str,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        split_by: Optional[str] = None,
+    ) -> List[tuple]:
+        return sum_payments_by_period(
+            db, user_id, period, start_date, end_date, split_by
+        )
+
+
+# Same as _signed_fen in payment_repository, on the snapshot's enum values
+SIGNED_FEN = (
+    f"CASE WHEN type = '{PaymentType.EXPENSE.value}' THEN -amount_fen"
+    f" WHEN type IN ('{PaymentType.INCOME.value}', '{PaymentType.REFUND.value}')"
+    " THEN amount_fen ELSE 0 END"
+)
+
+
+class DuckDBAnalytics:
+    """
+    The same aggregations in an embedded DuckDB. Each user's payments are
+    copied to a Parquet snapshot named after their data version, so the first
+    query after a write rebuilds it and later ones only read the file.
+    """
+
+    name = "duckdb"
+
+    def __init__(self, snapshot_dir: str = ANALYTICS_SNAPSHOT_DIR):
+        self.snapshot_dir = snapshot_dir
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def category_sums(
+        self,
+        db,
+        user_id: int,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+    ) -> List[Tuple[str, int]]:
+        where, params = _date_filter(start_date, end_date)
+        rows = self._query(
+            db,
+            user_id,
+            f"SELECT coalesce(category, ''), sum({SIGNED_FEN}) FROM {{payments}}"
+            f" {where} GROUP BY 1",
+            params,
+        )
+        return [(category, int(total)) for category, total in rows]
+
+    def sums_by_period(
+        self,
+        db,
+        user_id: int,
+        period: str,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        split_by: Optional[str] = None,
+    ) -> List[tuple]:
+        if period not in SERIES_PERIODS:
+            raise ValueError(f"Invalid period: {period}")
+        if split_by not in (None, "category", "source"):
+            raise ValueError(f"Invalid split: {split_by}")
+        group = split_by or "NULL"
+        where, params = _date_filter(start_date, end_date)
+        rows = self._query(
+            db,
+            user_id,
+            f"SELECT strftime(date_trunc('{period}', date), '%Y-%m-%d') AS bucket,"
+            f" {group} AS grp, sum({SIGNED_FEN}) FROM {{payments}} {where}"
+            f" GROUP BY bucket{', grp' if split_by else ''}",
+            params,
+        )
+        if split_by == "source":
+            return [(b, PaymentSource(g), int(total)) for b, g, total in rows]
+        return [(b, g, int(total)) for b, g, total in rows]
+
+    def snapshot_path(self, db, user_id: int) -> str:
+        """
+        Path of the user's snapshot for the current data version, written
+        first if it does not exist yet.
+        """
+        data_version, _ = get_data_versions(db, user_id)
+        user_dir = os.path.join(self.snapshot_dir, f"user_{user_id}")
+        path = os.path.join(user_dir, f"v{data_version}.parquet")
+        if not os.path.exists(path):
+            with self._lock:
+                if not os.path.exists(path):
+                    self._write_snapshot(db, user_id, user_dir, path, data_version)
+        return path
+
+    def _write_snapshot(
+        self, db, user_id: int, user_dir: str, path: str, data_version: int
+    ) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema(
+            [
+                ("date", pa.timestamp("us")),
+                ("amount_fen", pa.int64()),
+                ("category", pa.string()),
+                ("source", pa.string()),
+                ("type", pa.string()),
+            ]
+        )
+        os.makedirs(user_dir, exist_ok=True)
+        # Written under a unique name and renamed, other workers never see
+        # a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        result = db.execute(
+            select(
+                PaymentORM.date,
+                PaymentORM.amount_fen,
+                PaymentORM.category,
+                PaymentORM.source,
+                PaymentORM.type,
+            )
+            .where(PaymentORM.user_id == user_id)
+            .execution_options(stream_results=True, yield_per=SNAPSHOT_BATCH_ROWS)
+        )
+
+        def table_batches():
+            for batch in result.partitions():
+                record_rows_loaded(len(batch))
+                yield batch
+
+        # Read one month partition at a time, iter_archived_batches counts the
+        # rows it loads
+        archived = (
+            [
+                (row.date, row.amount_fen, row.category, row.source, row.type)
+                for row in rows
+            ]
+            for rows in iter_archived_batches(db, user_id)
+        )
+        with pq.ParquetWriter(tmp_path, schema, compression="zstd") as writer:
+            for batch in itertools.chain(archived, table_batches()):
+                dates, amounts, categories, sources, types = zip(*batch)
+                writer.write_batch(
+                    pa.record_batch(
+                        [
+                            pa.array(dates, pa.timestamp("us")),
+                            pa.array(amounts, pa.int64()),
+                            pa.array(categories, pa.string()),
+                            pa.array([s.value for s in sources], pa.string()),
+                            pa.array([t.value for t in types], pa.string()),
+                        ],
+                        schema=schema,
+                    )
+                )
+        os.replace(tmp_path, path)
+        for old_path in glob.glob(os.path.join(user_dir, "v*.parquet")):
+            version = os.path.basename(old_path)[1 : -len(".parquet")]
+            if version.isdigit() and int(version) < data_version:
+                os.remove(old_path)
+
+    def _query(self, db, user_id: int, sql: str, params: list) -> List[tuple]:
+        """
+        Run sql with {payments} replaced by the user's snapshot.
+        """
+        path = self.snapshot_path(db, user_id).replace("'", "''")
+        if self._connection is None:
+            import duckdb
+
+            with self._lock:
+                if self._connection is None:
+                    # Connecting takes longer than most queries, so one
+                    # in-memory database serves every thread through cursors
+                    self._connection = duckdb.connect()
+        cursor = self._connection.cursor()
+        try:
+            sql = sql.format(payments=f"read_parquet('{path}')")
+            return cursor.execute(sql, params).fetchall()
+        finally:
+            cursor.close()
+
+
+def _date_filter(
+    start_date: Optional[datetime], end_date: Optional[datetime]
+) -> Tuple[str, list]:
+    # Inclusive by day, like the SQL and Python aggregations
+    conditions = []
+    params = []
+    if start_date:
+        conditions.append("date >= ?")
+        params.append(datetime.combine(start_date, time.min))
+    if end_date:
+        conditions.append("date < ?")
+        params.append(datetime.combine(end_date, time.min) + timedelta(days=1))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where, params
+
+
+def create_analytics(backend: str = ANALYTICS_BACKEND):
+    if backend == "sql":
+        return SqlAnalytics()
+    if backend == "duckdb":
+        return DuckDBAnalytics()
+    raise ValueError(f"Unknown analytics backend: {backend}")
+
+
+analytics = create_analytics()
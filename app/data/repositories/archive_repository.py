@@ -0,0 +1,219 @@
+import glob
+import os
+import threading
+from collections import namedtuple
+from datetime import date, datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, select
+from sqlalchemy.orm.attributes import flag_modified
+
+from app.data.base import Base
+from app.domain.models.payment import PaymentSource, PaymentType
+
+# Payments older than this many days are moved to the archive, in whole months
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+PAYMENT_ARCHIVE_DIR = os.getenv("PAYMENT_ARCHIVE_DIR", "payment_archive")
+
+ARCHIVE_COLUMNS = [
+    "id",
+    "date",
+    "amount_fen",
+    "currency",
+    "merchant",
+    "auto_category",
+    "source",
+    "type",
+    "note",
+    "category",
+    "transaction_id",
+    "fingerprint",
+    "change_version",
+]
+
+# Same attributes as the rows of get_payment_rows and iter_payment_batches
+ArchivedRow = namedtuple("ArchivedRow", ARCHIVE_COLUMNS)
+
+_write_lock = threading.Lock()
+
+
+class PaymentArchiveORM(Base):
+    """
+    Per user, payments dated before archived_before may be in the Parquet
+    archive instead of the payments table. Later imports of older payments
+    still go to the table until the next archive run.
+    """
+
+    __tablename__ = "payment_archives"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    archived_before = Column(DateTime, nullable=False)
+
+
+def get_archived_before(db, user_id: int) -> Optional[datetime]:
+    return db.scalar(
+        select(PaymentArchiveORM.archived_before).where(
+            PaymentArchiveORM.user_id == user_id
+        )
+    )
+
+
+def set_archived_before(db, user_id: int, archived_before: datetime) -> None:
+    """
+    Raise the user's watermark. The row is written even when the watermark
+    does not move, so the write takes its locks on every run.
+    """
+    entry = db.get(PaymentArchiveORM, user_id)
+    if entry is None:
+        db.add(PaymentArchiveORM(user_id=user_id, archived_before=archived_before))
+    else:
+        entry.archived_before = max(entry.archived_before, archived_before)
+        flag_modified(entry, "archived_before")
+
+
+def reaches_archive(
+    archived_before: Optional[datetime], start: Optional[datetime] = None
+) -> bool:
+    return archived_before is not None and (start is None or start < archived_before)
+
+
+def _user_dir(user_id: int) -> str:
+    return os.path.join(PAYMENT_ARCHIVE_DIR, f"user_{user_id}")
+
+
+def _partition_path(user_id: int, month: date) -> str:
+    return os.path.join(_user_dir(user_id), f"{month:%Y-%m}.parquet")
+
+
+def _partition_paths(
+    user_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None
+) -> List[str]:
+    """
+    Month partitions of the user that overlap the half-open range [start, end).
+    """
+    paths = []
+    for path in sorted(glob.glob(os.path.join(_user_dir(user_id), "*.parquet"))):
+        month = datetime.strptime(os.path.basename(path), "%Y-%m.parquet")
+        if start and month < datetime(start.year, start.month, 1):
+            continue
+        if end and month >= end:
+            continue
+        paths.append(path)
+    return paths
+
+
+def _schema():
+    import pyarrow as pa
+
+    text = pa.string()
+    return pa.schema(
+        [
+            ("id", pa.int64()),
+            ("date", pa.timestamp("us")),
+            ("amount_fen", pa.int64()),
+            ("currency", text),
+            ("merchant", text),
+            ("auto_category", text),
+            ("source", text),
+            ("type", text),
+            ("note", text),
+            ("category", text),
+            ("transaction_id", text),
+            ("fingerprint", text),
+            ("change_version", pa.int64()),
+        ]
+    )
+
+
+def iter_archived_partitions(
+    user_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None
+) -> Iterator[List[ArchivedRow]]:
+    """
+    Archived payments with start <= date < end, ordered by date and id, one
+    list per month partition. Only the partitions overlapping the range are
+    read, each one when the previous list has been consumed.
+    """
+    import pyarrow.parquet as pq
+
+    for path in _partition_paths(user_id, start, end):
+        rows = []
+        for record in pq.read_table(path).to_pylist():
+            if (start and record["date"] < start) or (end and record["date"] >= end):
+                continue
+            record["source"] = PaymentSource(record["source"])
+            record["type"] = PaymentType(record["type"])
+            rows.append(ArchivedRow(**record))
+        rows.sort(key=lambda row: (row.date, row.id))
+        if rows:
+            yield rows
+
+
+def read_archived_fingerprints(user_id: int, months: Iterable[date]) -> Set[str]:
+    import pyarrow.parquet as pq
+
+    fingerprints: Set[str] = set()
+    for month in set(months):
+        path = _partition_path(user_id, month)
+        if os.path.exists(path):
+            table = pq.read_table(path, columns=["fingerprint"])
+            fingerprints.update(table.column("fingerprint").to_pylist())
+    return fingerprints
+
+
+def read_archived_ids(user_id: int, ids: Iterable[int]) -> Set[int]:
+    """
+    The given payment ids that are in the user's archive.
+    """
+    import pyarrow.parquet as pq
+
+    wanted = set(ids)
+    found: Set[int] = set()
+    for path in _partition_paths(user_id):
+        table = pq.read_table(path, columns=["id"])
+        found.update(i for i in table.column("id").to_pylist() if i in wanted)
+    return found
+
+
+def write_archived_rows(user_id: int, rows: Iterable) -> int:
+    """
+    Add payment rows with the ARCHIVE_COLUMNS attributes to their month
+    partitions. A partition is rewritten under a temporary name and renamed,
+    rows whose fingerprint it already holds are skipped.
+    Returns the number of rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    by_month: Dict[date, list] = {}
+    for row in rows:
+        by_month.setdefault(row.date.date().replace(day=1), []).append(row)
+    schema = _schema()
+    written = 0
+    with _write_lock:
+        os.makedirs(_user_dir(user_id), exist_ok=True)
+        for month, month_rows in sorted(by_month.items()):
+            path = _partition_path(user_id, month)
+            existing = pq.read_table(path) if os.path.exists(path) else None
+            seen = (
+                set(existing.column("fingerprint").to_pylist()) if existing else set()
+            )
+            records = []
+            for row in month_rows:
+                if row.fingerprint in seen:
+                    continue
+                seen.add(row.fingerprint)
+                record = {name: getattr(row, name) for name in ARCHIVE_COLUMNS}
+                record["source"] = row.source.value
+                record["type"] = row.type.value
+                records.append(record)
+            if not records:
+                continue
+            table = pa.Table.from_pylist(records, schema=schema)
+            if existing is not None:
+                table = pa.concat_tables([existing, table])
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            pq.write_table(
+                table.sort_by([("date", "ascending")]), tmp_path, compression="zstd"
+            )
+            os.replace(tmp_path, path)
+            written += len(records)
+    return written
@@ -1,23 +1,67 @@
 # app/data/repository.py
 import json
-from typing import List
+import os
+import sqlite3
+from datetime import date, datetime, time, timedelta
+from typing import AbstractSet, Iterator, List, Optional, Tuple
 
-from sqlalchemy import Column, DateTime
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Date,
+    DateTime,
+)
 from sqlalchemy import Enum as SAEnum
-from sqlalchemy import Float, ForeignKey, Integer, String, Text
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import (
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    PrimaryKeyConstraint,
+    String,
+    Text,
+    bindparam,
+    case,
+    column,
+    delete,
+    func,
+    insert,
+    inspect,
+    literal,
+    or_,
+    select,
+    text,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 
-from app.data.base import Base, engine
+from app.data.base import Base, SessionLocal, get_engine, mark_written
+from app.data.instrumentation import record_rows_loaded
+from app.data.repositories import user_repository  # noqa: F401 (users FK target)
+from app.data.repositories.archive_repository import (
+    ARCHIVE_COLUMNS,
+    PaymentArchiveORM,
+    get_archived_before,
+    iter_archived_partitions,
+    reaches_archive,
+    read_archived_fingerprints,
+    read_archived_ids,
+    set_archived_before,
+    write_archived_rows,
+)
+from app.domain.helpers.fingerprint import compute_fingerprint, payment_fingerprint
+from app.domain.helpers.sum import get_signed_amount
 from app.domain.models.payment import Payment, PaymentSource, PaymentType
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
 
 class PaymentORM(Base):
     __tablename__ = "payments"
     id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     date = Column(DateTime, nullable=False)
-    amount = Column(Float, nullable=False)
+    amount_fen = Column(BigInteger, nullable=False)
     currency = Column(String, nullable=False)
     merchant = Column(String, nullable=False)
     auto_category = Column(String, default="Uncategorized")
@@ -25,8 +69,36 @@ class PaymentORM(Base):
     type = Column(SAEnum(PaymentType), nullable=False)
     note = Column(String, default="")
     category = Column(String, default="")
+    transaction_id = Column(String, default="")
+    fingerprint = Column(String(64), nullable=False)
+    # data_version of the last write that inserted or changed this row
+    change_version = Column(BigInteger, nullable=False, default=0)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
 
+    __table_args__ = (
+        Index("ix_payments_user_fingerprint", "user_id", "fingerprint", unique=True),
+        Index("ix_payments_user_change_version", "user_id", "change_version"),
+        Index("ix_payments_user_date_id", "user_id", "date", "id"),
+        # Archived and deleted ids must never be handed out again
+        {"sqlite_autoincrement": True},
+    )
+
+
+class PaymentTombstoneORM(Base):
+    """
+    Remembers deleted payment ids so the change feed can report deletions.
+    """
+
+    __tablename__ = "payment_tombstones"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    payment_id = Column(Integer, nullable=False)
+    change_version = Column(BigInteger, nullable=False)
+
+    __table_args__ = (
+        Index("ix_payment_tombstones_user_change_version", "user_id", "change_version"),
+    )
+
 
 class CategoryTreeORM(Base):
     __tablename__ = "category_trees"
@@ -35,15 +107,294 @@ class CategoryTreeORM(Base):
     tree_json = Column(Text, nullable=False)
 
 
+class DataVersionORM(Base):
+    """
+    Per-user counters that only ever increase. data_version is bumped by every
+    payment write, tree_version by every category tree write.
+    """
+
+    __tablename__ = "data_versions"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    data_version = Column(BigInteger, nullable=False, default=0)
+    tree_version = Column(BigInteger, nullable=False, default=0)
+
+
+class PaymentMonthlySummaryORM(Base):
+    """
+    Sum and count of payment amounts per user, month, category, source and
+    type, kept up to date by every payment write.
+    """
+
+    __tablename__ = "payment_monthly_summary"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    month = Column(Date, primary_key=True)
+    category = Column(String, primary_key=True)
+    source = Column(SAEnum(PaymentSource), primary_key=True)
+    type = Column(SAEnum(PaymentType), primary_key=True)
+    amount_fen = Column(BigInteger, nullable=False, default=0)
+    payment_count = Column(Integer, nullable=False, default=0)
+
+
+class ImportedFileORM(Base):
+    """
+    One row per imported statement file. The content hash rejects identical
+    re-uploads, the date span marks which rows of the source are stored.
+    """
+
+    __tablename__ = "imported_files"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    source = Column(SAEnum(PaymentSource), nullable=False)
+    content_hash = Column(String(64), nullable=False)
+    filename = Column(String, default="")
+    first_date = Column(DateTime)
+    last_date = Column(DateTime)
+    row_count = Column(Integer, nullable=False, default=0)
+    inserted_count = Column(Integer, nullable=False, default=0)
+    imported_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_imported_files_user_hash", "user_id", "content_hash", unique=True),
+        Index("ix_imported_files_user_source", "user_id", "source"),
+    )
+
+
+# Postgres only: "hash" partitions payments by user_id, "range" by year of
+# date. Applies when setup creates the payments table, an existing
+# unpartitioned table is left as it is.
+PAYMENTS_PARTITIONING = os.getenv("PAYMENTS_PARTITIONING", "none").lower()
+PAYMENTS_HASH_PARTITIONS = int(os.getenv("PAYMENTS_HASH_PARTITIONS", "16"))
+PAYMENTS_FIRST_YEAR = int(os.getenv("PAYMENTS_FIRST_YEAR", "2010"))
+PARTITION_KEYS = {"hash": "user_id", "range": "date"}
+
+
 def create_payment_tables():
+    engine = get_engine()
+    summary_exists = inspect(engine).has_table(PaymentMonthlySummaryORM.__tablename__)
+    if engine.dialect.name == "postgresql" and PAYMENTS_PARTITIONING != "none":
+        _create_partitioned_payments(engine, PAYMENTS_PARTITIONING)
     Base.metadata.create_all(bind=engine)
+    _migrate_payments_table()
+    _create_search_index()
+    if not summary_exists:
+        db = SessionLocal()
+        try:
+            rebuild_monthly_summary(db)
+        finally:
+            db.close()
+
+
+def _create_partitioned_payments(engine, partitioning: str) -> None:
+    """
+    Create payments as a declaratively partitioned table if it does not exist
+    yet, and add missing partitions to a partitioned one. Postgres requires
+    the partition key in the primary key and in every unique index, which
+    does not change uniqueness: the fingerprint already covers the date, and
+    ids come from one sequence.
+    """
+    if partitioning not in PARTITION_KEYS:
+        raise ValueError(f"Unknown payments partitioning: {partitioning}")
+    key = PARTITION_KEYS[partitioning]
+    with engine.begin() as conn:
+        if not inspect(conn).has_table("payments"):
+            metadata = MetaData()
+            Base.metadata.tables["users"].to_metadata(metadata)
+            table = PaymentORM.__table__.to_metadata(metadata)
+            table.c[key].primary_key = True
+            table.append_constraint(PrimaryKeyConstraint(table.c.id, table.c[key]))
+            for index in list(table.indexes):
+                if index.unique and key not in index.columns:
+                    table.indexes.discard(index)
+                    Index(index.name, *index.columns, table.c[key], unique=True)
+            table.dialect_kwargs["postgresql_partition_by"] = (
+                f"{partitioning.upper()} ({key})"
+            )
+            table.create(conn, checkfirst=True)
+        partitioned = conn.scalar(
+            text(
+                "SELECT 1 FROM pg_partitioned_table"
+                " WHERE partrelid = 'payments'::regclass"
+            )
+        )
+        if partitioned:
+            _create_payment_partitions(conn, partitioning)
+
+
+def _create_payment_partitions(conn, partitioning: str) -> None:
+    """
+    Hash partitions payments_p0 .. payments_p{n-1}, or one range partition per
+    year from PAYMENTS_FIRST_YEAR to next year plus payments_default for
+    dates outside them. Running setup again adds the new years.
+    """
+    if partitioning == "hash":
+        for remainder in range(PAYMENTS_HASH_PARTITIONS):
+            conn.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS payments_p{remainder}"
+                    " PARTITION OF payments FOR VALUES WITH"
+                    f" (MODULUS {PAYMENTS_HASH_PARTITIONS}, REMAINDER {remainder})"
+                )
+            )
+        return
+    conn.execute(
+        text(
+            "CREATE TABLE IF NOT EXISTS payments_default PARTITION OF payments DEFAULT"
+        )
+    )
+    for year in range(PAYMENTS_FIRST_YEAR, datetime.now().year + 2):
+        name = f"payments_y{year}"
+        start, end = date(year, 1, 1), date(year + 1, 1, 1)
+        if inspect(conn).has_table(name):
+            continue
+        # Postgres refuses a partition whose range has rows in the default one
+        if conn.scalar(
+            text(
+                "SELECT 1 FROM payments_default"
+                " WHERE date >= :start AND date < :end LIMIT 1"
+            ),
+            {"start": start, "end": end},
+        ):
+            continue
+        conn.execute(
+            text(
+                f"CREATE TABLE {name} PARTITION OF payments"
+                f" FOR VALUES FROM ('{start}') TO ('{end}')"
+            )
+        )
+
+
+def _migrate_payments_table():
+    """
+    Bring a payments table created by an older version up to date:
+    float amounts become integer fen, and the transaction_id and fingerprint
+    columns are added and backfilled before the unique index is created.
+    """
+    engine = get_engine()
+    columns = {c["name"] for c in inspect(engine).get_columns("payments")}
+    table = PaymentORM.__table__
+    with engine.begin() as conn:
+        if "amount_fen" not in columns:
+            conn.execute(text("ALTER TABLE payments ADD COLUMN amount_fen BIGINT"))
+            conn.execute(
+                text(
+                    "UPDATE payments"
+                    " SET amount_fen = CAST(ROUND(amount * 100) AS BIGINT)"
+                )
+            )
+            conn.execute(text("ALTER TABLE payments DROP COLUMN amount"))
+        if "transaction_id" not in columns:
+            conn.execute(
+                text(
+                    "ALTER TABLE payments ADD COLUMN transaction_id VARCHAR DEFAULT ''"
+                )
+            )
+        if "fingerprint" not in columns:
+            conn.execute(
+                text("ALTER TABLE payments ADD COLUMN fingerprint VARCHAR(64)")
+            )
+            _backfill_fingerprints(conn)
+        if "change_version" not in columns:
+            conn.execute(
+                text(
+                    "ALTER TABLE payments"
+                    " ADD COLUMN change_version BIGINT NOT NULL DEFAULT 0"
+                )
+            )
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+SQLITE_SEARCH_DDL = [
+    # External content FTS5 table over payments, kept in sync by triggers.
+    # The trigram tokenizer matches substrings, which also works for Chinese.
+    "CREATE VIRTUAL TABLE payments_fts USING fts5("
+    "merchant, note, content='payments', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER payments_fts_ai AFTER INSERT ON payments BEGIN"
+    " INSERT INTO payments_fts(rowid, merchant, note)"
+    " VALUES (new.id, new.merchant, new.note); END",
+    "CREATE TRIGGER payments_fts_ad AFTER DELETE ON payments BEGIN"
+    " INSERT INTO payments_fts(payments_fts, rowid, merchant, note)"
+    " VALUES ('delete', old.id, old.merchant, old.note); END",
+    "CREATE TRIGGER payments_fts_au AFTER UPDATE OF merchant, note ON payments BEGIN"
+    " INSERT INTO payments_fts(payments_fts, rowid, merchant, note)"
+    " VALUES ('delete', old.id, old.merchant, old.note);"
+    " INSERT INTO payments_fts(rowid, merchant, note)"
+    " VALUES (new.id, new.merchant, new.note); END",
+    "INSERT INTO payments_fts(payments_fts) VALUES ('rebuild')",
+]
+
+# The FTS5 trigram tokenizer needs SQLite 3.34, older versions search with LIKE
+SQLITE_HAS_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34, 0)
+
+POSTGRES_SEARCH_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_payments_merchant_trgm"
+    " ON payments USING gin (merchant gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_payments_note_trgm"
+    " ON payments USING gin (note gin_trgm_ops)",
+]
+
+
+def _create_search_index():
+    """
+    Create the substring search index over merchant and note: pg_trgm GIN
+    indexes on Postgres, an FTS5 trigram table on SQLite.
+    """
+    engine = get_engine()
+    dialect = engine.dialect.name
+    with engine.begin() as conn:
+        if dialect == "postgresql":
+            for statement in POSTGRES_SEARCH_DDL:
+                conn.execute(text(statement))
+        elif (
+            dialect == "sqlite"
+            and SQLITE_HAS_TRIGRAM
+            and not inspect(conn).has_table("payments_fts")
+        ):
+            for statement in SQLITE_SEARCH_DDL:
+                conn.execute(text(statement))
+
+
+def _backfill_fingerprints(conn):
+    table = PaymentORM.__table__
+    rows = conn.execute(
+        select(
+            table.c.id,
+            table.c.user_id,
+            table.c.date,
+            table.c.amount_fen,
+            table.c.merchant,
+            table.c.source,
+            table.c.transaction_id,
+        )
+    ).all()
+    seen = set()
+    params = []
+    for row in rows:
+        fingerprint = compute_fingerprint(
+            row.date, row.amount_fen, row.merchant, row.source, row.transaction_id
+        )
+        # Rows that only differed below one fen must stay distinct
+        if (row.user_id, fingerprint) in seen:
+            fingerprint = compute_fingerprint(
+                row.date, row.amount_fen, row.merchant, row.source, f"legacy-{row.id}"
+            )
+        seen.add((row.user_id, fingerprint))
+        params.append({"row_id": row.id, "fp": fingerprint})
+    if params:
+        conn.execute(
+            update(table)
+            .where(table.c.id == bindparam("row_id"))
+            .values(fingerprint=bindparam("fp")),
+            params,
+        )
 
 
 def payment_to_domain(payment_orm: PaymentORM) -> Payment:
     return Payment(
         id=payment_orm.id,
         date=payment_orm.date,
-        amount=payment_orm.amount,
+        amount_fen=payment_orm.amount_fen,
         currency=payment_orm.currency,
         merchant=payment_orm.merchant,
         auto_category=payment_orm.auto_category,
@@ -51,85 +402,775 @@ def payment_to_domain(payment_orm: PaymentORM) -> Payment:
         type=payment_orm.type,
         note=payment_orm.note,
         category=payment_orm.category,
+        transaction_id=payment_orm.transaction_id or "",
         user_id=payment_orm.user_id,
     )
 
 
-def get_all_payments(db, user_id: int) -> List[Payment]:
+def get_data_versions(db, user_id: int) -> Tuple[int, int]:
+    row = db.get(DataVersionORM, user_id)
+    if row is None:
+        return 0, 0
+    return row.data_version, row.tree_version
+
+
+def _dialect_insert(db):
+    """
+    The insert() of the session's dialect, which supports ON CONFLICT.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql_insert
+    if dialect == "sqlite":
+        return sqlite_insert
+    raise RuntimeError(f"Upserts are not supported on {dialect}")
+
+
+def _bump_version(db, user_id: int, tree: bool = False) -> int:
+    """
+    Increment a version counter inside the caller's transaction, so it is
+    committed together with the write it describes. One upsert, so concurrent
+    first writes of a user cannot collide. Returns the new version.
+    """
+    mark_written(db, user_id)
+    column = DataVersionORM.tree_version if tree else DataVersionORM.data_version
+    stmt = _dialect_insert(db)(DataVersionORM).values(
+        user_id=user_id, data_version=0 if tree else 1, tree_version=int(tree)
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id"], set_={column.key: column + 1}
+    ).returning(column)
+    return db.execute(stmt).scalar_one()
+
+
+def archived_to_domain(row, user_id: int) -> Payment:
+    return Payment(
+        id=row.id,
+        date=row.date,
+        amount_fen=row.amount_fen,
+        currency=row.currency,
+        merchant=row.merchant,
+        auto_category=row.auto_category,
+        source=row.source,
+        type=row.type,
+        note=row.note,
+        category=row.category,
+        transaction_id=row.transaction_id or "",
+        user_id=user_id,
+    )
+
+
+def get_all_payments(db, user_id: int, include_archive: bool = True) -> List[Payment]:
+    """
+    The user's payments, including archived ones unless include_archive is
+    False. Archived payments are read-only.
+    """
     payments = db.query(PaymentORM).filter(PaymentORM.user_id == user_id).all()
-    return [payment_to_domain(p) for p in payments]
+    record_rows_loaded(len(payments))
+    result = [payment_to_domain(p) for p in payments]
+    if include_archive:
+        result += [
+            archived_to_domain(row, user_id) for row in get_archived_rows(db, user_id)
+        ]
+    return result
 
 
-def upsert_payments(db, payments: List[Payment], user_id: int) -> int:
-    count = 0
-    for p in payments:
-        exists = (
-            db.query(PaymentORM)
-            .filter_by(
-                date=p.date, amount=p.amount, merchant=p.merchant, user_id=user_id
-            )
-            .first()
-        )
-        if not exists:
-            db.add(
-                PaymentORM(
-                    date=p.date,
-                    amount=p.amount,
-                    currency=p.currency,
-                    merchant=p.merchant,
-                    auto_category=p.auto_category,
-                    source=p.source,
-                    type=p.type,
-                    note=p.note,
-                    category=p.category,
-                    user_id=user_id,
-                )
+def get_payment_rows(db, user_id: int) -> List[tuple]:
+    """
+    Return the user's payments as plain column tuples, skipping ORM and domain
+    object construction for read-only listings.
+    """
+    rows = db.execute(_payment_rows_query(user_id)).all()
+    record_rows_loaded(len(rows))
+    return rows + get_archived_rows(db, user_id)
+
+
+def get_archived_rows(
+    db, user_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None
+) -> list:
+    """
+    Archived payments with start <= date < end, read only if the user has an
+    archive that the range reaches.
+    """
+    return [
+        row for rows in iter_archived_batches(db, user_id, start, end) for row in rows
+    ]
+
+
+def iter_archived_batches(
+    db, user_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None
+) -> Iterator[list]:
+    """
+    Same rows as get_archived_rows, one list per month partition of the
+    archive. An archive run writes its partitions before it commits, and a
+    failed run leaves them behind: rows past the committed watermark, or still
+    in the payments table, are left out, so no payment is read twice.
+    """
+    archived_before = get_archived_before(db, user_id)
+    if not reaches_archive(archived_before, start):
+        return
+    end = archived_before if end is None else min(end, archived_before)
+    # Only payments imported after the last run, usually none
+    query = select(PaymentORM.fingerprint).where(
+        PaymentORM.user_id == user_id, PaymentORM.date < end
+    )
+    if start:
+        query = query.where(PaymentORM.date >= start)
+    in_table = set(db.scalars(query))
+    for rows in iter_archived_partitions(user_id, start, end):
+        rows = [row for row in rows if row.fingerprint not in in_table]
+        record_rows_loaded(len(rows))
+        if rows:
+            yield rows
+
+
+def _payment_rows_query(user_id: int):
+    return select(
+        PaymentORM.id,
+        PaymentORM.date,
+        PaymentORM.amount_fen,
+        PaymentORM.currency,
+        PaymentORM.merchant,
+        PaymentORM.auto_category,
+        PaymentORM.source,
+        PaymentORM.type,
+        PaymentORM.note,
+        PaymentORM.category,
+    ).where(PaymentORM.user_id == user_id)
+
+
+def iter_payment_batches(db, user_id: int, batch_size: int) -> Iterator[List[tuple]]:
+    """
+    Yield the user's payments by date in lists of at most batch_size column
+    tuples, read through a server-side cursor where the driver has one.
+    Archived payments come first.
+    """
+    for archived in iter_archived_batches(db, user_id):
+        for start in range(0, len(archived), batch_size):
+            yield archived[start : start + batch_size]
+    result = db.execute(
+        _payment_rows_query(user_id)
+        .add_columns(PaymentORM.transaction_id)
+        .order_by(PaymentORM.date, PaymentORM.id)
+        .execution_options(stream_results=True, yield_per=batch_size)
+    )
+    for batch in result.partitions():
+        record_rows_loaded(len(batch))
+        yield batch
+
+
+def get_payment_changes(
+    db, user_id: int, since: int, until: int
+) -> Tuple[List[tuple], List[int]]:
+    """
+    Return the rows inserted or changed and the ids deleted by writes with a
+    data version in (since, until], using the change_version indexes.
+    """
+    changed = db.execute(
+        _payment_rows_query(user_id).where(
+            PaymentORM.change_version > since, PaymentORM.change_version <= until
+        )
+    ).all()
+    deleted = db.scalars(
+        select(PaymentTombstoneORM.payment_id).where(
+            PaymentTombstoneORM.user_id == user_id,
+            PaymentTombstoneORM.change_version > since,
+            PaymentTombstoneORM.change_version <= until,
+        )
+    ).all()
+    record_rows_loaded(len(changed) + len(deleted))
+    return changed, list(deleted)
+
+
+SERIES_PERIODS = ("day", "week", "month", "year")
+
+
+def _signed_fen(model):
+    """
+    SQL version of get_signed_amount for a model with type and amount_fen.
+    """
+    return case(
+        (model.type == PaymentType.EXPENSE, -model.amount_fen),
+        (
+            model.type.in_([PaymentType.INCOME, PaymentType.REFUND]),
+            model.amount_fen,
+        ),
+        else_=0,
+    )
+
+
+def _period_start(db, period: str):
+    """
+    SQL expression for the first day of the period containing the payment
+    date, as a YYYY-MM-DD string.
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        if period == "day":
+            return func.date(PaymentORM.date)
+        if period == "week":
+            # Monday on or before the date
+            return func.date(PaymentORM.date, "-6 days", "weekday 1")
+        if period == "month":
+            return func.strftime("%Y-%m-01", PaymentORM.date)
+        return func.strftime("%Y-01-01", PaymentORM.date)
+    return func.to_char(func.date_trunc(period, PaymentORM.date), "YYYY-MM-DD")
+
+
+def sum_payments_by_period(
+    db,
+    user_id: int,
+    period: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    split_by: Optional[str] = None,
+) -> List[tuple]:
+    """
+    Signed sums in fen grouped in the database by period start and optionally
+    by category or source. Returns (period_start, group, signed_fen) rows.
+    Dates are filtered inclusively by day, like the Python aggregations.
+    """
+    if period not in SERIES_PERIODS:
+        raise ValueError(f"Invalid period: {period}")
+    bucket = _period_start(db, period).label("bucket")
+    signed = _signed_fen(PaymentORM)
+    if split_by == "category":
+        group = PaymentORM.category
+    elif split_by == "source":
+        group = PaymentORM.source
+    elif split_by is None:
+        group = literal(None)
+    else:
+        raise ValueError(f"Invalid split: {split_by}")
+    query = select(bucket, group.label("group"), func.sum(signed)).where(
+        PaymentORM.user_id == user_id
+    )
+    if start_date:
+        query = query.where(PaymentORM.date >= datetime.combine(start_date, time.min))
+    if end_date:
+        query = query.where(
+            PaymentORM.date < datetime.combine(end_date, time.min) + timedelta(days=1)
+        )
+    query = query.group_by(bucket, group) if split_by else query.group_by(bucket)
+    totals = {(b, g): int(total or 0) for b, g, total in db.execute(query)}
+
+    start_dt = datetime.combine(start_date, time.min) if start_date else None
+    end_dt = (
+        datetime.combine(end_date, time.min) + timedelta(days=1) if end_date else None
+    )
+    for row in get_archived_rows(db, user_id, start_dt, end_dt):
+        key = (_bucket(row.date, period), getattr(row, split_by) if split_by else None)
+        totals[key] = totals.get(key, 0) + get_signed_amount(row)
+    return [(b, g, total) for (b, g), total in totals.items()]
+
+
+def _bucket(day: datetime, period: str) -> str:
+    """
+    Python version of _period_start.
+    """
+    if period == "day":
+        return day.date().isoformat()
+    if period == "week":
+        return (day.date() - timedelta(days=day.weekday())).isoformat()
+    if period == "month":
+        return f"{day:%Y-%m}-01"
+    return f"{day:%Y}-01-01"
+
+
+def _split_range(
+    start_date: Optional[datetime], end_date: Optional[datetime]
+) -> Tuple[Optional[Tuple[Optional[date], Optional[date]]], List[tuple]]:
+    """
+    Split an inclusive day range into the whole months it covers, as a
+    half-open (first_month, end_month) pair or None, and the half-open
+    datetime ranges of the partial months at its edges. None means unbounded.
+    """
+    sd = start_date.date() if start_date else None
+    ed = end_date.date() if end_date else None
+    first_month = sd
+    if sd and sd.day != 1:
+        first_month = _next_month(sd)
+    end_month = ed
+    if ed:
+        # The month of the end date only counts as whole on its last day
+        last_day = _next_month(ed) - timedelta(days=1)
+        end_month = _next_month(ed) if ed == last_day else ed.replace(day=1)
+    start_dt = datetime.combine(sd, time.min) if sd else None
+    end_dt = datetime.combine(ed + timedelta(days=1), time.min) if ed else None
+
+    if first_month and end_month and first_month >= end_month:
+        return None, [(start_dt, end_dt)]
+    edges = []
+    if sd and sd < first_month:
+        edges.append((start_dt, datetime.combine(first_month, time.min)))
+    if ed and end_month <= ed:
+        edges.append((datetime.combine(end_month, time.min), end_dt))
+    return (first_month, end_month), edges
+
+
+def _next_month(day: date) -> date:
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def get_category_sums(
+    db,
+    user_id: int,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+) -> List[Tuple[str, int]]:
+    """
+    Signed sums in fen per category for an inclusive day range. Whole months
+    are read from the monthly summary, only partial months from payments and
+    the archive.
+    """
+    months, edges = _split_range(start_date, end_date)
+    totals: dict = {}
+    queries = []
+    if months is not None:
+        summary = PaymentMonthlySummaryORM
+        query = select(summary.category, func.sum(_signed_fen(summary))).where(
+            summary.user_id == user_id
+        )
+        if months[0]:
+            query = query.where(summary.month >= months[0])
+        if months[1]:
+            query = query.where(summary.month < months[1])
+        queries.append(query.group_by(summary.category))
+    for edge_start, edge_end in edges:
+        query = select(PaymentORM.category, func.sum(_signed_fen(PaymentORM))).where(
+            PaymentORM.user_id == user_id
+        )
+        if edge_start:
+            query = query.where(PaymentORM.date >= edge_start)
+        if edge_end:
+            query = query.where(PaymentORM.date < edge_end)
+        queries.append(query.group_by(PaymentORM.category))
+    for query in queries:
+        for category, total in db.execute(query):
+            totals[category or ""] = totals.get(category or "", 0) + int(total or 0)
+    for edge_start, edge_end in edges:
+        for row in get_archived_rows(db, user_id, edge_start, edge_end):
+            category = row.category or ""
+            totals[category] = totals.get(category, 0) + get_signed_amount(row)
+    return list(totals.items())
+
+
+def sum_signed_in_range(
+    db,
+    user_id: int,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+) -> int:
+    return sum(
+        total for _, total in get_category_sums(db, user_id, start_date, end_date)
+    )
+
+
+def _add_to_summary(
+    db, user_id: int, rows, sign: int = 1, category: Optional[str] = None
+) -> None:
+    """
+    Add (sign=1) or remove (sign=-1) payments given as objects or rows with
+    date, category, source, type and amount_fen from the monthly summary.
+    If category is given, it replaces the category of every row.
+    """
+    deltas: dict = {}
+    for row in rows:
+        row_category = row.category if category is None else category
+        key = (row.date.date().replace(day=1), row_category or "", row.source, row.type)
+        amount, count = deltas.get(key, (0, 0))
+        deltas[key] = (amount + sign * row.amount_fen, count + sign)
+    if not deltas:
+        return
+    stmt = _dialect_insert(db)(PaymentMonthlySummaryORM)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "month", "category", "source", "type"],
+        set_={
+            "amount_fen": PaymentMonthlySummaryORM.amount_fen
+            + stmt.excluded.amount_fen,
+            "payment_count": PaymentMonthlySummaryORM.payment_count
+            + stmt.excluded.payment_count,
+        },
+    )
+    db.execute(
+        stmt,
+        [
+            {
+                "user_id": user_id,
+                "month": month,
+                "category": category,
+                "source": source,
+                "type": type,
+                "amount_fen": amount,
+                "payment_count": count,
+            }
+            for (month, category, source, type), (amount, count) in deltas.items()
+        ],
+    )
+    if sign < 0:
+        db.execute(
+            delete(PaymentMonthlySummaryORM).where(
+                PaymentMonthlySummaryORM.user_id == user_id,
+                PaymentMonthlySummaryORM.payment_count <= 0,
             )
-            count += 1
+        )
+
+
+def rebuild_monthly_summary(db, user_id: Optional[int] = None) -> int:
+    """
+    Recompute the monthly summary from the payments table and the archive,
+    for one user or for everyone. Returns the number of summary rows written.
+    """
+    month = _period_start(db, "month")
+    query = select(
+        PaymentORM.user_id,
+        month,
+        func.coalesce(PaymentORM.category, ""),
+        PaymentORM.source,
+        PaymentORM.type,
+        func.sum(PaymentORM.amount_fen),
+        func.count(),
+    ).group_by(
+        PaymentORM.user_id,
+        month,
+        func.coalesce(PaymentORM.category, ""),
+        PaymentORM.source,
+        PaymentORM.type,
+    )
+    clear = delete(PaymentMonthlySummaryORM)
+    if user_id is not None:
+        query = query.where(PaymentORM.user_id == user_id)
+        clear = clear.where(PaymentMonthlySummaryORM.user_id == user_id)
+    totals = {
+        (row[0], date.fromisoformat(row[1]), row[2], row[3], row[4]): [
+            int(row[5]),
+            row[6],
+        ]
+        for row in db.execute(query)
+    }
+    # Archived payments stay counted
+    archive_users = select(PaymentArchiveORM.user_id)
+    if user_id is not None:
+        archive_users = archive_users.where(PaymentArchiveORM.user_id == user_id)
+    for archive_user_id in db.scalars(archive_users):
+        for row in get_archived_rows(db, archive_user_id):
+            key = (
+                archive_user_id,
+                row.date.date().replace(day=1),
+                row.category or "",
+                row.source,
+                row.type,
+            )
+            total = totals.setdefault(key, [0, 0])
+            total[0] += row.amount_fen
+            total[1] += 1
+    rows = [
+        {
+            "user_id": key[0],
+            "month": key[1],
+            "category": key[2],
+            "source": key[3],
+            "type": key[4],
+            "amount_fen": amount_fen,
+            "payment_count": payment_count,
+        }
+        for key, (amount_fen, payment_count) in totals.items()
+    ]
+    db.execute(clear)
+    if rows:
+        db.execute(insert(PaymentMonthlySummaryORM), rows)
     db.commit()
-    return count
+    return len(rows)
+
+
+# Trigram indexes cannot serve shorter search terms
+MIN_INDEXED_SEARCH_LENGTH = 3
+
+
+def _search_condition(db, search: str):
+    if (
+        db.get_bind().dialect.name == "sqlite"
+        and SQLITE_HAS_TRIGRAM
+        and len(search) >= MIN_INDEXED_SEARCH_LENGTH
+    ):
+        phrase = '"' + search.replace('"', '""') + '"'
+        matches = text(
+            "SELECT rowid FROM payments_fts WHERE payments_fts MATCH :phrase"
+        ).bindparams(phrase=phrase)
+        return PaymentORM.id.in_(matches.columns(column("rowid", Integer)))
+    escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    pattern = f"%{escaped}%"
+    return or_(
+        PaymentORM.merchant.ilike(pattern, escape="\\"),
+        PaymentORM.note.ilike(pattern, escape="\\"),
+    )
+
+
+def search_payments(
+    db,
+    user_id: int,
+    search: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    categories: Optional[List[str]] = None,
+    limit: int = 50,
+    after: Optional[Tuple[datetime, int]] = None,
+) -> List[tuple]:
+    """
+    Payments whose merchant or note contains the search text, newest first.
+    Pages are fetched by keyset: pass the (date, id) of the last row seen as
+    after. Dates are filtered inclusively by day. Archived payments are
+    searched once a page reaches back to the archive.
+    """
+    start_dt = datetime.combine(start_date, time.min) if start_date else None
+    end_dt = (
+        datetime.combine(end_date, time.min) + timedelta(days=1) if end_date else None
+    )
+    query = _payment_rows_query(user_id).where(_search_condition(db, search))
+    if start_dt:
+        query = query.where(PaymentORM.date >= start_dt)
+    if end_dt:
+        query = query.where(PaymentORM.date < end_dt)
+    if categories is not None:
+        query = query.where(PaymentORM.category.in_(categories))
+    if after is not None:
+        query = query.where(tuple_(PaymentORM.date, PaymentORM.id) < tuple_(*after))
+    query = query.order_by(PaymentORM.date.desc(), PaymentORM.id.desc()).limit(limit)
+    rows = db.execute(query).all()
+    record_rows_loaded(len(rows))
+
+    archived_before = get_archived_before(db, user_id)
+    # A full page ending after the archive cannot contain archived payments
+    if not reaches_archive(archived_before, start_dt) or (
+        len(rows) == limit and rows[-1].date >= archived_before
+    ):
+        return rows
+    if after is not None:
+        # Rows of the last seen second are filtered by id below
+        page_end = after[0] + timedelta(microseconds=1)
+        end_dt = min(end_dt, page_end) if end_dt else page_end
+    text = search.lower()
+    matches = [
+        row
+        for row in get_archived_rows(db, user_id, start_dt, end_dt)
+        if (text in row.merchant.lower() or text in (row.note or "").lower())
+        and (categories is None or row.category in categories)
+        and (after is None or (row.date, row.id) < after)
+    ]
+    rows = rows + matches
+    rows.sort(key=lambda row: (row.date, row.id), reverse=True)
+    return rows[:limit]
+
+
+def upsert_payments(db, payments: List[Payment], user_id: int) -> int:
+    inserted, _ = insert_new_payments(db, payments, user_id)
+    return len(inserted)
+
+
+def get_stored_fingerprints(db, user_id: int, fingerprints) -> set:
+    """
+    The given fingerprints that the payments table holds for the user.
+    """
+    fingerprints = set(fingerprints)
+    if not fingerprints:
+        return set()
+    return set(
+        db.scalars(
+            select(PaymentORM.fingerprint).where(
+                PaymentORM.user_id == user_id,
+                PaymentORM.fingerprint.in_(fingerprints),
+            )
+        )
+    )
+
+
+def insert_new_payments(
+    db,
+    payments: List[Payment],
+    user_id: int,
+    commit: bool = True,
+    checked: AbstractSet[str] = frozenset(),
+) -> Tuple[List[Payment], List[int]]:
+    """
+    Insert all payments whose fingerprint is not stored yet for the user with
+    one indexed lookup of the fingerprints and one INSERT ... RETURNING.
+    Fingerprints in checked were already looked up by the caller and found
+    missing, so they are not looked up again.
+    A payment with a transaction id also matches the same payment stored
+    without one, which then takes over the id. With commit=False the caller
+    commits, e.g. together with the import record.
+    Returns the inserted payments and the indexes of the skipped duplicates.
+    """
+    if not payments:
+        return [], []
+    fingerprints = [payment_fingerprint(p) for p in payments]
+    existing = get_stored_fingerprints(
+        db, user_id, [f for f in fingerprints if f not in checked]
+    )
+    archived_before = get_archived_before(db, user_id)
+    if archived_before is not None:
+        archived_months = [
+            p.date.date().replace(day=1) for p in payments if p.date < archived_before
+        ]
+        existing |= read_archived_fingerprints(user_id, archived_months)
+    legacy_keys = {
+        i: compute_fingerprint(p.date, p.amount_fen, p.merchant, p.source)
+        for i, (p, fingerprint) in enumerate(zip(payments, fingerprints))
+        if p.transaction_id and fingerprint not in existing
+    }
+    legacy_ids = _find_rows_without_transaction_id(db, user_id, legacy_keys.values())
+
+    rows = []
+    duplicates = []
+    adopted = []
+    for i, (p, fingerprint) in enumerate(zip(payments, fingerprints)):
+        if fingerprint in existing:
+            duplicates.append(i)
+            continue
+        existing.add(fingerprint)
+        if legacy_keys.get(i) in legacy_ids:
+            # The same payment stored before it had a transaction id: take
+            # over the id and fingerprint, so later imports match it exactly
+            row_id = legacy_ids.pop(legacy_keys[i])
+            adopted.append(
+                {"row_id": row_id, "tid": p.transaction_id, "fp": fingerprint}
+            )
+            duplicates.append(i)
+            continue
+        rows.append(_payment_row(p, fingerprint, user_id))
+
+    if adopted:
+        table = PaymentORM.__table__
+        db.execute(
+            update(table)
+            .where(table.c.id == bindparam("row_id"), table.c.user_id == user_id)
+            .values(transaction_id=bindparam("tid"), fingerprint=bindparam("fp")),
+            adopted,
+        )
+
+    inserted: List[Payment] = []
+    if rows:
+        version = _bump_version(db, user_id)
+        for row in rows:
+            row["change_version"] = version
+        result = db.scalars(
+            insert(PaymentORM).returning(PaymentORM, sort_by_parameter_order=True),
+            rows,
+        )
+        # Convert before commit, which would expire every returned row
+        inserted = [payment_to_domain(p) for p in result]
+        _add_to_summary(db, user_id, inserted)
+    if commit:
+        db.commit()
+    return inserted, duplicates
+
+
+def _find_rows_without_transaction_id(db, user_id: int, fingerprints) -> dict:
+    """
+    Fingerprint -> id of the user's payments stored without a transaction id
+    (e.g. migrated from before fingerprints) among the given fingerprints.
+    """
+    fingerprints = set(fingerprints)
+    if not fingerprints:
+        return {}
+    return {
+        fingerprint: row_id
+        for row_id, fingerprint in db.execute(
+            select(PaymentORM.id, PaymentORM.fingerprint).where(
+                PaymentORM.user_id == user_id,
+                PaymentORM.fingerprint.in_(fingerprints),
+                or_(
+                    PaymentORM.transaction_id == "", PaymentORM.transaction_id.is_(None)
+                ),
+            )
+        )
+    }
+
+
+def _payment_row(payment: Payment, fingerprint: str, user_id: int) -> dict:
+    return {
+        "date": payment.date,
+        "amount_fen": payment.amount_fen,
+        "currency": payment.currency,
+        "merchant": payment.merchant,
+        "auto_category": payment.auto_category,
+        "source": payment.source,
+        "type": payment.type,
+        "note": payment.note,
+        "category": payment.category,
+        "transaction_id": payment.transaction_id,
+        "fingerprint": fingerprint,
+        "user_id": user_id,
+    }
 
 
 def add_payment(db, payment: Payment, user_id: int) -> Payment:
+    fingerprint = payment_fingerprint(payment)
     exists = (
-        db.query(PaymentORM)
-        .filter_by(
-            date=payment.date,
-            amount=payment.amount,
-            merchant=payment.merchant,
-            user_id=user_id,
-        )
+        db.query(PaymentORM.id)
+        .filter_by(fingerprint=fingerprint, user_id=user_id)
         .first()
     )
     if exists:
         raise ValueError(
-            "Duplicate payment (same date, amount, merchant) already exists"
-        )
-    payment_orm = PaymentORM(
-        date=payment.date,
-        amount=payment.amount,
-        currency=payment.currency,
-        merchant=payment.merchant,
-        auto_category=payment.auto_category,
-        source=payment.source,
-        type=payment.type,
-        note=payment.note,
-        category=payment.category,
-        user_id=user_id,
-    )
+            "Duplicate payment (same date, amount, merchant, source) already exists"
+        )
+    payment_orm = PaymentORM(**_payment_row(payment, fingerprint, user_id))
+    payment_orm.change_version = _bump_version(db, user_id)
     db.add(payment_orm)
+    _add_to_summary(db, user_id, [payment_orm])
     db.commit()
     db.refresh(payment_orm)
     return payment_to_domain(payment_orm)
 
 
+def _reject_archived(db, user_id: int, ids) -> None:
+    """
+    Roll back and raise ValueError if any of the ids is an archived payment,
+    which is read-only.
+    """
+    if get_archived_before(db, user_id) is None:
+        return
+    archived = read_archived_ids(user_id, ids)
+    if archived:
+        db.rollback()
+        listed = ", ".join(str(i) for i in sorted(archived))
+        raise ValueError(f"Archived payments are read-only: {listed}")
+
+
+def _lock_payment(db, payment_id: int, user_id: int) -> Optional[PaymentORM]:
+    # Row lock on Postgres, so an archive run cannot move it meanwhile
+    return (
+        db.query(PaymentORM)
+        .filter_by(id=payment_id, user_id=user_id)
+        .with_for_update()
+        .first()
+    )
+
+
 def update_payment_category(
     db, payment_id: int, user_id: int, cust_category: str
 ) -> bool:
-    payment = db.query(PaymentORM).filter_by(id=payment_id, user_id=user_id).first()
-    if not payment:
+    payment = _lock_payment(db, payment_id, user_id)
+    updated = 0
+    if payment is not None:
+        # Filtered by both partition keys, so a partitioned table is pruned
+        updated = db.execute(
+            update(PaymentORM)
+            .where(
+                PaymentORM.id == payment.id,
+                PaymentORM.user_id == user_id,
+                PaymentORM.date == payment.date,
+            )
+            .values(category=cust_category, change_version=_bump_version(db, user_id))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    if not updated:
+        # Missing, or archived since it was read
+        _reject_archived(db, user_id, [payment_id])
+        db.rollback()
         return False
-    payment.category = cust_category
+    _add_to_summary(db, user_id, [payment], sign=-1)
+    _add_to_summary(db, user_id, [payment], category=cust_category)
     db.commit()
     return True
 
@@ -137,27 +1178,199 @@ def update_payment_category(
 def update_merchant_categories(
     db, payment_id: int, user_id: int, cust_category: str
 ) -> int:
-    payment = db.query(PaymentORM).filter_by(id=payment_id, user_id=user_id).first()
+    """
+    Set the category of every payment of the merchant of payment_id. Archived
+    payments of the merchant keep theirs.
+    """
+    payment = _lock_payment(db, payment_id, user_id)
     if not payment:
+        _reject_archived(db, user_id, [payment_id])
         return 0
     merchant = payment.merchant
+    affected = db.execute(
+        select(
+            PaymentORM.date,
+            PaymentORM.category,
+            PaymentORM.source,
+            PaymentORM.type,
+            PaymentORM.amount_fen,
+        )
+        .where(PaymentORM.merchant == merchant, PaymentORM.user_id == user_id)
+        .with_for_update()
+    ).all()
+    version = _bump_version(db, user_id)
     updated = (
         db.query(PaymentORM)
         .filter_by(merchant=merchant, user_id=user_id)
-        .update({"category": cust_category})
+        .update({"category": cust_category, "change_version": version})
     )
+    _add_to_summary(db, user_id, affected, sign=-1)
+    _add_to_summary(db, user_id, affected, category=cust_category)
     db.commit()
     return updated
 
 
 def delete_payments_by_ids(db, ids: list, user_id: int) -> int:
-    deleted = (
-        db.query(PaymentORM)
-        .filter(PaymentORM.id.in_(ids), PaymentORM.user_id == user_id)
-        .delete(synchronize_session=False)
+    deleted = db.execute(
+        delete(PaymentORM)
+        .where(PaymentORM.id.in_(ids), PaymentORM.user_id == user_id)
+        .returning(
+            PaymentORM.id,
+            PaymentORM.date,
+            PaymentORM.category,
+            PaymentORM.source,
+            PaymentORM.type,
+            PaymentORM.amount_fen,
+        )
+        .execution_options(synchronize_session=False)
+    ).all()
+    missing = set(ids) - {row.id for row in deleted}
+    if missing:
+        _reject_archived(db, user_id, missing)
+    if deleted:
+        version = _bump_version(db, user_id)
+        db.execute(
+            insert(PaymentTombstoneORM),
+            [
+                {"user_id": user_id, "payment_id": row.id, "change_version": version}
+                for row in deleted
+            ],
+        )
+        _add_to_summary(db, user_id, deleted, sign=-1)
+        _forget_imported_files(db, user_id, deleted)
+    db.commit()
+    return len(deleted)
+
+
+ARCHIVE_BATCH_ROWS = 50_000
+
+
+def archive_payments(db, user_id: int, before: datetime) -> int:
+    """
+    Move the user's payments dated before `before` from the payments table to
+    the Parquet archive. The monthly summary keeps counting them, and reads
+    whose date range reaches the archive include them again. Running it again
+    after a failure is safe, rows already in the archive are only deleted.
+    Writes to the moved payments wait until the move is committed: Postgres
+    locks their rows, SQLite the database from the first write on.
+    Returns the number of payments moved.
+    """
+    set_archived_before(db, user_id, before)
+    db.flush()
+    result = db.execute(
+        select(*[getattr(PaymentORM, name) for name in ARCHIVE_COLUMNS])
+        .where(PaymentORM.user_id == user_id, PaymentORM.date < before)
+        .order_by(PaymentORM.date, PaymentORM.id)
+        .with_for_update()
+        .execution_options(yield_per=ARCHIVE_BATCH_ROWS)
     )
+    ids = []
+    for batch in result.partitions():
+        write_archived_rows(user_id, batch)
+        ids += [row.id for row in batch]
+    for start in range(0, len(ids), ARCHIVE_BATCH_ROWS):
+        db.execute(
+            delete(PaymentORM)
+            .where(
+                PaymentORM.user_id == user_id,
+                PaymentORM.date < before,
+                PaymentORM.id.in_(ids[start : start + ARCHIVE_BATCH_ROWS]),
+            )
+            .execution_options(synchronize_session=False)
+        )
     db.commit()
-    return deleted
+    return len(ids)
+
+
+def users_with_payments_before(db, before: datetime) -> List[int]:
+    return list(
+        db.scalars(
+            select(PaymentORM.user_id).where(PaymentORM.date < before).distinct()
+        )
+    )
+
+
+def is_file_imported(db, user_id: int, content_hash: str) -> bool:
+    return (
+        db.scalar(
+            select(ImportedFileORM.id).where(
+                ImportedFileORM.user_id == user_id,
+                ImportedFileORM.content_hash == content_hash,
+            )
+        )
+        is not None
+    )
+
+
+def get_imported_spans(
+    db, user_id: int, source: PaymentSource
+) -> List[Tuple[datetime, datetime]]:
+    """
+    Date spans of the earlier imports of this source, sorted and merged where
+    they overlap.
+    """
+    spans = db.execute(
+        select(ImportedFileORM.first_date, ImportedFileORM.last_date)
+        .where(
+            ImportedFileORM.user_id == user_id,
+            ImportedFileORM.source == source,
+            ImportedFileORM.first_date.is_not(None),
+        )
+        .order_by(ImportedFileORM.first_date)
+    ).all()
+    merged: List[Tuple[datetime, datetime]] = []
+    for first, last in spans:
+        if merged and first <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def record_imported_file(
+    db,
+    user_id: int,
+    source: PaymentSource,
+    content_hash: str,
+    filename: str,
+    payments: List[Payment],
+    inserted_count: int,
+) -> None:
+    dates = [p.date for p in payments]
+    db.add(
+        ImportedFileORM(
+            user_id=user_id,
+            source=source,
+            content_hash=content_hash,
+            filename=filename,
+            first_date=min(dates, default=None),
+            last_date=max(dates, default=None),
+            row_count=len(payments),
+            inserted_count=inserted_count,
+        )
+    )
+    try:
+        db.commit()
+    except IntegrityError as e:
+        # The same file was imported concurrently, its rows are stored by then
+        db.rollback()
+        raise ValueError("This file was already imported.") from e
+
+
+def _forget_imported_files(db, user_id: int, deleted_rows) -> None:
+    # Files whose span covers deleted rows may be imported again to restore them
+    dates_by_source = {}
+    for row in deleted_rows:
+        dates_by_source.setdefault(row.source, []).append(row.date)
+    for source, dates in dates_by_source.items():
+        db.execute(
+            delete(ImportedFileORM).where(
+                ImportedFileORM.user_id == user_id,
+                ImportedFileORM.source == source,
+                ImportedFileORM.first_date <= max(dates),
+                ImportedFileORM.last_date >= min(dates),
+            )
+        )
 
 
 def get_category_tree(db, user_id: int) -> dict:
@@ -175,6 +1388,7 @@ def save_category_tree(db, user_id: int, tree: dict):
     else:
         obj = CategoryTreeORM(user_id=user_id, tree_json=tree_json)
         db.add(obj)
+    _bump_version(db, user_id, tree=True)
     db.commit()
 
 
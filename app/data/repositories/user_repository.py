@@ -1,9 +1,6 @@
 from sqlalchemy import Column, Integer, String
-from sqlalchemy.orm import sessionmaker
 
-from app.data.base import Base, engine
-
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+from app.data.base import Base, get_engine
 
 
 class UserORM(Base):
@@ -14,7 +11,7 @@ class UserORM(Base):
 
 
 def create_user_table():
-    Base.metadata.create_all(bind=engine)
+    Base.metadata.create_all(bind=get_engine())
 
 
 def get_user_by_username(db, username: str):
@@ -1,4 +1,16 @@
-from app.data.base import Base
-from app.data.repositories.payment_repository import engine
+from app.data.repositories.payment_repository import create_payment_tables
+from app.data.repositories.user_repository import create_user_table
 
-Base.metadata.create_all(bind=engine)
+
+def setup_db() -> None:
+    """
+    Create missing tables and indexes and run the in-place column migrations.
+    Safe to run repeatedly.
+    """
+    create_user_table()
+    create_payment_tables()
+
+
+if __name__ == "__main__":
+    setup_db()
+    print("Database schema is up to date")
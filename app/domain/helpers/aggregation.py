@@ -1,10 +1,45 @@
 from datetime import datetime
-from typing import List
+from typing import Dict, Iterable, List, Optional, Tuple
 
+from app.domain.helpers.money import to_yuan
 from app.domain.helpers.sum import get_signed_amount
 from app.domain.models.payment import Payment
 
 
+def collect_category_paths(tree, path=None, paths=None) -> List[List[str]]:
+    """
+    Return the path from the top-level category to every leaf category.
+    """
+    if tree is None:
+        return paths if paths is not None else []
+    if paths is None:
+        paths = []
+    if path is None:
+        path = []
+    for k, v in tree.items() if isinstance(tree, dict) else []:
+        current_path = path + [k]
+        if v is None:
+            paths.append(current_path)
+        elif isinstance(v, dict):
+            if not v:
+                paths.append(current_path)
+            else:
+                collect_category_paths(v, current_path, paths)
+    return paths
+
+
+def find_category_path(
+    category: str, leaf_to_path: Dict[str, List[str]]
+) -> Optional[List[str]]:
+    path = leaf_to_path.get(category)
+    if not path:
+        # Try partial match (for parent categories)
+        for k, v in leaf_to_path.items():
+            if category == k or category in v:
+                return v
+    return path
+
+
 def sum_payments_by_category(
     payments: List[Payment], category_tree: dict, start_date=None, end_date=None
 ):
@@ -14,43 +49,6 @@ def sum_payments_by_category(
     Adds 'no category' and 'invalid category' keys.
     Metadata includes total sum and invalid categories list.
     """
-
-    def collect_paths(tree, path=None, paths=None):
-        if tree is None:
-            return paths if paths is not None else []
-        if paths is None:
-            paths = []
-        if path is None:
-            path = []
-        for k, v in tree.items() if isinstance(tree, dict) else []:
-            current_path = path + [k]
-            if v is None:
-                paths.append(current_path)
-            elif isinstance(v, dict):
-                if not v:
-                    paths.append(current_path)
-                else:
-                    collect_paths(v, current_path, paths)
-        return paths
-
-    # Build all category paths
-    all_paths = collect_paths(category_tree)
-    # Map leaf to its full path
-    leaf_to_path = {}
-    for p in all_paths:
-        leaf_to_path[p[-1]] = p
-
-    # Prepare result dict for all categories
-    result = {}
-    for path in all_paths:
-        for cat in path:
-            result[cat] = 0.0
-    result["no category"] = 0.0
-    result["invalid category"] = 0.0
-
-    total_sum = 0.0
-    invalid_categories_set = set()
-
     # Filter payments by date if needed
     filtered_payments = []
     # Convert start_date/end_date to date if provided
@@ -66,40 +64,104 @@ def sum_payments_by_category(
             continue
         filtered_payments.append(p)
 
+    return sum_category_totals(
+        ((p.category, get_signed_amount(p)) for p in filtered_payments),
+        category_tree,
+    )
+
+
+def sum_category_totals(
+    category_sums: Iterable[Tuple[Optional[str], int]], category_tree: dict
+):
+    """
+    Same result as sum_payments_by_category, from signed amounts in fen that
+    are already summed per category (e.g. by the database).
+    """
+    # Build all category paths
+    all_paths = collect_category_paths(category_tree)
+    # Map leaf to its full path
+    leaf_to_path = {}
+    for p in all_paths:
+        leaf_to_path[p[-1]] = p
+
+    # Prepare result dict for all categories
+    result = {}
+    # Sums are accumulated exactly in fen
+    for path in all_paths:
+        for cat in path:
+            result[cat] = 0
+    result["no category"] = 0
+    result["invalid category"] = 0
+
+    total_sum = 0
+    invalid_categories_set = set()
+
     # Aggregate amounts
-    for p in filtered_payments:
-        signed_amount = get_signed_amount(p)
+    for category, signed_amount in category_sums:
         total_sum += signed_amount
-        cat = p.category.strip() if p.category else None
+        cat = category.strip() if category else None
         if not cat:
             result["no category"] += signed_amount
             continue
-        path = leaf_to_path.get(cat)
-        if not path:
-            # Try partial match (for parent categories)
-            for k, v in leaf_to_path.items():
-                if cat == k or cat in v:
-                    path = v
-                    break
+        path = find_category_path(cat, leaf_to_path)
         if not path:
             result["invalid category"] += signed_amount
             invalid_categories_set.add(cat)
             continue
         for cat_in_path in path:
             result[cat_in_path] += signed_amount
-    # Round all sums to zero decimal places
+    # Round all sums to whole yuan
     for key in result:
-        result[key] = round(result[key])
+        result[key] = round(to_yuan(result[key]))
 
-    output = {k: -v for k, v in result.items() if v != 0.0}
+    output = {k: -v for k, v in result.items() if v != 0}
     metadata = {
-        "total sum": total_sum,
+        "total sum": to_yuan(total_sum),
         "invalid categories": sorted(list(invalid_categories_set)),
     }
 
     return output, metadata
 
 
+def roll_up_series(
+    rows: List[Tuple[str, Optional[str], int]], category_tree: dict, split_by=None
+) -> List[dict]:
+    """
+    Turn (bucket, group, signed_fen) rows into one entry per bucket with the
+    total and, if split_by is set, the totals per group in yuan.
+    Category groups are rolled up to their top-level category, with the same
+    'no category' and 'invalid category' keys as sum_payments_by_category.
+    """
+    leaf_to_path = {p[-1]: p for p in collect_category_paths(category_tree)}
+    buckets: Dict[str, Dict[str, int]] = {}
+    totals: Dict[str, int] = {}
+    for bucket, group, signed_fen in rows:
+        totals[bucket] = totals.get(bucket, 0) + signed_fen
+        if split_by is None:
+            continue
+        if split_by == "category":
+            cat = group.strip() if group else None
+            if not cat:
+                group = "no category"
+            else:
+                path = find_category_path(cat, leaf_to_path)
+                group = path[0] if path else "invalid category"
+        elif split_by == "source":
+            group = getattr(group, "value", group)
+        groups = buckets.setdefault(bucket, {})
+        groups[group] = groups.get(group, 0) + signed_fen
+
+    series = []
+    for bucket in sorted(totals):
+        entry: dict = {"period": bucket, "total": to_yuan(totals[bucket])}
+        if split_by is not None:
+            entry["groups"] = {
+                k: to_yuan(v) for k, v in buckets.get(bucket, {}).items() if v != 0
+            }
+        series.append(entry)
+    return series
+
+
 def build_sankey_data(result: dict, metadata: dict, category_tree: dict):
     """
     Build Sankey diagram nodes and links from aggregation result and category tree.
@@ -1,15 +1,11 @@
 import os
+from functools import lru_cache
 
 from dotenv import load_dotenv
 
-# Simple translation using HuggingFace pipeline
-from transformers import pipeline
-from transformers import pipeline as hf_pipeline
-
+from app.domain.helpers.metrics import CLASSIFIER_DURATION, CLASSIFIER_RESULTS
 from app.domain.models.payment import Payment
 
-translator = hf_pipeline("translation", model="tryHelsinki-NLP/opus-mt-zh-en")
-
 load_dotenv()
 CATEGORIES_CSV_PATH = os.getenv("CATEGORIES_CSV_PATH", "resources/categories.csv")
 
@@ -19,27 +15,38 @@ def load_categories(csv_path: str):
         return sorted({line.strip() for line in f if line.strip()})
 
 
+@lru_cache(maxsize=None)
+def get_pipeline(task: str, model: str):
+    # transformers and the models are only loaded once classification is used
+    from transformers import pipeline
+
+    return pipeline(task, model=model)
+
+
 def translate_text(text: str) -> str:
     if not text.strip():
         return ""
     # Only translate if contains Chinese characters
     if any("\u4e00" <= ch <= "\u9fff" for ch in text):
+        translator = get_pipeline("translation", "tryHelsinki-NLP/opus-mt-zh-en")
         return translator(text, max_length=128)[0]["translation_text"]
     return text
 
 
 def classify_payments(payments: list[Payment]):
     categories = load_categories(CATEGORIES_CSV_PATH)
-    classifier = pipeline("zero-shot-classification", model="facebook/bart-large-mnli")
+    classifier = get_pipeline("zero-shot-classification", "facebook/bart-large-mnli")
 
     for p in payments:
         if not p.category:
-            t_m = translate_text(p.merchant)
-            t_n = translate_text(p.note)
-            input_text = f"{t_m} {t_n}"
-            result = classifier(input_text, candidate_labels=categories)
+            with CLASSIFIER_DURATION.time():
+                t_m = translate_text(p.merchant)
+                t_n = translate_text(p.note)
+                input_text = f"{t_m} {t_n}"
+                result = classifier(input_text, candidate_labels=categories)
             top_label = result["labels"][0]
             top_score = result["scores"][0]
+            CLASSIFIER_RESULTS.labels(str(top_score > 0.4).lower()).inc()
             if top_score > 0.4:
                 p.category = top_label
                 print(
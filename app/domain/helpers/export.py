@@ -0,0 +1,152 @@
+from typing import Iterable, Iterator, List
+
+import orjson
+
+# Format name -> (media type, file extension)
+EXPORT_FORMATS = {
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+
+# Columns of an iter_payment_batches row, in order. Amounts are exported as
+# integer fen, as stored, so no client reads a rounded float
+EXPORT_COLUMNS = [
+    "id",
+    "date",
+    "amount_fen",
+    "currency",
+    "merchant",
+    "auto_category",
+    "source",
+    "type",
+    "note",
+    "cust_category",
+    "transaction_id",
+]
+
+# Low-cardinality text columns, stored once per batch or row group
+DICTIONARY_COLUMNS = {
+    "currency",
+    "merchant",
+    "auto_category",
+    "cust_category",
+    "source",
+    "type",
+}
+
+
+def requires_pyarrow(export_format: str) -> bool:
+    return export_format in ("parquet", "arrow")
+
+
+def export_ndjson(batches: Iterable[List[tuple]]) -> Iterator[bytes]:
+    """
+    One JSON object per payment and line, one chunk per batch.
+    """
+    for batch in batches:
+        yield b"".join(
+            orjson.dumps(
+                {
+                    "id": row.id,
+                    "date": row.date,
+                    "amount_fen": row.amount_fen,
+                    "currency": row.currency,
+                    "merchant": row.merchant,
+                    "auto_category": row.auto_category or "",
+                    "source": row.source.value,
+                    "type": row.type.value,
+                    "note": row.note or "",
+                    "cust_category": row.category or "",
+                    "transaction_id": row.transaction_id or "",
+                },
+                option=orjson.OPT_APPEND_NEWLINE,
+            )
+            for row in batch
+        )
+
+
+class _ChunkSink:
+    """
+    Write-only file object that hands out what pyarrow wrote so far, so a
+    writer's output can be streamed batch by batch.
+    """
+
+    closed = False
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def export_arrow(batches: Iterable[List[tuple]], export_format: str) -> Iterator[bytes]:
+    """
+    Stream payments as an Arrow IPC stream or a Parquet file with one record
+    batch or row group per batch. Needs pyarrow.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    text = pa.string()
+    dictionary = pa.dictionary(pa.int32(), text)
+    schema = pa.schema(
+        [
+            ("id", pa.int64()),
+            ("date", pa.timestamp("us")),
+            ("amount_fen", pa.int64()),
+        ]
+        + [
+            (name, dictionary if name in DICTIONARY_COLUMNS else text)
+            for name in EXPORT_COLUMNS[3:]
+        ]
+    )
+
+    def text_column(name, values):
+        array = pc.fill_null(pa.array(values, text), "")
+        return array.dictionary_encode() if name in DICTIONARY_COLUMNS else array
+
+    sink = _ChunkSink()
+    out = pa.PythonFile(sink, mode="w")
+    if export_format == "parquet":
+        writer = pq.ParquetWriter(out, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_stream(
+            out, schema, options=pa.ipc.IpcWriteOptions(compression="zstd")
+        )
+    with writer:
+        for batch in batches:
+            columns = list(zip(*batch))
+            columns[6] = [source.value for source in columns[6]]
+            columns[7] = [p_type.value for p_type in columns[7]]
+            arrays = [
+                pa.array(columns[0], pa.int64()),
+                pa.array(columns[1], pa.timestamp("us")),
+                pa.array(columns[2], pa.int64()),
+            ] + [
+                text_column(name, values)
+                for name, values in zip(EXPORT_COLUMNS[3:], columns[3:])
+            ]
+            writer.write_batch(pa.record_batch(arrays, schema=schema))
+            yield sink.take()
+    yield sink.take()
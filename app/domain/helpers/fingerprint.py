@@ -0,0 +1,40 @@
+import hashlib
+from datetime import datetime
+
+from app.domain.models.payment import Payment, PaymentSource
+
+
+def compute_fingerprint(
+    date: datetime,
+    amount_fen: int,
+    merchant: str,
+    source: PaymentSource,
+    transaction_id: str = "",
+) -> str:
+    """
+    Deterministic hash identifying a payment across imports.
+    Built from the normalized date, amount in fen, merchant, source and the
+    transaction id of the source export (empty if the source has none).
+    The source is part of the key, so payments with the same date, amount and
+    merchant from two sources are both kept. They used to be duplicates.
+    """
+    if isinstance(date, datetime):
+        date = date.replace(microsecond=0, tzinfo=None)
+    parts = [
+        date.isoformat(),
+        str(amount_fen),
+        (merchant or "").strip(),
+        str(getattr(source, "value", source)),
+        (transaction_id or "").strip(),
+    ]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def payment_fingerprint(payment: Payment) -> str:
+    return compute_fingerprint(
+        payment.date,
+        payment.amount_fen,
+        payment.merchant,
+        payment.source,
+        payment.transaction_id,
+    )
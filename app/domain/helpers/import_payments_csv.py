@@ -1,24 +1,36 @@
 import csv
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import datetime
+from typing import Dict, Iterator, List, Tuple
 
-from sqlalchemy.orm import Session, sessionmaker
-
-from app.data.base import engine
-from app.data.repositories.payment_repository import upsert_payments
+from app.domain.helpers.money import to_fen, to_yuan
 from app.domain.models.payment import Payment, PaymentSource, PaymentType
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_WORKERS = 4
+DEFAULT_RETRIES = 3
+STREAM_CHUNK_BYTES = 2**16
 
 
-def parse_csv_payments(csv_path, user_id):
-    payments = []
+def iter_csv_payments(
+    csv_path, user_id, start_row: int = 0
+) -> Iterator[Tuple[int, Payment | None]]:
+    """
+    Stream the CSV and yield (row_number, payment) for every data row starting
+    at start_row. Rows that fail to parse are reported and yielded as None, so
+    row numbers stay stable for checkpointing.
+    """
     with open(csv_path, newline="", encoding="utf-8") as csvfile:
         reader = csv.DictReader(csvfile)
-        for row in reader:
+        for row_number, row in enumerate(reader):
+            if row_number < start_row:
+                continue
             try:
                 payment = Payment(
                     date=datetime.fromisoformat(row["date"]),
-                    amount=float(row["amount"]),
+                    amount_fen=to_fen(row["amount"]),
                     currency=row["currency"],
                     merchant=row["merchant"],
                     auto_category=row.get("auto_category", ""),
@@ -26,53 +38,284 @@ def parse_csv_payments(csv_path, user_id):
                     type=PaymentType(row["type"]),
                     note=row.get("note", ""),
                     category=row.get("cust_category", ""),
+                    transaction_id=row.get("transaction_id", ""),
                     user_id=user_id,
                 )
-                payments.append(payment)
             except Exception as e:
                 print(f"Skipping row due to error: {e}\nRow: {row}")
-    return payments
+                payment = None
+            yield row_number, payment
+
+
+def parse_csv_payments(csv_path, user_id):
+    return [p for _, p in iter_csv_payments(csv_path, user_id) if p is not None]
+
+
+def iter_chunks(
+    csv_path, user_id, chunk_size: int, start_row: int = 0
+) -> Iterator[Tuple[int, List[Payment]]]:
+    """
+    Yield (end_row, payments) chunks of at most chunk_size CSV rows, where
+    end_row is the number of rows consumed once the chunk is stored.
+    """
+    chunk: List[Payment] = []
+    rows_in_chunk = 0
+    end_row = start_row
+    for row_number, payment in iter_csv_payments(csv_path, user_id, start_row):
+        end_row = row_number + 1
+        rows_in_chunk += 1
+        if payment is not None:
+            chunk.append(payment)
+        if rows_in_chunk >= chunk_size:
+            yield end_row, chunk
+            chunk = []
+            rows_in_chunk = 0
+    if rows_in_chunk:
+        yield end_row, chunk
+
+
+def read_checkpoint(checkpoint_path: str) -> int:
+    try:
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def write_checkpoint(checkpoint_path: str, row: int) -> None:
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(str(row))
+    os.replace(tmp_path, checkpoint_path)
+
+
+def payment_to_payload(p: Payment) -> dict:
+    return {
+        "date": p.date.isoformat(),
+        "amount": to_yuan(p.amount_fen),
+        "currency": p.currency,
+        "merchant": p.merchant,
+        "type": p.type.value,
+        "source": p.source.value,
+        "note": p.note,
+        "category": p.category,
+        "transaction_id": p.transaction_id,
+    }
+
+
+def create_api_session(token: str | None, workers: int, retries: int):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    # POST is safe to retry: the batch endpoint skips already stored payments
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["POST"],
+    )
+    adapter = HTTPAdapter(
+        pool_connections=workers, pool_maxsize=workers, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if token:
+        session.headers["Authorization"] = f"Bearer {token}"
+    return session
+
+
+def upload_payments_to_api(
+    csv_path: str,
+    user_id: int,
+    api_url: str,
+    token: str | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    workers: int = DEFAULT_WORKERS,
+    retries: int = DEFAULT_RETRIES,
+    checkpoint_path: str | None = None,
+) -> Tuple[int, int]:
+    """
+    Send the CSV to the batch endpoint in chunks over a pooled session.
+    The checkpoint file holds the number of leading rows that are acknowledged,
+    so an interrupted upload resumes after the last contiguous acknowledged chunk.
+    Returns the number of added and duplicate payments.
+    """
+    checkpoint_path = checkpoint_path or f"{csv_path}.checkpoint"
+    start_row = read_checkpoint(checkpoint_path)
+    if start_row:
+        print(f"Resuming from row {start_row} ({checkpoint_path})")
+
+    session = create_api_session(token, workers, retries)
+
+    def send(payments: List[Payment]) -> dict:
+        if not payments:
+            return {"added": [], "duplicates": []}
+        resp = session.post(
+            api_url, json={"payments": [payment_to_payload(p) for p in payments]}
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    added = 0
+    duplicates = 0
+    acknowledged = start_row
+    # start_row -> end_row of chunks acknowledged ahead of the watermark
+    done_ahead: Dict[int, int] = {}
+    pending: Dict[Future, Tuple[int, int]] = {}
+    errors: List[Exception] = []
+
+    def collect(futures) -> None:
+        nonlocal added, duplicates, acknowledged
+        for future in futures:
+            chunk_start, chunk_end = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                # The watermark stops before this chunk, later ones still count
+                errors.append(e)
+                continue
+            added += len(result.get("added", []))
+            duplicates += len(result.get("duplicates", []))
+            done_ahead[chunk_start] = chunk_end
+        while acknowledged in done_ahead:
+            acknowledged = done_ahead.pop(acknowledged)
+        write_checkpoint(checkpoint_path, acknowledged)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            chunk_start = start_row
+            for chunk_end, payments in iter_chunks(
+                csv_path, user_id, chunk_size, start_row
+            ):
+                if errors:
+                    break
+                # Bound the number of chunks held in memory
+                if len(pending) >= workers * 2:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(finished)
+                pending[executor.submit(send, payments)] = (chunk_start, chunk_end)
+                chunk_start = chunk_end
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+    finally:
+        session.close()
+    if errors:
+        raise errors[0]
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return added, duplicates
+
+
+def iter_ndjson_chunks(csv_path, user_id) -> Iterator[bytes]:
+    """
+    Encode the CSV's payments as NDJSON request body chunks of about
+    STREAM_CHUNK_BYTES.
+    """
+    chunk: List[bytes] = []
+    size = 0
+    for _, payment in iter_csv_payments(csv_path, user_id):
+        if payment is None:
+            continue
+        line = json.dumps(payment_to_payload(payment), ensure_ascii=False) + "\n"
+        chunk.append(line.encode("utf-8"))
+        size += len(chunk[-1])
+        if size >= STREAM_CHUNK_BYTES:
+            yield b"".join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield b"".join(chunk)
+
+
+def stream_payments_to_api(
+    csv_path: str, user_id: int, api_url: str, token: str | None = None
+) -> Tuple[int, int, int]:
+    """
+    Send the whole CSV as one NDJSON request to the ingest endpoint, which
+    stores it in batches as it arrives. Running it again after a failure only
+    adds what is missing, stored payments come back as duplicates.
+    Returns the number of added, duplicate and rejected payments.
+    """
+    # A streamed body cannot be replayed, so no automatic retries
+    session = create_api_session(token, workers=1, retries=0)
+    counts = {"added": 0, "duplicate": 0, "error": 0}
+    try:
+        with session.post(
+            api_url,
+            data=iter_ndjson_chunks(csv_path, user_id),
+            headers={"Content-Type": "application/x-ndjson"},
+            stream=True,
+        ) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if not line:
+                    continue
+                result = json.loads(line)
+                counts[result["status"]] += 1
+                if result["status"] == "error":
+                    print(f"Rejected NDJSON line {result['line']}: {result['error']}")
+    finally:
+        session.close()
+    return counts["added"], counts["duplicate"], counts["error"]
 
 
 def import_payments_from_csv(
-    csv_path: str, user_id: int, api_url: str | None = None, token: str | None = None
+    csv_path: str,
+    user_id: int,
+    api_url: str | None = None,
+    token: str | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    workers: int = DEFAULT_WORKERS,
+    retries: int = DEFAULT_RETRIES,
+    checkpoint_path: str | None = None,
+    stream: bool = False,
 ):
-    payments = parse_csv_payments(csv_path, user_id)
-    if api_url:
-        import requests
-
-        # Prepare payload for API
-        payload = {
-            "payments": [
-                {
-                    "date": p.date.isoformat(),
-                    "amount": p.amount,
-                    "currency": p.currency,
-                    "merchant": p.merchant,
-                    "type": p.type.value,
-                    "source": p.source.value,
-                    "note": p.note,
-                    "category": p.category,
-                }
-                for p in payments
-            ]
-        }
-        headers = {}
-        if token:
-            headers["Authorization"] = f"Bearer {token}"
+    if api_url and stream:
         try:
-            resp = requests.post(api_url, json=payload, headers=headers)
-            resp.raise_for_status()
+            added, duplicates, rejected = stream_payments_to_api(
+                csv_path, user_id, api_url, token=token
+            )
+            print(
+                f"Streamed payments to API {api_url}: {added} added,"
+                f" {duplicates} duplicates skipped, {rejected} rejected."
+            )
+        except Exception as e:
+            print(f"Failed to stream payments to API: {e}")
+    elif api_url:
+        try:
+            added, duplicates = upload_payments_to_api(
+                csv_path,
+                user_id,
+                api_url,
+                token=token,
+                chunk_size=chunk_size,
+                workers=workers,
+                retries=retries,
+                checkpoint_path=checkpoint_path,
+            )
             print(
-                f"Sent {len(payments)} payments to API {api_url}."
-                f" Response: {resp.status_code}"
+                f"Sent payments to API {api_url}: {added} added,"
+                f" {duplicates} duplicates skipped."
             )
         except Exception as e:
-            print(f"Failed to send payments to API: {e}")
+            print(
+                f"Failed to send payments to API: {e}\n"
+                "Run the same command again to resume from the last checkpoint."
+            )
     else:
-        db: Session = SessionLocal()
+        # The database stack is only loaded when writing to it directly
+        from app.data.base import SessionLocal
+        from app.data.repositories.payment_repository import upsert_payments
+
+        db = SessionLocal()
         try:
-            count = upsert_payments(db, payments, user_id)
+            count = 0
+            for _, payments in iter_chunks(csv_path, user_id, chunk_size):
+                count += upsert_payments(db, payments, user_id)
             print(f"Imported {count} payments for user_id={user_id}")
         finally:
             db.close()
@@ -90,8 +333,43 @@ if __name__ == "__main__":
     parser.add_argument(
         "--token", help="Bearer token for API authentication (optional)", default=None
     )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="CSV rows per batch request",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=DEFAULT_WORKERS, help="Parallel API requests"
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=DEFAULT_RETRIES,
+        help="Retries per failed API request",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        help="Checkpoint file for resuming API uploads"
+        " (default: <csv_path>.checkpoint)",
+        default=None,
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Send one NDJSON request to --api-url, e.g."
+        " http://localhost:8000/api/payments/ingest, instead of batch requests",
+    )
     args = parser.parse_args()
 
     import_payments_from_csv(
-        args.csv_path, args.user_id, api_url=args.api_url, token=args.token
+        args.csv_path,
+        args.user_id,
+        api_url=args.api_url,
+        token=args.token,
+        chunk_size=args.chunk_size,
+        workers=args.workers,
+        retries=args.retries,
+        checkpoint_path=args.checkpoint,
+        stream=args.stream,
     )
@@ -0,0 +1,96 @@
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Request wall time by route",
+    ["method", "route", "status"],
+)
+REQUEST_SQL_DURATION = Histogram(
+    "http_request_sql_duration_seconds",
+    "Time spent in SQL per request by route",
+    ["method", "route"],
+)
+REQUEST_SQL_QUERIES = Histogram(
+    "http_request_sql_queries",
+    "SQL statements executed per request by route",
+    ["method", "route"],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+
+IMPORT_FILES = Counter(
+    "payment_import_files_total",
+    "Uploaded payment files by source and outcome",
+    ["source", "status"],
+)
+IMPORT_ROWS_PARSED = Counter(
+    "payment_import_rows_parsed_total",
+    "Payments parsed from uploaded files",
+    ["source"],
+)
+IMPORT_ROWS_COVERED = Counter(
+    "payment_import_rows_covered_total",
+    "Parsed payments inside the span of an earlier export of the source and "
+    "found already stored",
+    ["source"],
+)
+IMPORT_ROWS_INSERTED = Counter(
+    "payment_import_rows_inserted_total",
+    "Parsed payments stored as new rows",
+    ["source"],
+)
+IMPORT_DUPLICATES = Counter(
+    "payment_import_duplicates_total",
+    "Parsed payments not counted as covered but skipped on insert as already "
+    "stored, archived or repeated in the file",
+    ["source"],
+)
+IMPORT_ROWS_SKIPPED = Counter(
+    "payment_import_rows_skipped_total",
+    "Rows the parsers could not read",
+    ["source"],
+)
+
+CLASSIFIER_DURATION = Histogram(
+    "payment_classifier_duration_seconds",
+    "Time to translate and classify one payment",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+CLASSIFIER_RESULTS = Counter(
+    "payment_classifier_results_total",
+    "Classified payments by whether a confident category was found",
+    ["confident"],
+)
+
+
+class ResultCacheCollector:
+    """
+    Report the counters of a ResultCache at scrape time. The cache covers all
+    users, so its statistics are only exposed here and not through the API.
+    """
+
+    def __init__(self, name: str, cache):
+        self.name = name
+        self.cache = cache
+
+    def collect(self):
+        stats = self.cache.stats()
+        entries = GaugeMetricFamily(
+            "result_cache_entries", "Results currently cached", labels=["cache"]
+        )
+        entries.add_metric([self.name], stats["entries"])
+        yield entries
+        counters = {
+            "hits": "Lookups answered from the cache",
+            "misses": "Lookups that computed the result",
+            "coalesced": "Lookups that waited for a concurrent computation",
+            "evictions": "Results dropped to stay within the size limit",
+        }
+        for key, doc in counters.items():
+            family = CounterMetricFamily(f"result_cache_{key}", doc, labels=["cache"])
+            family.add_metric([self.name], stats[key])
+            yield family
+
+
+def register_result_cache(name: str, cache) -> None:
+    REGISTRY.register(ResultCacheCollector(name, cache))
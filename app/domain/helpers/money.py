@@ -0,0 +1,18 @@
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Union
+
+
+def to_fen(amount: Union[str, int, float, Decimal]) -> int:
+    """
+    Convert a CNY amount (e.g. "12.34" or 12.34) to integer fen (1234).
+    Floats are converted through their shortest repr, so 0.1 gives 10, not 9.
+    Infinite and NaN amounts raise ValueError.
+    """
+    value = Decimal(str(amount).strip()) * 100
+    if not value.is_finite():
+        raise ValueError(f"Amount is not a finite number: {amount}")
+    return int(value.to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def to_yuan(fen: int) -> float:
+    return fen / 100
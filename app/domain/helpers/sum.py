@@ -1,27 +1,28 @@
 from datetime import datetime
 from typing import List, Optional
 
+from app.domain.helpers.money import to_yuan
 from app.domain.models.payment import Payment, PaymentType
 
 
-def get_signed_amount(payment: Payment) -> float:
+def get_signed_amount(payment: Payment) -> int:
     """
-    Returns the signed amount for a payment depending on its type.
+    Returns the signed amount in fen for a payment depending on its type.
     EXPENSE: negative, INCOME/REFUND: positive, ABORT/other: zero.
     """
     if payment.type == PaymentType.ABORT:
-        return 0.0
+        return 0
     if payment.type == PaymentType.EXPENSE:
-        return -payment.amount
+        return -payment.amount_fen
     elif payment.type in (PaymentType.INCOME, PaymentType.REFUND):
-        return payment.amount
-    return 0.0
+        return payment.amount_fen
+    return 0
 
 
 def sum_payments_in_range(
     payments: List[Payment], start: Optional[datetime], end: Optional[datetime]
 ) -> float:
-    total = 0.0
+    total = 0
     # Convert start/end to date if provided
     start_date = start.date() if start else None
     end_date = end.date() if end else None
@@ -32,4 +33,4 @@ def sum_payments_in_range(
         if end_date and p_date > end_date:
             continue
         total += get_signed_amount(p)
-    return total
+    return to_yuan(total)
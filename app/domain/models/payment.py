@@ -18,10 +18,10 @@ class PaymentType(Enum):
     REFUND = "refund"
 
 
-@dataclass
+@dataclass(slots=True)
 class Payment:
     date: datetime
-    amount: float
+    amount_fen: int  # CNY amount in fen, 1/100 yuan
     currency: str
     merchant: str
     source: PaymentSource
@@ -29,12 +29,13 @@ class Payment:
     note: str = ""
     category: str = ""
     auto_category: str = "Uncategorized"
+    transaction_id: str = ""
     user_id: int | None = None
     id: int | None = None
 
     def __post_init__(self):
         # Basic validation
-        if self.amount == 0:
+        if self.amount_fen == 0:
             raise ValueError("Payment amount cannot be zero.")
         if not self.currency:
             raise ValueError("Currency must be provided.")
@@ -1,8 +1,12 @@
 # app/data/alipay_parser.py
+import codecs
 import csv
+import os
 from datetime import datetime
-from typing import List
+from typing import BinaryIO, List, Union
 
+from app.domain.helpers.metrics import IMPORT_ROWS_SKIPPED
+from app.domain.helpers.money import to_fen
 from app.domain.models.payment import Payment, PaymentSource, PaymentType
 
 # 🔧 Define your column numbers here (0-based index)
@@ -13,17 +17,41 @@ TRANSACTION_ID_COL = 9  # example index for transaction ID
 AMOUNT_COL = 6  # e.g., "5.40"
 CATEGORY_COL = 1  # (Optional)
 TYP_COL = 5  # 收/支 (income/expense)
+# Rows with fewer fields cannot hold every column read
+MIN_FIELDS = max(DATE_COL, AMOUNT_COL, MERCHANT_COL, TRANSACTION_ID_COL) + 1
 
+# "arrow" uses the columnar parser, "python" the row-by-row one, "auto" the
+# columnar one when pyarrow is installed
+PARSER_ENGINE = os.getenv("ALIPAY_PARSER_ENGINE", "auto").lower()
 
-def parse_alipay_file(filepath: str) -> List[Payment]:
+
+def parse_alipay_file(source: Union[str, BinaryIO]) -> List[Payment]:
     """
-    Reads an Alipay TSV file and returns a list of Payment objects.
+    Reads an Alipay CSV export from a path or a binary file object and returns
+    a list of Payment objects.
     Adjust the column numbers above if your file format changes.
     """
+    if PARSER_ENGINE != "python":
+        try:
+            from app.domain.parsers.alipay_arrow_parser import parse_alipay_arrow
+        except ImportError:
+            if PARSER_ENGINE == "arrow":
+                raise
+        else:
+            return parse_alipay_arrow(source)
+    return parse_alipay_rows(source)
+
+
+def parse_alipay_rows(source: Union[str, BinaryIO]) -> List[Payment]:
+    """
+    Row-by-row parser, used when pyarrow is not installed.
+    """
     payments = []
-    with open(filepath, "r", encoding="gb18030") as f:
-        reader = csv.reader(f, delimiter=",")
-        rows = list(reader)
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            rows = _read_rows(f)
+    else:
+        rows = _read_rows(source)
 
     # Find the first row that looks like data
     data_start = 0
@@ -33,10 +61,14 @@ def parse_alipay_file(filepath: str) -> List[Payment]:
             break
 
     for row in rows[data_start:]:
-        if len(row) <= max(DATE_COL, AMOUNT_COL, MERCHANT_COL, TRANSACTION_ID_COL):
-            continue  # skip malformed rows
+        if not row:
+            continue
+        if len(row) < MIN_FIELDS:
+            # Malformed rows, like the summary lines some exports append
+            IMPORT_ROWS_SKIPPED.labels(PaymentSource.ALIPAY.value).inc()
+            continue
         try:
-            amount = float(row[AMOUNT_COL])
+            amount_fen = to_fen(row[AMOUNT_COL])
             cat = row[CATEGORY_COL] if len(row) > CATEGORY_COL else "Uncategorized"
             raw_cat = row[TYP_COL].strip().lower() if len(row) > TYP_COL else ""
             if "income" in raw_cat or "收入" in raw_cat:
@@ -52,21 +84,29 @@ def parse_alipay_file(filepath: str) -> List[Payment]:
 
             payment = Payment(
                 date=datetime.strptime(row[DATE_COL], "%Y-%m-%d %H:%M:%S"),
-                amount=amount,
+                amount_fen=amount_fen,
                 currency="CNY",
                 merchant=row[MERCHANT_COL],
                 auto_category=cat,
                 source=PaymentSource.ALIPAY,
                 type=p_type,
                 note=row[DETAILS_COL] if len(row) > DETAILS_COL else "",
+                transaction_id=row[TRANSACTION_ID_COL].strip(),
             )
             payments.append(payment)
         except Exception as e:
             print(f"Skipping row due to parsing error: {e}")
+            IMPORT_ROWS_SKIPPED.labels(PaymentSource.ALIPAY.value).inc()
 
     return payments
 
 
+def _read_rows(f: BinaryIO) -> List[List[str]]:
+    # gb18030 never uses the newline byte inside a character, so decoding
+    # line by line is safe
+    return list(csv.reader(codecs.iterdecode(f, "gb18030"), delimiter=","))
+
+
 if __name__ == "__main__":
     import sys
 
@@ -1,9 +1,11 @@
 # app/data/tsinghua_card_parser.py
 from datetime import datetime
-from typing import List
+from typing import BinaryIO, List, Union
 
 import openpyxl
 
+from app.domain.helpers.metrics import IMPORT_ROWS_SKIPPED
+from app.domain.helpers.money import to_fen
 from app.domain.models.payment import Payment, PaymentSource, PaymentType
 
 # Define your column numbers here (0-based index)
@@ -16,13 +18,14 @@ AMOUNT_COL = 1
 TYP_COL = 3
 
 
-def parse_tsinghua_card_file(filepath: str) -> List[Payment]:
+def parse_tsinghua_card_file(source: Union[str, BinaryIO]) -> List[Payment]:
     """
-    Reads a tsinghua_card .xlsx file and returns a list of Payment objects.
+    Reads a tsinghua_card .xlsx file from a path or a binary file object and returns
+    a list of Payment objects.
     Adjust the column numbers above if your file format changes.
     """
     payments = []
-    wb = openpyxl.load_workbook(filepath)
+    wb = openpyxl.load_workbook(source)
     ws = wb.active
     rows = list(ws.iter_rows(values_only=True))
 
@@ -41,10 +44,14 @@ def parse_tsinghua_card_file(filepath: str) -> List[Payment]:
             break
 
     for row in rows[data_start:]:
+        if not row:
+            continue
         if len(row) <= max(DATE_COL, AMOUNT_COL, MERCHANT_COL, TRANSACTION_ID_COL):
-            continue  # skip malformed rows
+            # Malformed rows, counted like the ones that fail to parse
+            IMPORT_ROWS_SKIPPED.labels(PaymentSource.TSINGHUA_CARD.value).inc()
+            continue
         try:
-            amount = float(row[AMOUNT_COL])
+            amount_fen = to_fen(row[AMOUNT_COL])
             raw_cat = str(row[TYP_COL]).strip().lower() if row[TYP_COL] else ""
             if "微信充值" in raw_cat:
                 p_type = PaymentType.INCOME
@@ -67,7 +74,7 @@ def parse_tsinghua_card_file(filepath: str) -> List[Payment]:
                 raise ValueError("Transaction time is outside expected range.")
             payment = Payment(
                 date=datetime.strptime(row[DATE_COL], "%Y-%m-%d %H:%M:%S"),
-                amount=amount,
+                amount_fen=amount_fen,
                 currency="CNY",
                 merchant=row[MERCHANT_COL],
                 source=PaymentSource.TSINGHUA_CARD,
@@ -80,6 +87,7 @@ def parse_tsinghua_card_file(filepath: str) -> List[Payment]:
             payments.append(payment)
         except Exception as e:
             print(f"Skipping row due to parsing error: {e}")
+            IMPORT_ROWS_SKIPPED.labels(PaymentSource.TSINGHUA_CARD.value).inc()
 
     return payments
 
@@ -1,9 +1,11 @@
 # app/data/wechat_parser.py
 from datetime import datetime
-from typing import List
+from typing import BinaryIO, List, Union
 
 import openpyxl
 
+from app.domain.helpers.metrics import IMPORT_ROWS_SKIPPED
+from app.domain.helpers.money import to_fen
 from app.domain.models.payment import Payment, PaymentSource, PaymentType
 
 # Define your column numbers here (0-based index)
@@ -16,15 +18,17 @@ AMOUNT_COL = 5
 TYP_COL = 4
 
 
-def parse_wechat_file(filepath: str) -> List[Payment]:
+def parse_wechat_file(source: Union[str, BinaryIO]) -> List[Payment]:
     """
-    Reads a WeChat .xlsx file and returns a list of Payment objects.
+    Reads a WeChat .xlsx file from a path or a binary file object and returns
+    a list of Payment objects.
     Adjust the column numbers above if your file format changes.
     """
     payments = []
-    wb = openpyxl.load_workbook(filepath, read_only=True)
+    wb = openpyxl.load_workbook(source, read_only=True)
     ws = wb.active
     rows = list(ws.iter_rows(values_only=True))
+    wb.close()  # read-only workbooks keep the file open until closed
 
     # Find the first row that looks like data
     data_start = 0
@@ -39,10 +43,14 @@ def parse_wechat_file(filepath: str) -> List[Payment]:
             break
 
     for row in rows[data_start:]:
+        if not row:
+            continue
         if len(row) <= max(DATE_COL, AMOUNT_COL, MERCHANT_COL, TRANSACTION_ID_COL):
-            continue  # skip malformed rows
+            # Malformed rows, counted like the ones that fail to parse
+            IMPORT_ROWS_SKIPPED.labels(PaymentSource.WECHAT.value).inc()
+            continue
         try:
-            amount = float(row[AMOUNT_COL][1:])
+            amount_fen = to_fen(row[AMOUNT_COL][1:])
             raw_cat = str(row[TYP_COL]).strip().lower() if row[TYP_COL] else ""
             if "income" in raw_cat or "收入" in raw_cat:
                 p_type = PaymentType.INCOME
@@ -53,16 +61,18 @@ def parse_wechat_file(filepath: str) -> List[Payment]:
 
             payment = Payment(
                 date=datetime.strptime(row[DATE_COL], "%Y-%m-%d %H:%M:%S"),
-                amount=amount,
+                amount_fen=amount_fen,
                 currency="CNY",
                 merchant=row[MERCHANT_COL],
                 source=PaymentSource.WECHAT,
                 type=p_type,
                 note=row[DETAILS_COL] if row[DETAILS_COL] else "",
+                transaction_id=str(row[TRANSACTION_ID_COL] or "").strip(),
             )
             payments.append(payment)
         except Exception as e:
             print(f"Skipping row due to parsing error: {e}")
+            IMPORT_ROWS_SKIPPED.labels(PaymentSource.WECHAT.value).inc()
 
     return payments
 
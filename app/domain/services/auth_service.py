@@ -7,7 +7,9 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from sqlalchemy.orm import Session
 
-from app.data.repositories.user_repository import SessionLocal, get_user_by_username
+from app.data.base import SessionLocal
+from app.data.instrumentation import timed
+from app.data.repositories.user_repository import get_user_by_username
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = os.getenv("SECRET_KEY")
@@ -57,9 +59,10 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    db = SessionLocal()
-    user = get_user_by_username(db, username)
-    db.close()
+    with timed("auth"):
+        db = SessionLocal()
+        user = get_user_by_username(db, username)
+        db.close()
     if user is None:
         raise credentials_exception
     return user
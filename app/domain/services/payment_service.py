@@ -1,14 +1,34 @@
+import base64
 import csv
+import hashlib
 import io
 import os
-import shutil
 import tempfile
-from typing import Any, Dict, List
+from bisect import bisect_right
+from datetime import datetime
+from typing import (
+    Any,
+    AsyncIterable,
+    BinaryIO,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
+import orjson
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
 
-from app.data.repositories.payment_repository import add_payment, create_payment_tables
+from app.data.instrumentation import timed
+from app.data.repositories.analytics_repository import analytics
+from app.data.repositories.payment_repository import (
+    add_payment,
+)
 from app.data.repositories.payment_repository import (
     delete_payments_by_ids as repo_delete_payments_by_ids,
 )
@@ -16,7 +36,17 @@ from app.data.repositories.payment_repository import (
     get_all_child_categories,
     get_all_payments,
     get_category_tree,
+    get_data_versions,
+    get_imported_spans,
+    get_payment_changes,
+    get_payment_rows,
+    get_stored_fingerprints,
+    insert_new_payments,
+    is_file_imported,
+    iter_payment_batches,
+    record_imported_file,
     save_category_tree,
+    search_payments,
 )
 from app.data.repositories.payment_repository import (
     update_merchant_categories as repo_update_merchant_categories,
@@ -24,12 +54,51 @@ from app.data.repositories.payment_repository import (
 from app.data.repositories.payment_repository import (
     update_payment_category as repo_update_payment_category,
 )
-from app.data.repositories.payment_repository import upsert_payments
-from app.domain.helpers.aggregation import build_sankey_data, sum_payments_by_category
-from app.domain.helpers.sum import sum_payments_in_range
+from app.domain.helpers.aggregation import (
+    build_sankey_data,
+    collect_category_paths,
+    roll_up_series,
+    sum_category_totals,
+    sum_payments_by_category,
+)
+from app.domain.helpers.export import (
+    EXPORT_FORMATS,
+    export_arrow,
+    export_ndjson,
+    requires_pyarrow,
+)
+from app.domain.helpers.fingerprint import payment_fingerprint
+from app.domain.helpers.metrics import (
+    IMPORT_DUPLICATES,
+    IMPORT_FILES,
+    IMPORT_ROWS_COVERED,
+    IMPORT_ROWS_INSERTED,
+    IMPORT_ROWS_PARSED,
+    register_result_cache,
+)
+from app.domain.helpers.money import to_fen, to_yuan
+from app.domain.helpers.result_cache import ResultCache
 from app.domain.models.payment import Payment, PaymentSource, PaymentType
 
-create_payment_tables()
+aggregation_cache = ResultCache(
+    max_entries=int(os.getenv("AGGREGATION_CACHE_MAX_ENTRIES", "256")),
+    ttl_seconds=float(os.getenv("AGGREGATION_CACHE_TTL_SECONDS", "300")),
+)
+register_result_cache("aggregation", aggregation_cache)
+FileSource = Union[str, BinaryIO]
+MAX_IMPORT_FILE_BYTES = int(float(os.getenv("MAX_IMPORT_FILE_MB", "20")) * 2**20)
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "10000"))
+INGEST_BATCH_ROWS = int(os.getenv("INGEST_BATCH_ROWS", "1000"))
+MAX_INGEST_LINE_BYTES = 2**16
+
+
+def get_data_version_tag(db: Session, user_id: int) -> str:
+    """
+    Opaque tag that changes whenever the user's payments or category tree
+    change. Reading it costs one primary key lookup.
+    """
+    data_version, tree_version = get_data_versions(db, user_id)
+    return f"{user_id}-{data_version}-{tree_version}"
 
 
 def child_categories(db: Session, user_id: int) -> List[str]:
@@ -48,7 +117,8 @@ def update_category_tree(new_tree: Dict[str, Any], db: Session, user_id: int) ->
     old_child_categories = set(get_all_child_categories(old_tree))
     new_child_categories = set(get_all_child_categories(new_tree))
     deleted_categories = old_child_categories - new_child_categories
-    payments = get_all_payments(db, user_id)
+    # Archived payments are read-only and keep their category
+    payments = get_all_payments(db, user_id, include_archive=False)
     for p in payments:
         if p.category in deleted_categories:
             if p.id is None:
@@ -76,42 +146,155 @@ def update_merchant_categories(
     return count
 
 
-def import_alipay_payments(source_filepath: str, db: Session, user_id: int) -> int:
-    from app.domain.parsers.alipay_parser import parse_alipay_file
+def _content_hash(f: BinaryIO) -> str:
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: f.read(2**20), b""):
+        digest.update(chunk)
+    f.seek(0)
+    return digest.hexdigest()
 
-    payments = parse_alipay_file(source_filepath)
+
+def _import_parsed_payments(
+    payments: List[Payment],
+    source: PaymentSource,
+    db: Session,
+    user_id: int,
+    content_hash: str,
+    filename: str,
+) -> int:
     for p in payments:
         p.user_id = user_id
-    added = upsert_payments(db, payments, user_id)
+    # Rows inside the span of an earlier export of this source are usually
+    # stored already. Only rows whose fingerprint is found are dropped, as the
+    # earlier export may have left some out (e.g. a filtered download). The
+    # rest were looked up once here and are not looked up again on insert.
+    spans = get_imported_spans(db, user_id, source)
+    starts = [first for first, _ in spans]
+
+    def in_span(p: Payment) -> bool:
+        i = bisect_right(starts, p.date) - 1
+        return i >= 0 and p.date <= spans[i][1]
+
+    fingerprints = [payment_fingerprint(p) for p in payments]
+    covered = {f for p, f in zip(payments, fingerprints) if in_span(p)}
+    stored = get_stored_fingerprints(db, user_id, covered)
+    new_payments = [p for p, f in zip(payments, fingerprints) if f not in stored]
+    inserted, _ = insert_new_payments(
+        db, new_payments, user_id, commit=False, checked=covered - stored
+    )
+    added = len(inserted)
+    # Commits the payments and the record together
+    record_imported_file(db, user_id, source, content_hash, filename, payments, added)
+    IMPORT_ROWS_PARSED.labels(source.value).inc(len(payments))
+    IMPORT_ROWS_COVERED.labels(source.value).inc(len(payments) - len(new_payments))
+    IMPORT_ROWS_INSERTED.labels(source.value).inc(added)
+    IMPORT_DUPLICATES.labels(source.value).inc(len(new_payments) - added)
     return added
 
 
-def import_wechat_payments(source_filepath: str, db: Session, user_id: int) -> int:
+def import_alipay_payments(
+    source: FileSource, db: Session, user_id: int, content_hash: str, filename=""
+) -> int:
+    from app.domain.parsers.alipay_parser import parse_alipay_file
+
+    payments = parse_alipay_file(source)
+    return _import_parsed_payments(
+        payments, PaymentSource.ALIPAY, db, user_id, content_hash, filename
+    )
+
+
+def import_wechat_payments(
+    source: FileSource, db: Session, user_id: int, content_hash: str, filename=""
+) -> int:
     from app.domain.parsers.wechat_parser import parse_wechat_file
 
-    payments = parse_wechat_file(source_filepath)
-    for p in payments:
-        p.user_id = user_id
-    added = upsert_payments(db, payments, user_id)
-    return added
+    payments = parse_wechat_file(source)
+    return _import_parsed_payments(
+        payments, PaymentSource.WECHAT, db, user_id, content_hash, filename
+    )
 
 
 def import_tsinghua_card_payments(
-    source_filepath: str, db: Session, user_id: int
+    source: FileSource, db: Session, user_id: int, content_hash: str, filename=""
 ) -> int:
     from app.domain.parsers.tsinghua_card_parser import parse_tsinghua_card_file
 
-    payments = parse_tsinghua_card_file(source_filepath)
-    for p in payments:
-        p.user_id = user_id
-    added = upsert_payments(db, payments, user_id)
-    return added
+    payments = parse_tsinghua_card_file(source)
+    return _import_parsed_payments(
+        payments, PaymentSource.TSINGHUA_CARD, db, user_id, content_hash, filename
+    )
 
 
 def list_payments(db: Session, user_id: int) -> List[Payment]:
     return get_all_payments(db, user_id)
 
 
+def list_payment_rows(db: Session, user_id: int) -> List[tuple]:
+    return get_payment_rows(db, user_id)
+
+
+def list_payment_changes(
+    db: Session, user_id: int, since: Optional[int] = None
+) -> Tuple[int, List[tuple], List[int]]:
+    """
+    Payments changed and ids deleted since the cursor (a data version returned
+    by an earlier call). Without a cursor, all payments are returned.
+    Returns (cursor, rows, deleted_ids), where cursor is the current version.
+    """
+    cursor, _ = get_data_versions(db, user_id)
+    if not since:
+        return cursor, get_payment_rows(db, user_id), []
+    if since > cursor:
+        raise ValueError(f"Unknown cursor: {since}")
+    rows, deleted = get_payment_changes(db, user_id, since, cursor)
+    return cursor, rows, deleted
+
+
+def _encode_search_cursor(row) -> str:
+    raw = f"{row.date.isoformat()}|{row.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_search_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        date_str, id_str = raw.rsplit("|", 1)
+        return datetime.fromisoformat(date_str), int(id_str)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def search_payments_service(
+    db: Session,
+    user_id: int,
+    search: str,
+    start_date=None,
+    end_date=None,
+    category: Optional[str] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+) -> Tuple[List[tuple], Optional[str]]:
+    """
+    Search merchant and note. A parent category matches all its children.
+    Returns the rows and the cursor of the next page (None on the last page).
+    """
+    categories = None
+    if category is not None:
+        tree = get_category_tree(db, user_id)
+        paths = collect_category_paths(tree)
+        # The category itself and every category below it
+        categories = {
+            name for p in paths if category in p for name in p[p.index(category) :]
+        }
+        categories = sorted(categories) or [category]
+    after = _decode_search_cursor(cursor) if cursor else None
+    rows = search_payments(
+        db, user_id, search, start_date, end_date, categories, limit, after
+    )
+    next_cursor = _encode_search_cursor(rows[-1]) if len(rows) == limit else None
+    return rows, next_cursor
+
+
 def get_payments_csv_stream(db: Session, user_id: int):
     payments = get_all_payments(db, user_id)
     output = io.StringIO()
@@ -128,6 +311,7 @@ def get_payments_csv_stream(db: Session, user_id: int):
             "type",
             "note",
             "cust_category",
+            "transaction_id",
         ]
     )
     for p in payments:
@@ -135,7 +319,7 @@ def get_payments_csv_stream(db: Session, user_id: int):
             [
                 p.id,
                 p.date.isoformat(),
-                p.amount,
+                to_yuan(p.amount_fen),
                 p.currency,
                 p.merchant,
                 p.auto_category,
@@ -143,6 +327,7 @@ def get_payments_csv_stream(db: Session, user_id: int):
                 p.type.value if hasattr(p.type, "value") else str(p.type),
                 p.note or "",
                 p.category or "",
+                p.transaction_id or "",
             ]
         )
     output.seek(0)
@@ -153,6 +338,32 @@ def get_payments_csv_stream(db: Session, user_id: int):
     )
 
 
+def get_payments_export_stream(db: Session, user_id: int, export_format: str):
+    """
+    Stream the user's payments as Parquet, an Arrow IPC stream or NDJSON,
+    reading and encoding EXPORT_BATCH_ROWS payments at a time.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+    if requires_pyarrow(export_format):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError(f"The {export_format} export needs pyarrow installed")
+
+    batches = iter_payment_batches(db, user_id, EXPORT_BATCH_ROWS)
+    if export_format == "ndjson":
+        chunks = export_ndjson(batches)
+    else:
+        chunks = export_arrow(batches, export_format)
+    media_type, extension = EXPORT_FORMATS[export_format]
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=payments.{extension}"},
+    )
+
+
 def submit_custom_payment(
     date,
     amount,
@@ -185,7 +396,7 @@ def submit_custom_payment(
 
     payment = Payment(
         date=date,
-        amount=amount,
+        amount_fen=to_fen(amount),
         currency=currency,
         merchant=merchant,
         auto_category="",
@@ -213,43 +424,45 @@ async def import_payment_files_service(
         return {"imported": 0, "errors": ["A type must be specified for each file."]}
 
     import_funcs = {
-        PaymentSource.ALIPAY.value: lambda path: import_alipay_payments(
-            path, db, user_id
-        ),
-        PaymentSource.WECHAT.value: lambda path: import_wechat_payments(
-            path, db, user_id
-        ),
-        PaymentSource.TSINGHUA_CARD.value: lambda path: import_tsinghua_card_payments(
-            path, db, user_id
-        ),
+        PaymentSource.ALIPAY.value: import_alipay_payments,
+        PaymentSource.WECHAT.value: import_wechat_payments,
+        PaymentSource.TSINGHUA_CARD.value: import_tsinghua_card_payments,
     }
 
     imported = 0
     errors = []
     for file, type in zip(files, types):
-        if type not in import_funcs:
-            errors.append(
-                f"{getattr(file, 'filename', str(file))}: Unsupported payment type."
-            )
-            try:
-                file.file.close()
-            except Exception:
-                pass
-            continue
+        filename = getattr(file, "filename", str(file))
         try:
-            filename = getattr(file, "filename", "upload")
-            _, ext = os.path.splitext(filename)
-            with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
-                shutil.copyfileobj(file.file, tmp)
-                tmp_path = tmp.name
-            imported += import_funcs[type](tmp_path)
+            if type not in import_funcs:
+                IMPORT_FILES.labels("unknown", "unsupported").inc()
+                errors.append(f"{filename}: Unsupported payment type.")
+                continue
+            if file.size is not None and file.size > MAX_IMPORT_FILE_BYTES:
+                IMPORT_FILES.labels(type, "too_large").inc()
+                errors.append(
+                    f"{filename}: File exceeds {MAX_IMPORT_FILE_BYTES} bytes."
+                )
+                continue
+            # Parse straight from the upload's spooled file, no extra copy
+            file.file.seek(0)
+            content_hash = _content_hash(file.file)
+            if is_file_imported(db, user_id, content_hash):
+                IMPORT_FILES.labels(type, "already_imported").inc()
+                errors.append(f"{filename}: This file was already imported.")
+                continue
+            imported += import_funcs[type](
+                file.file, db, user_id, content_hash, filename
+            )
+            IMPORT_FILES.labels(type, "ok").inc()
         except Exception as e:
-            errors.append(f"{getattr(file, 'filename', str(file))}: {str(e)}")
+            # Nothing of a failed file is kept
+            db.rollback()
+            IMPORT_FILES.labels(type, "error").inc()
+            errors.append(f"{filename}: {str(e)}")
         finally:
-            try:
-                file.file.close()
-            except Exception:
-                pass
+            # Closing the spool removes its temp file if it rolled over to disk
+            await file.close()
 
     return {"imported": imported, "errors": errors}
 
@@ -257,12 +470,12 @@ async def import_payment_files_service(
 def get_sums_for_ranges_service(
     ranges: Dict[str, Dict[str, Any]], db: Session, user_id: int
 ) -> Dict[str, float]:
-    payments = get_all_payments(db, user_id)
     result = {}
     for name, range_dict in ranges.items():
         start = range_dict.get("start")
         end = range_dict.get("end")
-        result[name] = sum_payments_in_range(payments, start, end)
+        category_sums = analytics.category_sums(db, user_id, start, end)
+        result[name] = to_yuan(sum(total for _, total in category_sums))
     return result
 
 
@@ -286,29 +499,195 @@ def aggregate_payments_sankey(
     return sankey_data
 
 
+def get_aggregation(db: Session, user_id: int, start_date=None, end_date=None):
+    return _cached_aggregation("aggregate", db, user_id, start_date, end_date)
+
+
+def get_sankey_aggregation(db: Session, user_id: int, start_date=None, end_date=None):
+    return _cached_aggregation("sankey", db, user_id, start_date, end_date)
+
+
+def _cached_aggregation(endpoint, db, user_id, start_date, end_date):
+    # Writes bump the data versions, so stale entries are never hit again
+    # and simply age out of the LRU
+    data_version, tree_version = get_data_versions(db, user_id)
+    key = (user_id, data_version, tree_version, start_date, end_date, endpoint)
+
+    def compute():
+        with timed("aggregate"):
+            category_sums = analytics.category_sums(db, user_id, start_date, end_date)
+            category_tree = get_category_tree(db, user_id)
+            result, metadata = sum_category_totals(category_sums, category_tree)
+            if endpoint == "sankey":
+                return build_sankey_data(result, metadata, category_tree)
+            return result, metadata
+
+    return aggregation_cache.get_or_compute(key, compute)
+
+
+def get_payment_series(
+    db: Session,
+    user_id: int,
+    period: str,
+    start_date=None,
+    end_date=None,
+    split_by: Optional[str] = None,
+) -> List[dict]:
+    rows = analytics.sums_by_period(db, user_id, period, start_date, end_date, split_by)
+    category_tree = get_category_tree(db, user_id) if split_by == "category" else {}
+    return roll_up_series(rows, category_tree, split_by)
+
+
 def add_payments_list(
     payments_data: List[dict], db: Session, user_id: int
-) -> List[Payment]:
+) -> Tuple[List[Payment], List[int]]:
     """
-    Add a list of payments to the database.
-    Returns the list of added Payment domain objects.
+    Add a list of payments to the database in a single transaction.
+    All entries are validated before anything is written; duplicates of
+    stored payments (or of earlier entries) are skipped instead of failing.
+    Returns the added Payment domain objects and the indexes of the duplicates.
     """
-    added_payments = []
-    for data in payments_data:
-        payment_type_enum = PaymentType(data["type"])
-        payment_source = PaymentSource(data.get("source", PaymentSource.OTHER.value))
-        payment = Payment(
-            date=data["date"],
-            amount=data["amount"],
-            currency=data["currency"],
-            merchant=data["merchant"],
-            auto_category=data.get("auto_category", ""),
-            category=data.get("category", ""),
-            source=payment_source,
-            type=payment_type_enum,
-            note=data.get("note", ""),
-            user_id=user_id,
+    payments = []
+    errors = []
+    for i, data in enumerate(payments_data):
+        try:
+            payments.append(payment_from_data(data, user_id))
+        except (KeyError, ValueError, ArithmeticError) as e:
+            errors.append(f"Payment {i}: {e}")
+    if errors:
+        raise ValueError("; ".join(errors))
+
+    return insert_new_payments(db, payments, user_id)
+
+
+def payment_from_data(data: dict, user_id: int) -> Payment:
+    return Payment(
+        date=data["date"],
+        amount_fen=to_fen(data["amount"]),
+        currency=data["currency"],
+        merchant=data["merchant"],
+        auto_category=data.get("auto_category") or "",
+        category=data.get("category") or "",
+        source=PaymentSource(data.get("source") or PaymentSource.OTHER.value),
+        type=PaymentType(data["type"]),
+        note=data.get("note") or "",
+        transaction_id=data.get("transaction_id") or "",
+        user_id=user_id,
+    )
+
+
+async def ingest_payment_lines(
+    chunks: AsyncIterable[bytes],
+    parse_line: Callable[[bytes], dict],
+    db: Session,
+    user_id: int,
+) -> BinaryIO:
+    """
+    Validate NDJSON payments line by line and insert them in batches of
+    INGEST_BATCH_ROWS lines, each committed on its own. Returns a spooled file
+    with one NDJSON result per non-empty line: its line number, a status
+    ("added", "duplicate" or "error") and the new id or the error. A line that
+    is too long to be buffered gets an error and ends the ingest, the results
+    of the lines before it are kept.
+    """
+    results = tempfile.SpooledTemporaryFile(max_size=2**20)
+    batch: List[Tuple[int, Any]] = []
+    try:
+        async for line_number, line in _iter_lines(chunks):
+            if isinstance(line, ValueError):
+                batch.append((line_number, line))
+                continue
+            if not line.strip():
+                continue
+            try:
+                batch.append((line_number, parse_line(line)))
+            except ValueError as e:
+                batch.append((line_number, e))
+            if len(batch) >= INGEST_BATCH_ROWS:
+                await run_in_threadpool(_ingest_batch, batch, db, user_id, results)
+                batch = []
+        await run_in_threadpool(_ingest_batch, batch, db, user_id, results)
+    except BaseException:
+        results.close()
+        raise
+    results.seek(0)
+    return results
+
+
+async def _iter_lines(chunks: AsyncIterable[bytes]):
+    """
+    Yield (line number, line) pairs. A line longer than MAX_INGEST_LINE_BYTES
+    is yielded as a ValueError instead. If it is still incomplete, iteration
+    stops there, as the rest of the body cannot be split into lines without
+    buffering it.
+    """
+    buffer = b""
+    line_number = 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if len(line) > MAX_INGEST_LINE_BYTES:
+                yield line_number, _line_too_long(line_number)
+            else:
+                yield line_number, line
+        if len(buffer) > MAX_INGEST_LINE_BYTES:
+            yield line_number + 1, _line_too_long(line_number + 1)
+            return
+    if buffer:
+        yield line_number + 1, buffer
+
+
+def _line_too_long(line_number: int) -> ValueError:
+    return ValueError(
+        f"Line {line_number} is longer than {MAX_INGEST_LINE_BYTES} bytes."
+    )
+
+
+def _ingest_batch(
+    batch: List[Tuple[int, Any]], db: Session, user_id: int, results: BinaryIO
+) -> None:
+    outcomes: Dict[int, dict] = {}
+    payments = []
+    payment_lines = []
+    for line_number, data in batch:
+        if isinstance(data, Exception):
+            outcomes[line_number] = {"status": "error", "error": _error_text(data)}
+            continue
+        try:
+            payments.append(payment_from_data(data, user_id))
+            payment_lines.append(line_number)
+        except (KeyError, ValueError, ArithmeticError) as e:
+            outcomes[line_number] = {"status": "error", "error": _error_text(e)}
+
+    inserted, duplicates = insert_new_payments(db, payments, user_id)
+    duplicate_indexes = set(duplicates)
+    inserted_payments = iter(inserted)
+    for i, line_number in enumerate(payment_lines):
+        if i in duplicate_indexes:
+            outcomes[line_number] = {"status": "duplicate"}
+        else:
+            outcomes[line_number] = {
+                "status": "added",
+                "id": next(inserted_payments).id,
+            }
+
+    for line_number, _ in batch:
+        results.write(
+            orjson.dumps(
+                {"line": line_number, **outcomes[line_number]},
+                option=orjson.OPT_APPEND_NEWLINE,
+            )
+        )
+
+
+def _error_text(error: Exception) -> str:
+    if isinstance(error, KeyError):
+        return f"Missing field {error}"
+    if isinstance(error, ValidationError):
+        return "; ".join(
+            f"{'.'.join(map(str, e['loc'])) or 'line'}: {e['msg']}"
+            for e in error.errors()
         )
-        added = add_payment(db, payment, user_id)
-        added_payments.append(added)
-    return added_payments
+    return str(error)
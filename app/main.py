@@ -1,19 +1,54 @@
+import json
+import logging
 import os
+import time
+from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 
+from app.data.instrumentation import reset_request_stats, start_request_stats
+from app.data.setup_db import setup_db
+from app.domain.helpers.metrics import (
+    REQUEST_DURATION,
+    REQUEST_SQL_DURATION,
+    REQUEST_SQL_QUERIES,
+)
+from app.domain.services.payment_service import MAX_IMPORT_FILE_BYTES
+from app.presentation.metrics_api import router as metrics_router
 from app.presentation.payments_api import router as payments_router
+from app.presentation.upload_limit import UploadSizeLimitMiddleware
 from app.presentation.user_api import router as auth_router
 
 load_dotenv()  # Load environment variables from .env
 
-app = FastAPI(title="Payment API", version="1.0.0")
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger("app.performance")
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+# Set to false when `python -m app.data.setup_db` runs as a separate deploy step
+RUN_MIGRATIONS = os.getenv("RUN_MIGRATIONS", "true").lower() == "true"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if RUN_MIGRATIONS:
+        setup_db()
+    yield
+
+
+app = FastAPI(title="Payment API", version="1.0.0", lifespan=lifespan)
 
 cors_origins = os.getenv("CORS_ORIGINS", "")
 origins = [origin.strip() for origin in cors_origins.split(",") if origin.strip()]
 
+# Added before CORS so that 413 responses still carry CORS headers.
+# Allows up to three files per import plus multipart overhead
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    max_bytes=3 * MAX_IMPORT_FILE_BYTES + 2**16,
+    path_prefix="/api/payments/import",
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -22,5 +57,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def performance_middleware(request: Request, call_next):
+    """
+    Record wall time, SQL queries and rows loaded per request, returned as a
+    Server-Timing header and logged as one JSON line.
+    """
+    stats, token = start_request_stats()
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        reset_request_stats(token)
+    total_ms = (time.perf_counter() - started) * 1000
+    # Label by route template so ids in the path don't create new series
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    REQUEST_DURATION.labels(request.method, route, response.status_code).observe(
+        total_ms / 1000
+    )
+    REQUEST_SQL_DURATION.labels(request.method, route).observe(stats.sql_ms / 1000)
+    REQUEST_SQL_QUERIES.labels(request.method, route).observe(stats.queries)
+    response.headers["Server-Timing"] = stats.server_timing(total_ms)
+    line = json.dumps(
+        {
+            "event": "request",
+            "method": request.method,
+            "path": request.url.path,
+            "route": route,
+            "status": response.status_code,
+            "duration_ms": round(total_ms, 1),
+            "sql_queries": stats.queries,
+            "sql_ms": round(stats.sql_ms, 1),
+            "rows": stats.rows,
+            **{f"{name}_ms": round(ms, 1) for name, ms in stats.spans.items()},
+        }
+    )
+    if total_ms >= SLOW_REQUEST_MS:
+        logger.warning(line)
+    else:
+        logger.info(line)
+    return response
+
+
 app.include_router(auth_router)
 app.include_router(payments_router)
+app.include_router(metrics_router)
@@ -1,23 +1,45 @@
 from datetime import datetime
 from enum import Enum
-from typing import Any, Dict, List, Optional
-
-from fastapi import APIRouter, Body, Depends, File, Form, HTTPException, UploadFile
+from typing import Any, Dict, List, Literal, Optional
+
+import orjson
+from fastapi import (
+    APIRouter,
+    Body,
+    Depends,
+    File,
+    Form,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+)
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field, RootModel
 from sqlalchemy.orm import Session
+from starlette.background import BackgroundTask
 
-from app.data.repositories.payment_repository import SessionLocal
+from app.data.base import SessionLocal, read_session
+from app.data.instrumentation import timed
+from app.domain.helpers.money import to_yuan
 from app.domain.models.payment import Payment
 from app.domain.services.auth_service import get_current_user
 from app.domain.services.payment_service import (
-    aggregate_payments_by_category,
-    aggregate_payments_sankey,
+    get_aggregation,
     get_category_tree,
+    get_data_version_tag,
+    get_payment_series,
     get_payments_csv_stream,
+    get_payments_export_stream,
+    get_sankey_aggregation,
     get_sums_for_ranges_service,
     import_payment_files_service,
+    ingest_payment_lines,
     list_categories,
-    list_payments,
+    list_payment_changes,
+    list_payment_rows,
+    search_payments_service,
     update_category_tree,
     update_merchant_categories,
     update_payment_category,
@@ -68,7 +90,7 @@ class PaymentResponse(BaseModel):
         return PaymentResponse(
             id=p.id,
             date=p.date,
-            amount=p.amount,
+            amount=to_yuan(p.amount_fen),
             currency=p.currency,
             merchant=p.merchant,
             auto_category=p.auto_category,
@@ -90,25 +112,183 @@ def get_db():
         db.close()
 
 
+def get_read_db(current_user=Depends(get_current_user)):
+    """
+    Session for the read-only dashboard endpoints, on the read replica unless
+    the user wrote just before (see read_session).
+    """
+    db = read_session(current_user.id)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def make_etag(db: Session, user_id: int) -> str:
+    """
+    Strong ETag from the user's data versions, for GET endpoints.
+    """
+    return f'"{get_data_version_tag(db, user_id)}"'
+
+
+def etag_headers(etag: str) -> Dict[str, str]:
+    # Responses are per user: allow only private caches, and always revalidate
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+def not_modified_response(etag: str) -> Response:
+    return Response(status_code=304, headers=etag_headers(etag))
+
+
+def payment_row_to_json(row) -> dict:
+    """
+    Same fields as PaymentResponse, built straight from a get_payment_rows row.
+    """
+    return {
+        "id": row.id,
+        "date": row.date,
+        "amount": to_yuan(row.amount_fen),
+        "currency": row.currency,
+        "merchant": row.merchant,
+        "auto_category": row.auto_category or "",
+        "source": row.source.value,
+        "type": row.type.value,
+        "note": row.note or "",
+        "cust_category": row.category or "",
+    }
+
+
 @router.get("", response_model=List[PaymentResponse])
 def get_all_payments_endpoint(
-    db: Session = Depends(get_db), current_user=Depends(get_current_user)
-) -> List[PaymentResponse]:
-    payments = list_payments(db, current_user.id)
-    return [PaymentResponse.from_domain(p) for p in payments]
+    request: Request,
+    db: Session = Depends(get_read_db),
+    current_user=Depends(get_current_user),
+):
+    etag = make_etag(db, current_user.id)
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    rows = list_payment_rows(db, current_user.id)
+    with timed("serialize"):
+        content = orjson.dumps([payment_row_to_json(row) for row in rows])
+    return Response(
+        content=content,
+        media_type="application/json",
+        headers=etag_headers(etag),
+    )
+
+
+class PaymentChangesResponse(BaseModel):
+    cursor: int
+    full: bool
+    upserted: List[PaymentResponse]
+    deleted: List[int]
+
+
+@router.get("/changes", response_model=PaymentChangesResponse)
+def get_payment_changes_endpoint(
+    since: Optional[int] = Query(
+        None, ge=0, description="Cursor returned by the previous call"
+    ),
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user),
+):
+    """
+    Payments inserted or changed and ids deleted after the `since` cursor, up
+    to and including the returned cursor. Without `since`, all payments are
+    returned. Archiving moves payments out of the database without a new
+    version or a tombstone: they disappear from later change sets but are not
+    listed in `deleted`, and a full fetch still returns them.
+    """
+    try:
+        cursor, rows, deleted = list_payment_changes(db, current_user.id, since)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(
+        content=orjson.dumps(
+            {
+                "cursor": cursor,
+                "full": not since,
+                "upserted": [payment_row_to_json(row) for row in rows],
+                "deleted": deleted,
+            }
+        ),
+        media_type="application/json",
+    )
+
+
+class PaymentSearchResponse(BaseModel):
+    items: List[PaymentResponse]
+    next_cursor: Optional[str] = None
+
+
+@router.get("/search", response_model=PaymentSearchResponse)
+def search_payments_endpoint(
+    q: str = Query(..., min_length=1, description="Text in merchant or note"),
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    category: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="next_cursor of the last page"),
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user),
+):
+    try:
+        rows, next_cursor = search_payments_service(
+            db,
+            current_user.id,
+            q,
+            start_date=start_date,
+            end_date=end_date,
+            category=category,
+            limit=limit,
+            cursor=cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(
+        content=orjson.dumps(
+            {
+                "items": [payment_row_to_json(row) for row in rows],
+                "next_cursor": next_cursor,
+            }
+        ),
+        media_type="application/json",
+    )
 
 
 @router.get("/categories", response_model=List[str])
 def get_categories(
-    db: Session = Depends(get_db), current_user=Depends(get_current_user)
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db),
+    current_user=Depends(get_current_user),
 ):
+    etag = make_etag(db, current_user.id)
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    response.headers.update(etag_headers(etag))
     return list_categories(db, current_user.id)
 
 
 @router.get("/categories/tree", response_model=Dict[str, Any])
 def get_categories_tree(
-    db: Session = Depends(get_db), current_user=Depends(get_current_user)
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db),
+    current_user=Depends(get_current_user),
 ):
+    etag = make_etag(db, current_user.id)
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    response.headers.update(etag_headers(etag))
     return get_category_tree(db, current_user.id)
 
 
@@ -145,15 +325,12 @@ def update_payment_cust_category(
 @router.post("/aggregate")
 def aggregate_payments_endpoint(
     req: AggregateRequest,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user=Depends(get_current_user),
 ):
-    payments = list_payments(db, current_user.id)
-    category_tree = get_category_tree(db, current_user.id)
-    result = aggregate_payments_by_category(
-        payments, category_tree, start_date=req.start_date, end_date=req.end_date
+    return get_aggregation(
+        db, current_user.id, start_date=req.start_date, end_date=req.end_date
     )
-    return result
 
 
 class SankeyAggregateRequest(BaseModel):
@@ -164,21 +341,41 @@ class SankeyAggregateRequest(BaseModel):
 @router.post("/aggregate/sankey")
 def aggregate_payments_sankey_endpoint(
     req: SankeyAggregateRequest,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
+    current_user=Depends(get_current_user),
+):
+    return get_sankey_aggregation(
+        db, current_user.id, start_date=req.start_date, end_date=req.end_date
+    )
+
+
+class SeriesRequest(BaseModel):
+    period: Literal["day", "week", "month", "year"] = "month"
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    split_by: Optional[Literal["category", "source"]] = None
+
+
+@router.post("/series")
+def get_payment_series_endpoint(
+    req: SeriesRequest,
+    db: Session = Depends(get_read_db),
     current_user=Depends(get_current_user),
 ):
-    payments = list_payments(db, current_user.id)
-    category_tree = get_category_tree(db, current_user.id)
-    result = aggregate_payments_sankey(
-        payments, category_tree, start_date=req.start_date, end_date=req.end_date
+    return get_payment_series(
+        db,
+        current_user.id,
+        req.period,
+        start_date=req.start_date,
+        end_date=req.end_date,
+        split_by=req.split_by,
     )
-    return result
 
 
 @router.post("/sums")
 def get_sums_for_ranges(
     req: SumsRequest = Body(...),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user=Depends(get_current_user),
 ):
     return get_sums_for_ranges_service(req.root, db, current_user.id)
@@ -212,6 +409,20 @@ def download_all_payments(
     return get_payments_csv_stream(db, current_user.id)
 
 
+@router.get("/export")
+def export_payments(
+    export_format: Literal["parquet", "arrow", "ndjson"] = Query(
+        "parquet", alias="format"
+    ),
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user),
+):
+    try:
+        return get_payments_export_stream(db, current_user.id, export_format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 class SubmitPaymentRequest(BaseModel):
     date: datetime
     amount: float
@@ -221,6 +432,7 @@ class SubmitPaymentRequest(BaseModel):
     source: Optional[str] = None
     note: Optional[str] = ""
     category: Optional[str] = ""
+    transaction_id: Optional[str] = ""
 
 
 @router.post("", response_model=PaymentResponse)
@@ -272,7 +484,15 @@ class BatchPaymentRequest(BaseModel):
     payments: List[SubmitPaymentRequest]
 
 
-@router.post("/batch", response_model=List[PaymentResponse])
+class BatchPaymentResponse(BaseModel):
+    added: List[PaymentResponse]
+    duplicates: List[int] = Field(
+        default_factory=list,
+        description="Indexes of request payments skipped as duplicates",
+    )
+
+
+@router.post("/batch", response_model=BatchPaymentResponse)
 def submit_payments_batch(
     req: BatchPaymentRequest,
     db: Session = Depends(get_db),
@@ -281,11 +501,43 @@ def submit_payments_batch(
     from app.domain.services.payment_service import add_payments_list
 
     payments_data = [p.model_dump() for p in req.payments]
-    # Convert datetime fields if needed
-    for p in payments_data:
-        if isinstance(p["date"], str):
-            from dateutil.parser import parse
-
-            p["date"] = parse(p["date"])
-    added_payments = add_payments_list(payments_data, db, current_user.id)
-    return [PaymentResponse.from_domain(p) for p in added_payments]
+    try:
+        added_payments, duplicates = add_payments_list(
+            payments_data, db, current_user.id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return BatchPaymentResponse(
+        added=[PaymentResponse.from_domain(p) for p in added_payments],
+        duplicates=duplicates,
+    )
+
+
+def _parse_ndjson_payment(line: bytes) -> dict:
+    return SubmitPaymentRequest.model_validate_json(line).model_dump()
+
+
+@router.post("/ingest")
+async def ingest_payments_ndjson(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user),
+):
+    """
+    Streaming alternative to /batch: one SubmitPaymentRequest JSON object per
+    line of an application/x-ndjson body. Responds with one NDJSON result per
+    non-empty line, in order.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.split(";")[0].strip() != "application/x-ndjson":
+        raise HTTPException(
+            status_code=415, detail="Send payments as application/x-ndjson."
+        )
+    results = await ingest_payment_lines(
+        request.stream(), _parse_ndjson_payment, db, current_user.id
+    )
+    return StreamingResponse(
+        iter(lambda: results.read(2**16), b""),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(results.close),
+    )
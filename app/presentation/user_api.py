@@ -2,12 +2,8 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel
 
-from app.data.repositories.user_repository import (
-    SessionLocal,
-    create_user,
-    create_user_table,
-    get_user_by_username,
-)
+from app.data.base import SessionLocal
+from app.data.repositories.user_repository import create_user, get_user_by_username
 from app.domain.services.auth_service import (
     authenticate_user,
     create_access_token,
@@ -53,7 +49,3 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
 @router.get("/me")
 def read_users_me(current_user=Depends(get_current_user)):
     return {"username": current_user.username}
-
-
-# Ensure user table exists at startup
-create_user_table()
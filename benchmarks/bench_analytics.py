@@ -0,0 +1,89 @@
+"""
+Compare the sql and duckdb analytics backends on one user with many payments,
+seeded in chunks so 10M rows fit in memory. Uses a temporary SQLite database
+unless --database-url is given.
+
+    python -m benchmarks.bench_analytics --payments 10000000
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+_tmp_dir = tempfile.mkdtemp()
+os.environ.setdefault("SECRET_KEY", "benchmark")
+# Every query here would be logged as slow
+os.environ.setdefault("SLOW_QUERY_MS", "600000")
+
+SEED_CHUNK = 50_000
+CASES = {
+    "category sums, all time": ("category_sums", (None, None)),
+    "category sums, partial months": (
+        "category_sums",
+        (datetime(2022, 3, 15), datetime(2024, 9, 20)),
+    ),
+    "monthly series": ("sums_by_period", ("month", None, None, None)),
+    "weekly series by category": ("sums_by_period", ("week", None, None, "category")),
+}
+
+
+def seed(db, user_id: int, count: int) -> None:
+    from app.data.repositories.payment_repository import insert_new_payments
+    from benchmarks.generate import generate_payments
+
+    started = time.perf_counter()
+    for chunk, start in enumerate(range(0, count, SEED_CHUNK)):
+        payments = generate_payments(min(SEED_CHUNK, count - start), seed=chunk)
+        insert_new_payments(db, payments, user_id)
+        print(f"\rSeeded {start + len(payments)} payments", end="", flush=True)
+    print(f" in {time.perf_counter() - started:.0f}s")
+
+
+def measure(backend, db, user_id: int, repeat: int) -> None:
+    if backend.name == "duckdb":
+        started = time.perf_counter()
+        backend.snapshot_path(db, user_id)
+        print(f"{'duckdb':<8}{'snapshot':<32}{time.perf_counter() - started:9.2f} s")
+    for name, (method, args) in CASES.items():
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            getattr(backend, method)(db, user_id, *args)
+            samples.append(time.perf_counter() - started)
+        print(f"{backend.name:<8}{name:<32}{statistics.median(samples) * 1000:9.1f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--payments", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--database-url", default=f"sqlite:///{_tmp_dir}/bench.db")
+    args = parser.parse_args()
+    os.environ["DATABASE_URL"] = args.database_url
+
+    from app.data.base import SessionLocal
+    from app.data.repositories.analytics_repository import (
+        DuckDBAnalytics,
+        SqlAnalytics,
+    )
+    from app.data.repositories.user_repository import create_user
+    from app.data.setup_db import setup_db
+
+    setup_db()
+    db = SessionLocal()
+    try:
+        user_id = create_user(db, f"analytics{time.time_ns()}", "!").id
+        seed(db, user_id, args.payments)
+        for backend in (SqlAnalytics(), DuckDBAnalytics(f"{_tmp_dir}/snapshots")):
+            measure(backend, db, user_id, args.repeat)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
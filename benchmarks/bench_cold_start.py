@@ -0,0 +1,126 @@
+"""
+Measure cold start of the API and the command line tools, each in a fresh
+interpreter. The CLIs run without DATABASE_URL to show they no longer need a
+database.
+
+    python -m benchmarks.bench_cold_start [--repeat 5]
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.generate import write_alipay_csv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _env(database_url=None, **extra) -> dict:
+    env = {k: v for k, v in os.environ.items() if k != "DATABASE_URL"}
+    env.setdefault("SECRET_KEY", "benchmark")
+    if database_url:
+        env["DATABASE_URL"] = database_url
+    env.update(extra)
+    return env
+
+
+def run_command(args, env) -> float:
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, *args],
+        cwd=ROOT,
+        env=env,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - started
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_first_response(env) -> float:
+    """
+    Seconds from spawning uvicorn until it answers a request.
+    """
+    port = _free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=1)
+                return time.perf_counter() - started
+            except OSError:
+                if server.poll() is not None:
+                    raise RuntimeError("uvicorn exited during startup")
+                time.sleep(0.01)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def report(name: str, samples) -> None:
+    print(
+        f"{name:<40} min {min(samples) * 1000:8.1f} ms"
+        f"  median {statistics.median(samples) * 1000:8.1f} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    csv_path = write_alipay_csv(os.path.join(tmp_dir, "alipay.csv"), 100)
+    migrated_url = f"sqlite:///{tmp_dir}/migrated.db"
+    run_command(["-m", "app.data.setup_db"], _env(migrated_url))
+
+    def fresh_url(i: int) -> str:
+        return f"sqlite:///{tmp_dir}/fresh{i}.db"
+
+    cases = {
+        "import app.main": lambda i: run_command(
+            ["-c", "import app.main"], _env(migrated_url)
+        ),
+        "uvicorn, first run with migrations": lambda i: time_to_first_response(
+            _env(fresh_url(i))
+        ),
+        "uvicorn, migrated schema": lambda i: time_to_first_response(
+            _env(migrated_url)
+        ),
+        "uvicorn, RUN_MIGRATIONS=false": lambda i: time_to_first_response(
+            _env(migrated_url, RUN_MIGRATIONS="false")
+        ),
+        "setup_db, migrated schema": lambda i: run_command(
+            ["-m", "app.data.setup_db"], _env(migrated_url)
+        ),
+        "alipay_parser CLI, no database": lambda i: run_command(
+            ["-m", "app.domain.parsers.alipay_parser", csv_path], _env()
+        ),
+        "import_payments_csv --help, no database": lambda i: run_command(
+            ["-m", "app.domain.helpers.import_payments_csv", "--help"], _env()
+        ),
+    }
+    for name, case in cases.items():
+        report(name, [case(i) for i in range(args.repeat)])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Compare the payments table unpartitioned and partitioned by hash of user_id or
+by year of date (PAYMENTS_PARTITIONING) on Postgres: table and index sizes,
+VACUUM time after recent updates, and query latency for one user. Payments
+are generated in the database in chunks. Drops and recreates every table, so
+point it at a scratch database.
+
+    python -m benchmarks.bench_partitioning \\
+        --database-url postgresql://user:pw@localhost/scratch --payments 50000000
+"""
+
+import argparse
+import os
+import statistics
+import time
+from datetime import date, datetime
+
+os.environ.setdefault("SECRET_KEY", "benchmark")
+# Every query here would be logged as slow
+os.environ.setdefault("SLOW_QUERY_MS", "600000")
+
+SEED_CHUNK = 1_000_000
+STRATEGIES = ["none", "hash", "range"]
+
+# Ten years of payments spread round-robin over the users
+SEED_SQL = """
+INSERT INTO payments (
+    date, amount_fen, currency, merchant, auto_category, source, type, note,
+    category, transaction_id, fingerprint, change_version, user_id
+)
+SELECT
+    timestamp '2016-01-01' + random() * interval '10 years',
+    1 + (random() * 100000)::bigint,
+    'CNY',
+    'merchant ' || (g % 997),
+    'Uncategorized',
+    (ARRAY['ALIPAY', 'WECHAT', 'TSINGHUA_CARD', 'OTHER'])[1 + g % 4]::paymentsource,
+    (ARRAY['EXPENSE', 'EXPENSE', 'EXPENSE', 'INCOME', 'REFUND'])[1 + g % 5]
+        ::paymenttype,
+    '',
+    (ARRAY['Lunch', 'Dinner', 'Salary', ''])[1 + g % 4],
+    g::text,
+    md5(g::text),
+    0,
+    (CAST(:user_ids AS integer[]))[1 + g % :users]
+FROM generate_series(:first, :last) AS g
+"""
+
+# The parent table and all its partitions
+SIZES_SQL = """
+SELECT sum(pg_table_size(c.oid)), sum(pg_indexes_size(c.oid)), count(*)
+FROM pg_class c
+WHERE c.oid = 'payments'::regclass
+   OR c.oid IN (SELECT inhrelid FROM pg_inherits
+                WHERE inhparent = 'payments'::regclass)
+"""
+
+
+def seed(engine, user_ids, count: int) -> None:
+    from sqlalchemy import text
+
+    started = time.perf_counter()
+    for first in range(0, count, SEED_CHUNK):
+        last = min(first + SEED_CHUNK, count) - 1
+        with engine.begin() as conn:
+            conn.execute(
+                text(SEED_SQL),
+                {
+                    "user_ids": user_ids,
+                    "users": len(user_ids),
+                    "first": first,
+                    "last": last,
+                },
+            )
+        print(f"\rSeeded {last + 1} payments", end="", flush=True)
+    print(f" in {time.perf_counter() - started:.0f}s")
+
+
+def timed_median(function, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+def measure(strategy: str, args) -> None:
+    from sqlalchemy import text
+
+    from app.data.base import Base, SessionLocal, get_engine
+    from app.data.repositories import payment_repository as repo
+    from app.data.repositories.user_repository import create_user
+    from app.data.setup_db import setup_db
+    from benchmarks.generate import generate_payments
+
+    engine = get_engine()
+    Base.metadata.drop_all(bind=engine)
+    repo.PAYMENTS_PARTITIONING = strategy
+    setup_db()
+    db = SessionLocal()
+    try:
+        user_ids = [create_user(db, f"user{i}", "!").id for i in range(args.users)]
+        seed(engine, user_ids, args.payments)
+        repo.rebuild_monthly_summary(db)
+        autocommit = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        with autocommit as conn:
+            conn.execute(text("ANALYZE payments"))
+            table_bytes, index_bytes, tables = conn.execute(text(SIZES_SQL)).one()
+            print(
+                f"{strategy:<6}{'tables':<34}{tables:>10}\n"
+                f"{strategy:<6}{'table size':<34}{table_bytes / 2**20:>10.0f} MB\n"
+                f"{strategy:<6}{'index size':<34}{index_bytes / 2**20:>10.0f} MB"
+            )
+            conn.execute(
+                text(
+                    "UPDATE payments SET note = 'edited'"
+                    " WHERE date >= timestamp '2026-01-01' - interval '30 days'"
+                )
+            )
+            started = time.perf_counter()
+            conn.execute(text("VACUUM payments"))
+            vacuum_s = time.perf_counter() - started
+            print(
+                f"{strategy:<6}{'vacuum after recent updates':<34}{vacuum_s:>10.2f} s"
+            )
+
+        user_id = user_ids[0]
+        queries = {
+            "list one user": lambda: repo.get_payment_rows(db, user_id),
+            "monthly series, one year": lambda: repo.sum_payments_by_period(
+                db, user_id, "month", date(2024, 1, 1), date(2024, 12, 31)
+            ),
+            "category sums, partial months": lambda: repo.get_category_sums(
+                db, user_id, datetime(2022, 3, 15), datetime(2024, 9, 20)
+            ),
+            "weekly series, all time": lambda: repo.sum_payments_by_period(
+                db, user_id, "week"
+            ),
+        }
+        for name, query in queries.items():
+            elapsed = timed_median(query, args.repeat)
+            print(f"{strategy:<6}{name:<34}{elapsed:>10.1f} ms")
+        batches = iter(range(args.repeat))
+        elapsed = timed_median(
+            lambda: repo.insert_new_payments(
+                db, generate_payments(1000, seed=1000 + next(batches)), user_id
+            ),
+            args.repeat,
+        )
+        print(f"{strategy:<6}{'insert 1000 payments':<34}{elapsed:>10.1f} ms")
+    finally:
+        db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--database-url", required=True, help="Scratch Postgres")
+    parser.add_argument("--payments", type=int, default=50_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--strategy", choices=STRATEGIES, action="append")
+    args = parser.parse_args()
+    if not args.database_url.startswith("postgresql"):
+        parser.error("partitioning needs a Postgres --database-url")
+    os.environ["DATABASE_URL"] = args.database_url
+
+    for strategy in args.strategy or STRATEGIES:
+        measure(strategy, args)
+
+
+if __name__ == "__main__":
+    main()
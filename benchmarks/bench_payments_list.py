@@ -0,0 +1,110 @@
+"""
+Compare GET /api/payments against the previous ORM -> Payment -> PaymentResponse
+pipeline on a temporary SQLite database.
+
+    python -m benchmarks.bench_payments_list [--payments 100000]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+_tmp_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp_dir}/bench.db"
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import orjson  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from app.data.repositories.payment_repository import (  # noqa: E402
+    SessionLocal,
+    insert_new_payments,
+)
+from app.data.repositories.user_repository import create_user  # noqa: E402
+from app.data.setup_db import setup_db  # noqa: E402
+from app.domain.models.payment import Payment, PaymentSource, PaymentType  # noqa
+from app.domain.services.payment_service import (  # noqa: E402
+    list_payment_rows,
+    list_payments,
+)
+from app.presentation.payments_api import (  # noqa: E402
+    PaymentResponse,
+    payment_row_to_json,
+)
+
+
+def seed(db, user_id: int, count: int) -> None:
+    start = datetime(2020, 1, 1)
+    batch = []
+    for i in range(count):
+        batch.append(
+            Payment(
+                date=start + timedelta(minutes=7 * i),
+                amount_fen=100 + i % 50000,
+                currency="CNY",
+                merchant=f"商户 {i % 997}",
+                source=PaymentSource.ALIPAY,
+                type=PaymentType.EXPENSE if i % 5 else PaymentType.INCOME,
+                note=f"note {i}",
+                category="Lunch",
+            )
+        )
+        if len(batch) == 5000:
+            insert_new_payments(db, batch, user_id)
+            batch = []
+    insert_new_payments(db, batch, user_id)
+
+
+def legacy_endpoint(db, user_id: int) -> bytes:
+    payments = list_payments(db, user_id)
+    response = [PaymentResponse.from_domain(p) for p in payments]
+    return JSONResponse(content=jsonable_encoder(response)).body
+
+
+def fast_endpoint(db, user_id: int) -> bytes:
+    # The body GET /api/payments sends, without the ETag check
+    rows = list_payment_rows(db, user_id)
+    return orjson.dumps([payment_row_to_json(row) for row in rows])
+
+
+def measure(name: str, func, db, user_id: int) -> None:
+    # Time and memory are measured in separate runs, tracing slows Python down
+    db.expunge_all()
+    started = time.perf_counter()
+    body = func(db, user_id)
+    elapsed = time.perf_counter() - started
+
+    db.expunge_all()
+    tracemalloc.start()
+    func(db, user_id)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:<8} {elapsed * 1000:9.1f} ms  peak {peak / 2**20:8.1f} MiB"
+        f"  body {len(body) / 2**20:6.1f} MiB"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--payments", type=int, default=100_000)
+    args = parser.parse_args()
+
+    setup_db()
+    db = SessionLocal()
+    try:
+        user_id = create_user(db, "benchmark", "x").id
+        seed(db, user_id, args.payments)
+        print(f"{args.payments} payments")
+        measure("legacy", legacy_endpoint, db, user_id)
+        measure("fast", fast_endpoint, db, user_id)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Fixtures for the pytest-benchmark suite. The suite runs against a temporary
+SQLite database; BENCH_ROWS sets the size of every dataset (default 10000).
+
+    pytest benchmarks --benchmark-autosave
+    pytest benchmarks --benchmark-compare
+"""
+
+import itertools
+import os
+import tempfile
+
+_tmp_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp_dir}/bench.db"
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.data.repositories.payment_repository import (  # noqa: E402
+    SessionLocal,
+    insert_new_payments,
+    save_category_tree,
+)
+from app.data.repositories.user_repository import create_user  # noqa: E402
+from app.data.setup_db import setup_db  # noqa: E402
+from app.domain.services.auth_service import create_access_token  # noqa: E402
+from app.main import app  # noqa: E402
+from benchmarks.generate import (  # noqa: E402
+    CATEGORY_TREE,
+    generate_payments,
+    write_exports,
+)
+
+BENCH_ROWS = int(os.getenv("BENCH_ROWS", "10000"))
+
+setup_db()
+
+_usernames = (f"bench{i}" for i in itertools.count())
+
+
+def new_user(db):
+    # Benchmarks authenticate with tokens, the password hash is never checked
+    return create_user(db, next(_usernames), "!")
+
+
+@pytest.fixture(scope="session")
+def rows() -> int:
+    return BENCH_ROWS
+
+
+@pytest.fixture(scope="session")
+def payments(rows):
+    return generate_payments(rows)
+
+
+@pytest.fixture(scope="session")
+def export_files(rows, tmp_path_factory):
+    return write_exports(str(tmp_path_factory.mktemp("exports")), rows)
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture(scope="session")
+def seeded_user(payments):
+    """
+    A user with BENCH_ROWS payments and the generator's category tree.
+    """
+    session = SessionLocal()
+    try:
+        user = new_user(session)
+        user_id, username = user.id, user.username
+        save_category_tree(session, user_id, CATEGORY_TREE)
+        for start in range(0, len(payments), 5000):
+            insert_new_payments(session, payments[start : start + 5000], user_id)
+    finally:
+        session.close()
+    return user_id, username
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def auth_headers(seeded_user):
+    _, username = seeded_user
+    token = create_access_token({"sub": username})
+    return {"Authorization": f"Bearer {token}"}
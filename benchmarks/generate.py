@@ -0,0 +1,234 @@
+"""
+Synthetic payment data shaped like the real exports, for benchmarks and load
+tests. Output is deterministic for a given seed.
+
+    python -m benchmarks.generate --rows 10000 --out /tmp/exports
+"""
+
+import argparse
+import csv
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Iterator, List
+
+import openpyxl
+
+from app.domain.helpers.money import to_fen
+from app.domain.models.payment import Payment, PaymentSource, PaymentType
+
+MERCHANTS = [
+    "美团外卖",
+    "瑞幸咖啡",
+    "滴滴出行",
+    "北京地铁",
+    "京东商城",
+    "盒马鲜生",
+    "全家便利店",
+    "中国移动",
+    "星巴克",
+    "肯德基",
+    "麦当劳",
+    "淘宝",
+    "拼多多",
+    "饿了么",
+    "华联超市",
+]
+ALIPAY_CATEGORIES = ["餐饮美食", "交通出行", "日用百货", "充值缴费", "服饰装扮"]
+CANTEENS = ["观畴园", "桃李园", "紫荆园", "清芬园", "听涛园"]
+
+CATEGORY_TREE = {
+    "Food": {"Breakfast": None, "Lunch": None, "Dinner": None, "Coffee": None},
+    "Transport": {"Metro": None, "Taxi": None},
+    "Shopping": {"Groceries": None, "Online": None},
+    "Bills": {"Phone": None},
+    "Income": {"Salary": None, "Refund": None},
+}
+CATEGORIES = [child for children in CATEGORY_TREE.values() for child in children.keys()]
+
+START = datetime(2022, 1, 1)
+
+
+def _amount(rng: random.Random) -> str:
+    # Mostly small purchases with a long tail, as in real statements
+    return f"{min(rng.lognormvariate(3, 1), 5000):.2f}"
+
+
+def _timestamps(rng: random.Random, count: int) -> Iterator[datetime]:
+    moment = START
+    for _ in range(count):
+        moment += timedelta(seconds=rng.randint(600, 20000))
+        yield moment
+
+
+def generate_payments(count: int, seed: int = 0) -> List[Payment]:
+    """
+    Domain payments across ~3 years, about one income per twenty expenses,
+    mostly categorized.
+    """
+    rng = random.Random(seed)
+    sources = [PaymentSource.ALIPAY, PaymentSource.WECHAT, PaymentSource.TSINGHUA_CARD]
+    payments = []
+    for i, moment in enumerate(_timestamps(rng, count)):
+        income = rng.random() < 0.05
+        payments.append(
+            Payment(
+                date=moment,
+                amount_fen=to_fen(_amount(rng)),
+                currency="CNY",
+                merchant=rng.choice(MERCHANTS),
+                source=rng.choice(sources),
+                type=PaymentType.INCOME if income else PaymentType.EXPENSE,
+                note=f"订单 {i}",
+                category="Salary" if income else rng.choice(CATEGORIES + [""] * 2),
+                transaction_id=f"{seed:04d}{i:012d}",
+            )
+        )
+    return payments
+
+
+def write_alipay_csv(path: str, count: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    with open(path, "w", encoding="gb18030", newline="") as f:
+        f.write(
+            "------------------------支付宝支付科技有限公司------------------------\n"
+        )
+        f.write("导出信息：\n")
+        f.write(f"共{count}笔记录\n")
+        writer = csv.writer(f)
+        writer.writerow(
+            [
+                "交易时间",
+                "交易分类",
+                "交易对方",
+                "对方账号",
+                "商品说明",
+                "收/支",
+                "金额",
+                "收/付款方式",
+                "交易状态",
+                "交易订单号",
+                "商家订单号",
+                "备注",
+            ]
+        )
+        for i, moment in enumerate(_timestamps(rng, count)):
+            kind = rng.choices(["支出", "收入", "不计收支"], [90, 5, 5])[0]
+            writer.writerow(
+                [
+                    moment.strftime("%Y-%m-%d %H:%M:%S"),
+                    rng.choice(ALIPAY_CATEGORIES),
+                    rng.choice(MERCHANTS),
+                    "***@example.com",
+                    f"商品 {i}",
+                    kind,
+                    _amount(rng),
+                    "余额宝",
+                    "交易成功",
+                    f"2022{seed:04d}{i:014d}",
+                    f"M{i:010d}",
+                    "",
+                ]
+            )
+    return path
+
+
+def write_wechat_xlsx(path: str, count: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("微信支付账单明细")
+    ws.append(["微信支付账单明细"])
+    ws.append([f"共{count}笔记录"])
+    ws.append(["----------------------微信支付账单明细列表--------------------"])
+    ws.append(
+        [
+            "交易时间",
+            "交易类型",
+            "交易对方",
+            "商品",
+            "收/支",
+            "金额(元)",
+            "支付方式",
+            "当前状态",
+            "交易单号",
+            "商户单号",
+            "备注",
+        ]
+    )
+    for i, moment in enumerate(_timestamps(rng, count)):
+        income = rng.random() < 0.05
+        ws.append(
+            [
+                moment.strftime("%Y-%m-%d %H:%M:%S"),
+                "转账" if income else "商户消费",
+                rng.choice(MERCHANTS),
+                f"商品 {i}",
+                "收入" if income else "支出",
+                f"¥{_amount(rng)}",
+                "零钱",
+                "支付成功",
+                f"4200{seed:04d}{i:014d}",
+                f"W{i:010d}",
+                "/",
+            ]
+        )
+    wb.save(path)
+    return path
+
+
+def write_tsinghua_xlsx(path: str, count: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("交易明细")
+    ws.append(["清华大学校园卡交易明细"])
+    ws.append(["姓名", "学号"])
+    ws.append(["商户", "金额", "交易时间", "交易类型", "余额"])
+    balance = 500.0
+    day = START
+    for i in range(count):
+        recharge = rng.random() < 0.05
+        day += timedelta(days=1) if i % 3 == 0 else timedelta()
+        # Canteen hours only, the parser rejects night-time transactions
+        moment = day.replace(hour=rng.randint(6, 21), minute=rng.randint(0, 59))
+        amount = 200.0 if recharge else round(rng.uniform(3, 30), 2)
+        balance += amount if recharge else -amount
+        ws.append(
+            [
+                "微信充值" if recharge else rng.choice(CANTEENS),
+                f"{amount:.2f}",
+                moment.strftime("%Y-%m-%d %H:%M:%S"),
+                "微信充值" if recharge else "持卡人消费",
+                f"{balance:.2f}",
+            ]
+        )
+    wb.save(path)
+    return path
+
+
+def write_exports(out_dir: str, count: int, seed: int = 0) -> dict:
+    os.makedirs(out_dir, exist_ok=True)
+    return {
+        PaymentSource.ALIPAY: write_alipay_csv(
+            os.path.join(out_dir, "alipay.csv"), count, seed
+        ),
+        PaymentSource.WECHAT: write_wechat_xlsx(
+            os.path.join(out_dir, "wechat.xlsx"), count, seed
+        ),
+        PaymentSource.TSINGHUA_CARD: write_tsinghua_xlsx(
+            os.path.join(out_dir, "tsinghua_card.xlsx"), count, seed
+        ),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="exports")
+    args = parser.parse_args()
+    for source, path in write_exports(args.out, args.rows, args.seed).items():
+        print(f"{source.value}: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""
+Concurrent load test against a running API. Seeds --users users with
+--payments payments each (idempotent, existing users are reused) and replays
+a dashboard-like request mix, then reports latency percentiles and throughput
+per endpoint.
+
+Start a local stack first, for SQLite:
+    DATABASE_URL=sqlite:///./load.db SECRET_KEY=load uvicorn app.main:app --workers 4
+or against the Postgres container:
+    docker compose -f docker-compose.yml -f docker-compose.override.yml up -d db
+    uvicorn app.main:app --workers 4
+
+then:
+    python -m benchmarks.loadtest --users 20 --payments 5000 --concurrency 32
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Dict, List
+
+import httpx
+
+from app.domain.helpers.money import to_yuan
+from benchmarks.generate import (
+    CATEGORIES,
+    CATEGORY_TREE,
+    generate_payments,
+    write_alipay_csv,
+)
+
+PASSWORD = "loadtest"
+SEED_BATCH = 1000
+IMPORT_ROWS = 50
+
+# Relative weights of the replayed requests
+MIX = {
+    "list": 20,
+    "aggregate": 20,
+    "sankey": 10,
+    "sums": 20,
+    "patch_category": 10,
+    "login": 5,
+    "import": 2,
+}
+
+
+@dataclass
+class LoadUser:
+    username: str
+    token: str = ""
+    payment_ids: List[int] = field(default_factory=list)
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+def _payload(p) -> dict:
+    return {
+        "date": p.date.isoformat(),
+        "amount": to_yuan(p.amount_fen),
+        "currency": p.currency,
+        "merchant": p.merchant,
+        "type": p.type.value,
+        "source": p.source.value,
+        "note": p.note,
+        "category": p.category,
+        "transaction_id": p.transaction_id,
+    }
+
+
+def _month_start(index: int) -> date:
+    return date(2022 + index // 12, index % 12 + 1, 1)
+
+
+def _random_range(rng: random.Random) -> dict:
+    # Whole months, quarters and years of the generated period, or everything.
+    # End dates are inclusive, so a range ends on the last day of its month.
+    months = rng.choice([1, 3, 12, None])
+    if months is None:
+        return {"start_date": None, "end_date": None}
+    start = rng.randrange(36 - months + 1)
+    end = _month_start(start + months) - timedelta(days=1)
+    return {
+        "start_date": f"{_month_start(start)}T00:00:00",
+        "end_date": f"{end}T00:00:00",
+    }
+
+
+async def login(client: httpx.AsyncClient, user: LoadUser) -> httpx.Response:
+    response = await client.post(
+        "/api/auth/token", data={"username": user.username, "password": PASSWORD}
+    )
+    response.raise_for_status()
+    user.token = response.json()["access_token"]
+    return response
+
+
+async def seed_user(
+    client: httpx.AsyncClient, user: LoadUser, index: int, count: int
+) -> None:
+    await client.post(
+        "/api/auth/register", json={"username": user.username, "password": PASSWORD}
+    )
+    await login(client, user)
+    response = await client.get("/api/payments", headers=user.headers)
+    response.raise_for_status()
+    if not response.json():
+        await client.put(
+            "/api/payments/categories/tree",
+            json={"tree": CATEGORY_TREE},
+            headers=user.headers,
+        )
+        payments = generate_payments(count, seed=index)
+        for start in range(0, count, SEED_BATCH):
+            chunk = payments[start : start + SEED_BATCH]
+            batch = await client.post(
+                "/api/payments/batch",
+                json={"payments": [_payload(p) for p in chunk]},
+                headers=user.headers,
+                timeout=120,
+            )
+            batch.raise_for_status()
+        response = await client.get("/api/payments", headers=user.headers)
+    user.payment_ids = [p["id"] for p in response.json()[:500]]
+
+
+def build_import_files(count: int, seed: int) -> List[bytes]:
+    # A new export for each import, identical files are rejected by their hash
+    files = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for i in range(count):
+            path = os.path.join(tmp_dir, f"alipay_{i}.csv")
+            write_alipay_csv(path, IMPORT_ROWS, seed + i)
+            with open(path, "rb") as f:
+                files.append(f.read())
+    return files
+
+
+async def run_request(
+    client: httpx.AsyncClient,
+    name: str,
+    user: LoadUser,
+    rng: random.Random,
+    import_files: List[bytes],
+) -> httpx.Response:
+    if name == "list":
+        return await client.get("/api/payments", headers=user.headers)
+    if name == "aggregate":
+        return await client.post(
+            "/api/payments/aggregate", json=_random_range(rng), headers=user.headers
+        )
+    if name == "sankey":
+        return await client.post(
+            "/api/payments/aggregate/sankey",
+            json=_random_range(rng),
+            headers=user.headers,
+        )
+    if name == "sums":
+        ranges = {}
+        for i in range(4):
+            period = _random_range(rng)
+            ranges[f"r{i}"] = {
+                "start": period["start_date"],
+                "end": period["end_date"],
+            }
+        return await client.post(
+            "/api/payments/sums", json=ranges, headers=user.headers
+        )
+    if name == "patch_category":
+        return await client.patch(
+            f"/api/payments/{rng.choice(user.payment_ids)}/category",
+            json={"cust_category": rng.choice(CATEGORIES)},
+            headers=user.headers,
+        )
+    if name == "login":
+        return await login(client, user)
+    if name == "import":
+        return await client.post(
+            "/api/payments/import",
+            files=[
+                ("files", ("alipay.csv", import_files.pop(), "text/csv")),
+            ],
+            data={"types": "Alipay"},
+            headers=user.headers,
+        )
+    raise ValueError(f"Unknown request: {name}")
+
+
+async def worker(
+    client: httpx.AsyncClient,
+    users: List[LoadUser],
+    deadline: float,
+    seed: int,
+    import_files: List[bytes],
+    results: Dict[str, List[float]],
+    errors: Dict[str, int],
+) -> None:
+    rng = random.Random(seed)
+    names, weights = list(MIX), list(MIX.values())
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        user = rng.choice(users)
+        # Nothing left to import, or no payment to patch (--payments 0 or a
+        # failed list fetch)
+        if name == "import" and not import_files:
+            continue
+        if name == "patch_category" and not user.payment_ids:
+            continue
+        started = time.perf_counter()
+        try:
+            response = await run_request(client, name, user, rng, import_files)
+            failed = response.status_code >= 400
+        except httpx.HTTPError:
+            failed = True
+        results[name].append(time.perf_counter() - started)
+        if failed:
+            errors[name] += 1
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    index = min(len(sorted_values) - 1, int(q / 100 * len(sorted_values)))
+    return sorted_values[index]
+
+
+def report(results: Dict[str, List[float]], errors: Dict[str, int], elapsed: float):
+    header = (
+        f"{'endpoint':<16}{'count':>8}{'errors':>8}{'rps':>9}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    )
+    print(header)
+    print("-" * len(header))
+    everything = []
+    for name in MIX:
+        latencies = sorted(results.get(name, []))
+        if not latencies:
+            continue
+        everything += latencies
+        _print_row(name, latencies, errors[name], elapsed)
+    print("-" * len(header))
+    if everything:
+        _print_row("total", sorted(everything), sum(errors.values()), elapsed)
+
+
+def _print_row(name: str, latencies: List[float], error_count: int, elapsed: float):
+    print(
+        f"{name:<16}{len(latencies):>8}{error_count:>8}"
+        f"{len(latencies) / elapsed:>9.1f}"
+        f"{percentile(latencies, 50) * 1000:>10.1f}"
+        f"{percentile(latencies, 95) * 1000:>10.1f}"
+        f"{percentile(latencies, 99) * 1000:>10.1f}"
+        f"{latencies[-1] * 1000:>10.1f}"
+    )
+
+
+async def main_async(args) -> None:
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(
+        base_url=args.base_url, limits=limits, timeout=args.timeout
+    ) as client:
+        users = [LoadUser(f"{args.user_prefix}{i}") for i in range(args.users)]
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def seed(index: int, user: LoadUser) -> None:
+            async with semaphore:
+                await seed_user(client, user, index, args.payments)
+
+        await asyncio.gather(*(seed(i, u) for i, u in enumerate(users)))
+        print(
+            f"Seeded {args.users} users x {args.payments} payments "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+
+        # Generated up front so that CSV writing does not block the event loop
+        import_files = build_import_files(args.import_files, random.getrandbits(31))
+        results: Dict[str, List[float]] = defaultdict(list)
+        errors: Dict[str, int] = defaultdict(int)
+        print(f"Running for {args.duration}s at concurrency {args.concurrency}")
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(
+            *(
+                worker(client, users, deadline, i, import_files, results, errors)
+                for i in range(args.concurrency)
+            )
+        )
+        report(results, errors, time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--payments", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds")
+    parser.add_argument("--timeout", type=float, default=30, help="Per request")
+    parser.add_argument("--user-prefix", default="loadtest")
+    parser.add_argument(
+        "--import-files",
+        type=int,
+        default=200,
+        help="Alipay exports generated before the run, imports stop when used up",
+    )
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
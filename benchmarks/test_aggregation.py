@@ -0,0 +1,29 @@
+from datetime import datetime
+
+from app.domain.helpers.aggregation import build_sankey_data, sum_payments_by_category
+from app.domain.services.payment_service import get_sums_for_ranges_service
+from benchmarks.generate import CATEGORY_TREE
+
+RANGES = {
+    "all": {"start": None, "end": None},
+    "2022": {"start": datetime(2022, 1, 1), "end": datetime(2022, 12, 31)},
+    "q2_2023": {"start": datetime(2023, 4, 3), "end": datetime(2023, 6, 17)},
+    "march_2024": {"start": datetime(2024, 3, 1), "end": datetime(2024, 3, 31)},
+}
+
+
+def test_sum_payments_by_category(benchmark, payments):
+    result, metadata = benchmark(sum_payments_by_category, payments, CATEGORY_TREE)
+    assert metadata["total sum"]
+
+
+def test_build_sankey_data(benchmark, payments):
+    result, metadata = sum_payments_by_category(payments, CATEGORY_TREE)
+    sankey = benchmark(build_sankey_data, result, metadata, CATEGORY_TREE)
+    assert sankey["links"]
+
+
+def test_get_sums_for_ranges_service(benchmark, db, seeded_user):
+    user_id, _ = seeded_user
+    sums = benchmark(get_sums_for_ranges_service, RANGES, db, user_id)
+    assert set(sums) == set(RANGES)
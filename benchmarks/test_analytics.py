@@ -0,0 +1,41 @@
+import pytest
+
+from app.data.repositories.analytics_repository import SqlAnalytics
+
+PERIOD = (None, None)
+
+
+@pytest.fixture(scope="module", params=["sql", "duckdb"])
+def backend(request, tmp_path_factory):
+    if request.param == "sql":
+        return SqlAnalytics()
+    pytest.importorskip("duckdb")
+    pytest.importorskip("pyarrow")
+    from app.data.repositories.analytics_repository import DuckDBAnalytics
+
+    return DuckDBAnalytics(str(tmp_path_factory.mktemp("snapshots")))
+
+
+def test_category_sums(benchmark, backend, db, seeded_user):
+    user_id, _ = seeded_user
+    sums = benchmark(backend.category_sums, db, user_id, *PERIOD)
+    assert sums
+
+
+def test_category_sums_partial_months(benchmark, backend, db, seeded_user, payments):
+    user_id, _ = seeded_user
+    # The middle half of the generated dates holds data at any BENCH_ROWS and
+    # starts and ends inside a month
+    first = min(p.date for p in payments)
+    span = max(p.date for p in payments) - first
+    sums = benchmark(
+        backend.category_sums, db, user_id, first + span / 4, first + span * 3 / 4
+    )
+    assert sums
+
+
+@pytest.mark.parametrize("split_by", [None, "category"])
+def test_monthly_series(benchmark, backend, db, seeded_user, split_by):
+    user_id, _ = seeded_user
+    rows = benchmark(backend.sums_by_period, db, user_id, "month", None, None, split_by)
+    assert rows
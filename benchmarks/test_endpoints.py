@@ -0,0 +1,86 @@
+import pytest
+
+from app.domain.services.payment_service import aggregation_cache
+
+PERIOD = {"start_date": "2023-01-15T00:00:00", "end_date": "2024-06-20T00:00:00"}
+
+
+def test_list_payments(benchmark, client, auth_headers, rows):
+    response = benchmark(client.get, "/api/payments", headers=auth_headers)
+    assert response.status_code == 200
+    assert len(response.json()) == rows
+
+
+def test_list_payments_not_modified(benchmark, client, auth_headers):
+    etag = client.get("/api/payments", headers=auth_headers).headers["etag"]
+    headers = {**auth_headers, "If-None-Match": etag}
+    response = benchmark(client.get, "/api/payments", headers=headers)
+    assert response.status_code == 304
+
+
+def test_aggregate(benchmark, client, auth_headers):
+    # Clear the result cache each round to time the computation itself
+    response = benchmark.pedantic(
+        client.post,
+        args=("/api/payments/aggregate",),
+        kwargs={"json": PERIOD, "headers": auth_headers},
+        setup=aggregation_cache.clear,
+        rounds=20,
+    )
+    assert response.status_code == 200
+
+
+def test_aggregate_cached(benchmark, client, auth_headers):
+    response = benchmark(
+        client.post, "/api/payments/aggregate", json=PERIOD, headers=auth_headers
+    )
+    assert response.status_code == 200
+
+
+def test_sankey(benchmark, client, auth_headers):
+    response = benchmark.pedantic(
+        client.post,
+        args=("/api/payments/aggregate/sankey",),
+        kwargs={"json": PERIOD, "headers": auth_headers},
+        setup=aggregation_cache.clear,
+        rounds=20,
+    )
+    assert response.status_code == 200
+
+
+def test_sums(benchmark, client, auth_headers):
+    ranges = {
+        "all": {"start": None, "end": None},
+        "period": {"start": PERIOD["start_date"], "end": PERIOD["end_date"]},
+    }
+    response = benchmark(
+        client.post, "/api/payments/sums", json=ranges, headers=auth_headers
+    )
+    assert response.status_code == 200
+
+
+def test_search(benchmark, client, auth_headers):
+    response = benchmark(
+        client.get, "/api/payments/search", params={"q": "咖啡"}, headers=auth_headers
+    )
+    assert response.status_code == 200
+
+
+def test_download_csv(benchmark, client, auth_headers):
+    response = benchmark(client.get, "/api/payments/download", headers=auth_headers)
+    assert response.status_code == 200
+    benchmark.extra_info["bytes"] = len(response.content)
+
+
+@pytest.mark.parametrize("export_format", ["parquet", "arrow", "ndjson"])
+def test_export(benchmark, client, auth_headers, export_format):
+    if export_format != "ndjson":
+        pytest.importorskip("pyarrow")
+    response = benchmark(
+        client.get,
+        "/api/payments/export",
+        params={"format": export_format},
+        headers=auth_headers,
+    )
+    assert response.status_code == 200
+    benchmark.extra_info["bytes"] = len(response.content)
@@ -0,0 +1,36 @@
+import pytest
+
+from app.domain.models.payment import PaymentSource
+from app.domain.parsers.alipay_parser import parse_alipay_file, parse_alipay_rows
+from app.domain.parsers.tsinghua_card_parser import parse_tsinghua_card_file
+from app.domain.parsers.wechat_parser import parse_wechat_file
+
+
+def test_parse_alipay_csv(benchmark, export_files, rows):
+    payments = benchmark(parse_alipay_file, export_files[PaymentSource.ALIPAY])
+    assert len(payments) == rows
+
+
+def test_parse_alipay_csv_rows(benchmark, export_files, rows):
+    payments = benchmark(parse_alipay_rows, export_files[PaymentSource.ALIPAY])
+    assert len(payments) == rows
+
+
+def test_parse_alipay_csv_arrow(benchmark, export_files, rows):
+    pytest.importorskip("pyarrow")
+    from app.domain.parsers.alipay_arrow_parser import parse_alipay_arrow
+
+    payments = benchmark(parse_alipay_arrow, export_files[PaymentSource.ALIPAY])
+    assert len(payments) == rows
+
+
+def test_parse_wechat_xlsx(benchmark, export_files, rows):
+    payments = benchmark(parse_wechat_file, export_files[PaymentSource.WECHAT])
+    assert len(payments) == rows
+
+
+def test_parse_tsinghua_card_xlsx(benchmark, export_files, rows):
+    payments = benchmark(
+        parse_tsinghua_card_file, export_files[PaymentSource.TSINGHUA_CARD]
+    )
+    assert len(payments) == rows
@@ -0,0 +1,19 @@
+import copy
+
+from app.data.repositories.payment_repository import upsert_payments
+from benchmarks.conftest import new_user
+
+
+def test_upsert_new_payments(benchmark, db, payments):
+    def setup():
+        # A fresh user per round so every payment is a new row
+        return (db, copy.deepcopy(payments), new_user(db).id), {}
+
+    added = benchmark.pedantic(upsert_payments, setup=setup, rounds=3)
+    assert added == len(payments)
+
+
+def test_upsert_duplicate_payments(benchmark, db, payments, seeded_user):
+    user_id, _ = seeded_user
+    added = benchmark(upsert_payments, db, payments, user_id)
+    assert added == 0
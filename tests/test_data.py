@@ -0,0 +1,546 @@
+import io
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/test.db")
+os.environ.setdefault("SECRET_KEY", "test")
+
+import pytest  # noqa: E402
+from sqlalchemy import select  # noqa: E402
+
+from app.data.base import SessionLocal  # noqa: E402
+from app.data.repositories import archive_repository  # noqa: E402
+from app.data.repositories.analytics_repository import SqlAnalytics  # noqa: E402
+from app.data.repositories.payment_repository import (  # noqa: E402
+    PaymentMonthlySummaryORM,
+    archive_payments,
+    delete_payments_by_ids,
+    get_all_payments,
+    get_category_sums,
+    get_payment_rows,
+    insert_new_payments,
+    iter_payment_batches,
+    rebuild_monthly_summary,
+    search_payments,
+    sum_payments_by_period,
+    update_merchant_categories,
+    update_payment_category,
+)
+from app.data.repositories.user_repository import create_user  # noqa: E402
+from app.data.setup_db import setup_db  # noqa: E402
+from app.domain.helpers.aggregation import (  # noqa: E402
+    roll_up_series,
+    sum_category_totals,
+    sum_payments_by_category,
+)
+from app.domain.models.payment import Payment, PaymentSource, PaymentType  # noqa
+
+CATEGORY_TREE = {"Food": {"Lunch": None, "Dinner": None}, "Income": {"Salary": None}}
+CATEGORIES = ["Lunch", "Dinner", "Salary", "", "Unknown"]
+
+RANGES = [
+    (None, None),
+    (datetime(2024, 1, 15), datetime(2024, 3, 10)),
+    (datetime(2024, 2, 1), datetime(2024, 2, 29)),
+    (None, datetime(2024, 2, 10)),
+    (datetime(2024, 3, 5, 18, 30), None),
+]
+
+
+@pytest.fixture(scope="module")
+def analytics_data(tmp_path_factory):
+    pytest.importorskip("duckdb")
+    pytest.importorskip("pyarrow")
+    from app.data.repositories.analytics_repository import DuckDBAnalytics
+
+    setup_db()
+    db = SessionLocal()
+    rng = random.Random(0)
+    start = datetime(2023, 12, 1)
+    user_id = create_user(db, f"analytics{rng.random()}", "!").id
+    payments = [
+        Payment(
+            date=start + timedelta(minutes=rng.randrange(200 * 24 * 60)),
+            amount_fen=rng.randrange(1, 100000),
+            currency="CNY",
+            merchant=f"merchant {i % 13}",
+            source=rng.choice(list(PaymentSource)),
+            type=rng.choice(list(PaymentType)),
+            category=rng.choice(CATEGORIES),
+            transaction_id=str(i),
+        )
+        for i in range(3000)
+    ]
+    insert_new_payments(db, payments, user_id)
+    duckdb_analytics = DuckDBAnalytics(str(tmp_path_factory.mktemp("snapshots")))
+    yield db, user_id, payments, duckdb_analytics
+    db.close()
+
+
+@pytest.mark.parametrize("start_date,end_date", RANGES)
+def test_duckdb_category_sums_match_python(analytics_data, start_date, end_date):
+    db, user_id, payments, duckdb_analytics = analytics_data
+    expected = sum_payments_by_category(payments, CATEGORY_TREE, start_date, end_date)
+    for backend in (SqlAnalytics(), duckdb_analytics):
+        category_sums = backend.category_sums(db, user_id, start_date, end_date)
+        assert sum_category_totals(category_sums, CATEGORY_TREE) == expected
+
+
+@pytest.mark.parametrize("period", ["day", "week", "month", "year"])
+@pytest.mark.parametrize("split_by", [None, "category", "source"])
+def test_duckdb_series_match_sql(analytics_data, period, split_by):
+    db, user_id, _, duckdb_analytics = analytics_data
+    for start_date, end_date in RANGES:
+        expected = SqlAnalytics().sums_by_period(
+            db, user_id, period, start_date, end_date, split_by
+        )
+        rows = duckdb_analytics.sums_by_period(
+            db, user_id, period, start_date, end_date, split_by
+        )
+        assert roll_up_series(rows, CATEGORY_TREE, split_by) == roll_up_series(
+            expected, CATEGORY_TREE, split_by
+        )
+
+
+def test_duckdb_snapshot_follows_writes(analytics_data):
+    db, user_id, payments, duckdb_analytics = analytics_data
+    before = duckdb_analytics.snapshot_path(db, user_id)
+    extra = Payment(
+        date=datetime(2024, 2, 2, 12),
+        amount_fen=12345,
+        currency="CNY",
+        merchant="late write",
+        source=PaymentSource.OTHER,
+        type=PaymentType.EXPENSE,
+        category="Lunch",
+    )
+    insert_new_payments(db, [extra], user_id)
+    after = duckdb_analytics.snapshot_path(db, user_id)
+    assert after != before and not os.path.exists(before)
+    expected = sum_payments_by_category(payments + [extra], CATEGORY_TREE)
+    category_sums = duckdb_analytics.category_sums(db, user_id)
+    assert sum_category_totals(category_sums, CATEGORY_TREE) == expected
+
+
+def _expected_period_sums(payments, period, start_date=None, end_date=None):
+    from app.domain.helpers.sum import get_signed_amount
+
+    totals = {}
+    for p in payments:
+        day = p.date.date()
+        if start_date and day < start_date.date() or end_date and day > end_date.date():
+            continue
+        if period == "week":
+            day -= timedelta(days=day.weekday())
+        elif period == "month":
+            day = day.replace(day=1)
+        elif period == "year":
+            day = day.replace(month=1, day=1)
+        totals[day.isoformat()] = totals.get(day.isoformat(), 0) + get_signed_amount(p)
+    return totals
+
+
+@pytest.mark.parametrize("start_date,end_date", RANGES)
+@pytest.mark.parametrize("period", ["day", "week", "month", "year"])
+def test_period_sums_match_signed_amounts(analytics_data, period, start_date, end_date):
+    db, user_id, _, _ = analytics_data
+    rows = sum_payments_by_period(db, user_id, period, start_date, end_date)
+    payments = get_all_payments(db, user_id)
+    expected = _expected_period_sums(payments, period, start_date, end_date)
+    assert {bucket: total for bucket, _, total in rows} == expected
+
+
+def test_period_sums_start_weeks_on_monday_and_include_the_end_day():
+    setup_db()
+    db = SessionLocal()
+    try:
+        user_id = create_user(db, f"weeks{random.random()}", "!").id
+        dates = [
+            datetime(2024, 3, 3, 23, 59),  # Sunday
+            datetime(2024, 3, 4),  # Monday
+            datetime(2024, 3, 10, 23, 59, 59),  # Sunday, the end day
+            datetime(2024, 3, 11),  # Monday after the end day
+        ]
+        payments = [
+            Payment(
+                date=date,
+                amount_fen=100 * (i + 1),
+                currency="CNY",
+                merchant="weeks",
+                source=PaymentSource.OTHER,
+                type=PaymentType.EXPENSE,
+                transaction_id=str(i),
+            )
+            for i, date in enumerate(dates)
+        ]
+        insert_new_payments(db, payments, user_id)
+        rows = sum_payments_by_period(
+            db, user_id, "week", datetime(2024, 3, 1), datetime(2024, 3, 10, 12)
+        )
+        assert sorted((bucket, total) for bucket, _, total in rows) == [
+            ("2024-02-26", -100),
+            ("2024-03-04", -500),
+        ]
+    finally:
+        db.close()
+
+
+def _search_all(db, user_id, search, start_date=None, end_date=None):
+    # Page through with a limit that does not divide the result count
+    ids, after = [], None
+    while True:
+        rows = search_payments(
+            db, user_id, search, start_date, end_date, limit=97, after=after
+        )
+        ids += [row.id for row in rows]
+        if len(rows) < 97:
+            return ids
+        after = (rows[-1].date, rows[-1].id)
+
+
+def test_archived_payments_are_still_read(analytics_data, monkeypatch, tmp_path):
+    db, _, payments, duckdb_analytics = analytics_data
+    monkeypatch.setattr(archive_repository, "PAYMENT_ARCHIVE_DIR", str(tmp_path))
+    user_id = create_user(db, f"archive{random.random()}", "!").id
+    insert_new_payments(db, payments, user_id)
+
+    def snapshot():
+        return (
+            # Archived rows carry extra columns at the end
+            sorted(tuple(row)[:10] for row in get_payment_rows(db, user_id)),
+            sorted(
+                tuple(row)[:11]
+                for batch in iter_payment_batches(db, user_id, 500)
+                for row in batch
+            ),
+            sorted(repr(p) for p in get_all_payments(db, user_id)),
+            [set(get_category_sums(db, user_id, *r)) for r in RANGES],
+            [_search_all(db, user_id, "chant 1", *r) for r in RANGES],
+            [
+                set(sum_payments_by_period(db, user_id, period, *r, split_by))
+                for period in ("day", "week", "month", "year")
+                for split_by in (None, "category", "source")
+                for r in RANGES
+            ],
+        )
+
+    expected = snapshot()
+    archived = archive_payments(db, user_id, datetime(2024, 2, 1))
+    assert 0 < archived < len(payments)
+    assert len(get_all_payments(db, user_id, include_archive=False)) == (
+        len(payments) - archived
+    )
+    assert snapshot() == expected
+    rebuild_monthly_summary(db, user_id)
+    assert snapshot() == expected
+    assert set(duckdb_analytics.category_sums(db, user_id)) == expected[3][0]
+
+    inserted, duplicates = insert_new_payments(db, payments, user_id)
+    assert inserted == [] and len(duplicates) == len(payments)
+
+    # Archived payments are read-only, a write naming one changes nothing
+    rows = sorted(get_payment_rows(db, user_id), key=lambda row: row.date)
+    archived_id, live_id = rows[0].id, rows[-1].id
+    for write in (
+        lambda: delete_payments_by_ids(db, [live_id, archived_id], user_id),
+        lambda: update_payment_category(db, archived_id, user_id, "Lunch"),
+        lambda: update_merchant_categories(db, archived_id, user_id, "Lunch"),
+    ):
+        with pytest.raises(ValueError, match="read-only"):
+            write()
+    assert snapshot() == expected
+
+    # Exports read the archive one month partition at a time
+    import pyarrow.parquet as pq
+
+    paths = []
+    read_table = pq.read_table
+    monkeypatch.setattr(
+        pq, "read_table", lambda path: paths.append(path) or read_table(path)
+    )
+    next(iter_payment_batches(db, user_id, 500))
+    assert len(paths) == 1
+
+
+def test_failed_archive_run_reads_no_payment_twice(
+    analytics_data, monkeypatch, tmp_path
+):
+    db, _, payments, _ = analytics_data
+    monkeypatch.setattr(archive_repository, "PAYMENT_ARCHIVE_DIR", str(tmp_path))
+    user_id = create_user(db, f"archive{random.random()}", "!").id
+    # Imported after the first run, so still in the table below its watermark
+    late = [
+        p
+        for i, p in enumerate(payments)
+        if i % 10 == 0 and p.date < datetime(2024, 2, 1)
+    ]
+    insert_new_payments(db, [p for p in payments if p not in late], user_id)
+    archive_payments(db, user_id, datetime(2024, 2, 1))
+    insert_new_payments(db, late, user_id)
+
+    def ids():
+        listed = [row.id for row in get_payment_rows(db, user_id)]
+        exported = [
+            row.id for batch in iter_payment_batches(db, user_id, 500) for row in batch
+        ]
+        assert sorted(listed) == sorted(exported)
+        return sorted(listed)
+
+    expected = ids()
+    assert len(set(expected)) == len(payments)
+
+    def fail():
+        raise RuntimeError("commit failed")
+
+    # The second run writes its partitions, then fails to commit
+    with monkeypatch.context() as m:
+        m.setattr(db, "commit", fail)
+        with pytest.raises(RuntimeError):
+            archive_payments(db, user_id, datetime(2024, 3, 1))
+    db.rollback()
+    assert ids() == expected
+    assert archive_payments(db, user_id, datetime(2024, 3, 1)) > len(late)
+    assert ids() == expected
+
+
+def test_monthly_summary_follows_every_write(monkeypatch, tmp_path):
+    from app.domain.helpers.sum import get_signed_amount
+
+    monkeypatch.setattr(archive_repository, "PAYMENT_ARCHIVE_DIR", str(tmp_path))
+    setup_db()
+    db = SessionLocal()
+    rng = random.Random(1)
+    start = datetime(2024, 1, 1)
+
+    def payments(count, offset):
+        return [
+            Payment(
+                date=start + timedelta(minutes=rng.randrange(120 * 24 * 60)),
+                amount_fen=rng.randrange(1, 10000),
+                currency="CNY",
+                merchant=f"merchant {i % 7}",
+                source=rng.choice(list(PaymentSource)),
+                type=rng.choice(list(PaymentType)),
+                category=rng.choice(CATEGORIES),
+                transaction_id=str(offset + i),
+            )
+            for i in range(count)
+        ]
+
+    def summary():
+        # One row per month, category, source and type
+        return set(
+            db.execute(
+                select(
+                    PaymentMonthlySummaryORM.month,
+                    PaymentMonthlySummaryORM.category,
+                    PaymentMonthlySummaryORM.source,
+                    PaymentMonthlySummaryORM.type,
+                    PaymentMonthlySummaryORM.amount_fen,
+                    PaymentMonthlySummaryORM.payment_count,
+                ).where(PaymentMonthlySummaryORM.user_id == user_id)
+            ).all()
+        )
+
+    def assert_matches_payments():
+        stored = get_payment_rows(db, user_id)
+        groups, by_category = {}, {}
+        for row in stored:
+            category = row.category or ""
+            key = (row.date.date().replace(day=1), category, row.source, row.type)
+            amount, count = groups.get(key, (0, 0))
+            groups[key] = (amount + row.amount_fen, count + 1)
+            by_category[category] = by_category.get(category, 0) + get_signed_amount(
+                row
+            )
+        assert summary() == {key + total for key, total in groups.items()}
+        # Whole months are answered from the summary alone
+        sums = get_category_sums(
+            db, user_id, datetime(2024, 1, 1), datetime(2024, 6, 30)
+        )
+        assert {c: t for c, t in sums if t} == {
+            c: t for c, t in by_category.items() if t
+        }
+        incremental = summary()
+        rebuild_monthly_summary(db, user_id)
+        assert summary() == incremental
+
+    try:
+        user_id = create_user(db, f"summary{random.random()}", "!").id
+        insert_new_payments(db, payments(400, 0), user_id)
+        assert_matches_payments()
+
+        rows = get_payment_rows(db, user_id)
+        update_payment_category(db, rows[0].id, user_id, "Dinner")
+        assert_matches_payments()
+        update_merchant_categories(db, rows[1].id, user_id, "Salary")
+        assert_matches_payments()
+        delete_payments_by_ids(db, [row.id for row in rows[2:40]], user_id)
+        assert_matches_payments()
+        assert archive_payments(db, user_id, datetime(2024, 3, 1)) > 0
+        assert_matches_payments()
+        insert_new_payments(db, payments(100, 400), user_id)
+        assert_matches_payments()
+    finally:
+        db.close()
+
+
+@pytest.fixture(scope="module")
+def search_data():
+    setup_db()
+    db = SessionLocal()
+    user_id = create_user(db, f"search{random.random()}", "!").id
+    merchants = ["星巴克咖啡", "Coffee 50%_off", "瑞幸咖啡", "book store", "咖"]
+    payments = [
+        Payment(
+            date=datetime(2024, 5, 1) + timedelta(hours=i),
+            amount_fen=100 + i,
+            currency="CNY",
+            merchant=merchants[i % len(merchants)],
+            source=PaymentSource.OTHER,
+            type=PaymentType.EXPENSE,
+            note="weekly coffee" if i % 4 == 0 else "",
+            transaction_id=str(i),
+        )
+        for i in range(40)
+    ]
+    insert_new_payments(db, payments, user_id)
+    yield db, user_id
+    db.close()
+
+
+def _expected_search(db, user_id, search):
+    rows = [
+        row
+        for row in get_payment_rows(db, user_id)
+        if search.lower() in row.merchant.lower() or search.lower() in row.note.lower()
+    ]
+    return sorted((row.id for row in rows), key=lambda i: -i)
+
+
+@pytest.mark.parametrize("search", ["咖啡", "星巴克", "coffee", "50%_", "_", "none"])
+@pytest.mark.parametrize("trigram", [True, False])
+def test_search_matches_substrings(search_data, monkeypatch, search, trigram):
+    from app.data.repositories import payment_repository
+
+    db, user_id = search_data
+    if trigram and not payment_repository.SQLITE_HAS_TRIGRAM:
+        pytest.skip("SQLite is older than 3.34")
+    monkeypatch.setattr(payment_repository, "SQLITE_HAS_TRIGRAM", trigram)
+    # Ids grow with the date here, so newest first is descending ids
+    rows = search_payments(db, user_id, search, limit=100)
+    assert [row.id for row in rows] == _expected_search(db, user_id, search)
+
+
+def test_search_pages_by_keyset(search_data):
+    db, user_id = search_data
+    pages, after = [], None
+    while True:
+        rows = search_payments(db, user_id, "咖啡", limit=7, after=after)
+        pages.append([row.id for row in rows])
+        if len(rows) < 7:
+            break
+        after = (rows[-1].date, rows[-1].id)
+    assert len(pages) > 2
+    assert sum(pages, []) == _expected_search(db, user_id, "咖啡")
+    rows = search_payments(
+        db, user_id, "coffee", datetime(2024, 5, 1), datetime(2024, 5, 1), limit=100
+    )
+    assert {row.date.date() for row in rows} == {datetime(2024, 5, 1).date()}
+
+
+def test_search_by_parent_category_includes_the_parent(search_data):
+    from app.data.repositories.payment_repository import save_category_tree
+    from app.domain.services.payment_service import search_payments_service
+
+    db, user_id = search_data
+    save_category_tree(db, user_id, CATEGORY_TREE)
+    ids = [row.id for row in search_payments(db, user_id, "咖", limit=100)]
+    for payment_id, category in zip(ids, ["Food", "Lunch", "Dinner", "Salary"]):
+        update_payment_category(db, payment_id, user_id, category)
+
+    rows, _ = search_payments_service(db, user_id, "咖", category="Food")
+    assert [row.id for row in rows] == ids[:3]
+    rows, _ = search_payments_service(db, user_id, "咖", category="Lunch")
+    assert [row.id for row in rows] == ids[1:2]
+
+
+LEGACY_PAYMENTS_DDL = """
+CREATE TABLE payments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date DATETIME NOT NULL,
+    amount FLOAT NOT NULL,
+    currency VARCHAR NOT NULL,
+    merchant VARCHAR NOT NULL,
+    auto_category VARCHAR,
+    source VARCHAR(13) NOT NULL,
+    type VARCHAR(7) NOT NULL,
+    note VARCHAR,
+    category VARCHAR,
+    user_id INTEGER NOT NULL REFERENCES users (id)
+)
+"""
+
+
+def test_migrated_payments_match_reimported_statement(tmp_path, monkeypatch):
+    from sqlalchemy import create_engine, text
+
+    from app.data import base
+    from app.domain.parsers.alipay_parser import parse_alipay_file
+
+    monkeypatch.setitem(
+        base._engines, "primary", create_engine(f"sqlite:///{tmp_path}/legacy.db")
+    )
+    statement = (
+        "支付宝交易明细\n"
+        "交易时间,交易分类,交易对方,对方账号,商品说明,收/支,金额,收/付款方式,"
+        "交易状态,交易订单号\n"
+        "2024-05-01 12:00:00,餐饮美食,食堂,-,午饭,支出,12.50,余额,交易成功,T1\n"
+        "2024-05-01 18:00:00,餐饮美食,食堂,-,晚饭,支出,8.00,余额,交易成功,T2\n"
+    ).encode("gb18030")
+    with base.get_engine().begin() as conn:
+        conn.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY)"))
+        conn.execute(text("INSERT INTO users (id) VALUES (1)"))
+        conn.execute(text(LEGACY_PAYMENTS_DDL))
+        conn.execute(
+            text(
+                "INSERT INTO payments (date, amount, currency, merchant, source,"
+                " type, note, category, user_id) VALUES"
+                " ('2024-05-01 12:00:00.000000', 12.5, 'CNY', '食堂', 'ALIPAY',"
+                " 'EXPENSE', '', '', 1)"
+            )
+        )
+    setup_db()
+
+    db = SessionLocal()
+    try:
+        # The migrated lunch is matched and takes over T1, then both match
+        for expected in (["T2"], []):
+            payments = parse_alipay_file(io.BytesIO(statement))
+            inserted, _ = insert_new_payments(db, payments, 1)
+            assert [p.transaction_id for p in inserted] == expected
+        stored = get_all_payments(db, 1)
+        assert sorted(p.transaction_id for p in stored) == ["T1", "T2"]
+    finally:
+        db.close()
+
+
+def test_versions_start_at_one_and_count_writes():
+    from app.data.repositories.payment_repository import (
+        _bump_version,
+        get_data_versions,
+    )
+
+    setup_db()
+    db = SessionLocal()
+    try:
+        user_id = create_user(db, f"versions{random.random()}", "!").id
+        assert get_data_versions(db, user_id) == (0, 0)
+        assert _bump_version(db, user_id, tree=True) == 1
+        assert [_bump_version(db, user_id) for _ in range(3)] == [1, 2, 3]
+        db.commit()
+        assert get_data_versions(db, user_id) == (3, 1)
+    finally:
+        db.close()
@@ -0,0 +1,168 @@
+import io
+import os
+import threading
+
+import pytest
+
+from app.domain.helpers.money import to_fen
+from app.domain.parsers.alipay_parser import parse_alipay_rows
+
+ALIPAY_EXPORT = (
+    "支付宝交易明细\n"
+    "交易时间,交易分类,交易对方,对方账号,商品说明,收/支,金额,收/付款方式,"
+    "交易状态,交易订单号\n"
+    "2025-01-01 10:00:00,退款,食堂,-,午饭,不计收支,0.005,余额,退款成功, T1 \n"
+    "2025-01-01 10:00:01,转账,Bob,-,还钱,Income,-0.005,余额,交易成功,T2\n"
+    "2025-01-01 10:00:02,餐饮美食,食堂,-,午饭,支出,0,余额,交易成功,T3\n"
+    "not-a-date,餐饮美食,食堂,-,午饭,支出,1,余额,交易成功,T4\n"
+    '2025-01-01 10:00:03,餐饮美食,"食堂, 二楼",-,午饭,支出,abc,余额,交易成功,T5\n'
+    "2025-01-01 10:00:04,日用百货,超市,-,纸巾,支出,12.345,余额,交易成功,T6\n"
+    "2025-01-01 10:00:05,日用百货,超市,-,纸巾,支出,1.5\n"
+    "------------------------------------\n"
+    '2025-01-01 10:00:06,餐饮美食,"食堂, 二楼",-,晚饭,支出, 3.10 ,余额,交易成功,T7\n'
+    # Amounts that are not plain decimals but that to_fen reads
+    "2025-01-01 10:00:08,餐饮美食,食堂,-,午饭,支出,1e2,余额,交易成功,T9\n"
+    "2025-01-01 10:00:09,餐饮美食,食堂,-,午饭,支出,.5,余额,交易成功,T10\n"
+    "2025-01-01 10:00:10,餐饮美食,食堂,-,午饭,支出,+3.20,余额,交易成功,T11\n"
+).encode("gb18030")
+
+
+# Rows with an extra trailing field hold every column and are kept
+RAGGED_ROW = "2025-01-01 10:00:07,日用百货,超市,-,纸巾,支出,2.00,余额,交易成功,T8,\n"
+
+
+def _skipped_rows():
+    from prometheus_client import REGISTRY
+
+    from app.domain.models.payment import PaymentSource
+
+    labels = {"source": PaymentSource.ALIPAY.value}
+    return REGISTRY.get_sample_value("payment_import_rows_skipped_total", labels) or 0
+
+
+@pytest.mark.parametrize(
+    "export,transaction_ids",
+    [
+        (ALIPAY_EXPORT, ["T1", "T2", "T6", "T7", "T9", "T10", "T11"]),
+        (
+            ALIPAY_EXPORT + RAGGED_ROW.encode("gb18030"),
+            ["T1", "T2", "T6", "T7", "T9", "T10", "T11", "T8"],
+        ),
+    ],
+)
+def test_alipay_arrow_parser_matches_row_parser(export, transaction_ids):
+    pytest.importorskip("pyarrow")
+    from app.domain.parsers.alipay_arrow_parser import parse_alipay_arrow
+
+    before = _skipped_rows()
+    expected = parse_alipay_rows(io.BytesIO(export))
+    skipped = _skipped_rows() - before
+    assert [p.transaction_id for p in expected] == transaction_ids
+    assert skipped == 5
+    assert parse_alipay_arrow(io.BytesIO(export)) == expected
+    assert _skipped_rows() - before == 2 * skipped
+
+
+@pytest.mark.parametrize("amount", [float("inf"), float("-inf"), "Infinity", "NaN"])
+def test_to_fen_rejects_non_finite_amounts(amount):
+    with pytest.raises(ValueError):
+        to_fen(amount)
+
+
+class _StubResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+class _StubSession:
+    """
+    Stands in for the pooled requests session: handle gets the payloads of a
+    batch request and returns the response body.
+    """
+
+    def __init__(self, handle):
+        self.handle = handle
+
+    def post(self, url, json):
+        return _StubResponse(self.handle(json["payments"]))
+
+    def close(self):
+        pass
+
+
+def _write_payments_csv(path, rows):
+    lines = ["date,amount,currency,merchant,source,type"] + [
+        f"2025-01-01T10:{i:02d}:00,{i + 1}.50,CNY,m{i},Other,expense"
+        for i in range(rows)
+    ]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def _upload(monkeypatch, csv_path, handle, **kwargs):
+    from app.domain.helpers import import_payments_csv
+
+    monkeypatch.setattr(
+        import_payments_csv, "create_api_session", lambda *args: _StubSession(handle)
+    )
+    return import_payments_csv.upload_payments_to_api(
+        str(csv_path), 1, "http://api", chunk_size=2, **kwargs
+    )
+
+
+def test_upload_checkpoint_waits_for_earlier_chunks(monkeypatch, tmp_path):
+    from app.domain.helpers import import_payments_csv
+
+    csv_path = tmp_path / "payments.csv"
+    _write_payments_csv(csv_path, 6)
+    checkpoints = []
+    checkpointed = threading.Event()
+    write_checkpoint = import_payments_csv.write_checkpoint
+
+    def record_checkpoint(path, row):
+        checkpoints.append(row)
+        write_checkpoint(path, row)
+        checkpointed.set()
+
+    def handle(payloads):
+        # The first chunk is acknowledged after the later ones
+        if payloads[0]["merchant"] == "m0":
+            assert checkpointed.wait(5)
+        return {"added": [p["merchant"] for p in payloads], "duplicates": []}
+
+    monkeypatch.setattr(import_payments_csv, "write_checkpoint", record_checkpoint)
+    assert _upload(monkeypatch, csv_path, handle, workers=3) == (6, 0)
+    assert checkpoints[-1] == 6
+    assert set(checkpoints[:-1]) == {0}
+    assert not os.path.exists(f"{csv_path}.checkpoint")
+
+
+def test_interrupted_upload_resumes_from_checkpoint(monkeypatch, tmp_path):
+    csv_path = tmp_path / "payments.csv"
+    _write_payments_csv(csv_path, 9)
+    sent = []
+    server = {"fails_at": "m4", "down": False}
+
+    def handle(payloads):
+        merchants = [p["merchant"] for p in payloads]
+        # The server goes down at the third chunk and stays down
+        if server["fails_at"] in merchants:
+            server["down"] = True
+        if server["down"]:
+            raise RuntimeError("server down")
+        sent.extend(merchants)
+        return {"added": merchants, "duplicates": []}
+
+    with pytest.raises(RuntimeError):
+        _upload(monkeypatch, csv_path, handle, workers=1)
+    assert (tmp_path / "payments.csv.checkpoint").read_text() == "4"
+    assert sent == ["m0", "m1", "m2", "m3"]
+
+    server.update(fails_at=None, down=False)
+    assert _upload(monkeypatch, csv_path, handle, workers=2) == (5, 0)
+    assert sorted(sent) == sorted(f"m{i}" for i in range(9))
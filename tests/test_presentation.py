@@ -0,0 +1,551 @@
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+_tmp_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp_dir}/test.db"
+os.environ.setdefault("SECRET_KEY", "test")
+
+import pytest  # noqa: E402
+from fastapi import FastAPI, Request  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.main import app  # noqa: E402
+from app.presentation.upload_limit import UploadSizeLimitMiddleware  # noqa: E402
+
+ALIPAY_HEADER = (
+    "支付宝交易明细\n"
+    "交易时间,交易分类,交易对方,对方账号,商品说明,收/支,金额,收/付款方式,"
+    "交易状态,交易订单号\n"
+)
+
+
+def alipay_csv(*minutes, padding=b""):
+    """
+    An Alipay export with one payment per given minute after 2025-03-01 noon.
+    """
+    noon = datetime(2025, 3, 1, 12)
+    rows = "".join(
+        f"{noon + timedelta(minutes=m):%Y-%m-%d %H:%M:%S},餐饮美食,食堂,-,午饭,支出,"
+        f"12.50,余额,交易成功,T{m:06d}\n"
+        for m in minutes
+    )
+    return padding + (ALIPAY_HEADER + rows).encode("gb18030")
+
+
+def import_files(client, headers, *contents):
+    return client.post(
+        "/api/payments/import",
+        files=[
+            ("files", (f"alipay_{i}.csv", c, "text/csv"))
+            for i, c in enumerate(contents)
+        ],
+        data={"types": ["Alipay"] * len(contents)},
+        headers=headers,
+    )
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="module")
+def auth_headers(client):
+    credentials = {"username": "uploader", "password": "secret"}
+    client.post("/api/auth/register", json=credentials)
+    token = client.post("/api/auth/token", data=credentials).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def _disk_usage(path):
+    files = [os.path.join(root, f) for root, _, names in os.walk(path) for f in names]
+    return len(files), sum(os.path.getsize(f) for f in files)
+
+
+def test_import_many_files_leaves_no_temp_files(
+    client, auth_headers, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    # Uploads over 1 MiB roll over from memory to a temp file on disk
+    padding = (b"#" * 99 + b"\n") * 20000
+    before = _disk_usage(tmp_path)
+
+    for i in range(1000):
+        content = alipay_csv(i, padding=padding if i % 100 == 0 else b"")
+        response = import_files(client, auth_headers, content)
+        assert response.status_code == 200
+        assert response.json() == {"imported": 1}
+
+    assert _disk_usage(tmp_path) == before
+
+
+def test_reimport_is_rejected_and_overlap_skipped(client, auth_headers):
+    first = alipay_csv(2000, 2002)
+    assert import_files(client, auth_headers, first).json() == {"imported": 2}
+
+    response = import_files(client, auth_headers, first)
+    assert response.status_code == 400
+    assert "already imported" in response.json()["detail"]
+
+    # Only the row after the first export's span is new
+    overlapping = alipay_csv(2002, 2003)
+    assert import_files(client, auth_headers, overlapping).json() == {"imported": 1}
+    # A row inside the span that the earlier exports left out is still added
+    filled = alipay_csv(2001, 2002)
+    assert import_files(client, auth_headers, filled).json() == {"imported": 1}
+
+
+def test_overlapping_import_looks_up_each_row_once(client, auth_headers, monkeypatch):
+    from prometheus_client import REGISTRY
+
+    from app.data.repositories import payment_repository
+    from app.domain.services import payment_service
+
+    lookups = []
+
+    def get_stored_fingerprints(db, user_id, fingerprints):
+        fingerprints = list(fingerprints)
+        lookups.extend(fingerprints)
+        return lookup(db, user_id, fingerprints)
+
+    def counter(name):
+        labels = {"source": "Alipay"}
+        return REGISTRY.get_sample_value(f"payment_import_{name}_total", labels) or 0
+
+    lookup = payment_repository.get_stored_fingerprints
+    assert import_files(client, auth_headers, alipay_csv(2200, 2202)).json() == {
+        "imported": 2
+    }
+    for module in (payment_repository, payment_service):
+        monkeypatch.setattr(module, "get_stored_fingerprints", get_stored_fingerprints)
+    before = {name: counter(name) for name in ("rows_covered", "duplicates")}
+
+    # 2201 is inside the first span but new, 2202 is stored, 2203 is after it
+    overlapping = alipay_csv(2201, 2202, 2203)
+    assert import_files(client, auth_headers, overlapping).json() == {"imported": 2}
+    assert len(lookups) == len(set(lookups)) == 3
+    assert counter("rows_covered") - before["rows_covered"] == 1
+    assert counter("duplicates") - before["duplicates"] == 0
+
+
+def test_import_stores_payments_and_record_together(client, auth_headers, monkeypatch):
+    from app.domain.services import payment_service
+
+    # Two different files seen as the same one, as in a concurrent import
+    monkeypatch.setattr(payment_service, "_content_hash", lambda f: "same hash")
+    monkeypatch.setattr(payment_service, "is_file_imported", lambda *args: False)
+    assert import_files(client, auth_headers, alipay_csv(2100)).json() == {
+        "imported": 1
+    }
+    response = import_files(client, auth_headers, alipay_csv(2101))
+    assert response.status_code == 400
+    assert "already imported" in response.json()["detail"]
+    monkeypatch.undo()
+    # The rows of the rejected file were not kept, so it imports in full
+    assert import_files(client, auth_headers, alipay_csv(2101)).json() == {
+        "imported": 1
+    }
+
+
+def test_ingest_ndjson_reports_each_line(client, auth_headers):
+    payment = (
+        '{"date": "2025-05-01T12:00:00", "amount": 9.5, "currency": "CNY",'
+        ' "merchant": "ndjson", "type": "expense"}'
+    )
+    body = "\n".join([payment, "{not json", payment, "", '{"amount": 1}'])
+    response = client.post(
+        "/api/payments/ingest",
+        content=body.encode(),
+        headers={**auth_headers, "Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert [(r["line"], r["status"]) for r in results] == [
+        (1, "added"),
+        (2, "error"),
+        (3, "duplicate"),
+        (5, "error"),
+    ]
+
+
+def test_ingest_stops_at_a_line_too_long_to_buffer(client, auth_headers, monkeypatch):
+    import asyncio
+
+    from app.data.base import SessionLocal
+    from app.data.repositories.user_repository import get_user_by_username
+    from app.domain.services import payment_service
+    from app.presentation.payments_api import _parse_ndjson_payment
+
+    monkeypatch.setattr(payment_service, "MAX_INGEST_LINE_BYTES", 200)
+
+    def payment(merchant):
+        return json.dumps(_batch_payment(merchant)).encode() + b"\n"
+
+    async def chunks():
+        yield payment("ingest first") + b"x" * 300 + b"\n" + payment("ingest second")
+        # A line still incomplete after 200 bytes ends the ingest
+        yield b"y" * 300
+        yield b"\n" + payment("ingest after")
+
+    db = SessionLocal()
+    try:
+        user_id = get_user_by_username(db, "uploader").id
+        results = asyncio.run(
+            payment_service.ingest_payment_lines(
+                chunks(), _parse_ndjson_payment, db, user_id
+            )
+        )
+        lines = [json.loads(line) for line in results.read().splitlines()]
+        results.close()
+    finally:
+        db.close()
+    assert [(r["line"], r["status"]) for r in lines] == [
+        (1, "added"),
+        (2, "error"),
+        (3, "added"),
+        (4, "error"),
+    ]
+    assert "longer than 200 bytes" in lines[3]["error"]
+    merchants = _merchants(client, auth_headers)
+    assert "ingest second" in merchants and "ingest after" not in merchants
+
+
+def _batch_payment(merchant, amount=5.0, **extra):
+    return {
+        "date": "2025-04-01T12:00:00",
+        "amount": amount,
+        "currency": "CNY",
+        "merchant": merchant,
+        "type": "expense",
+        **extra,
+    }
+
+
+def _merchants(client, headers):
+    response = client.get("/api/payments", headers=headers)
+    return [p["merchant"] for p in response.json()]
+
+
+def test_batch_rejects_everything_on_one_bad_payment(client, auth_headers):
+    payments = [_batch_payment("batch ok"), _batch_payment("batch bad", type="?")]
+    response = client.post(
+        "/api/payments/batch", json={"payments": payments}, headers=auth_headers
+    )
+    assert response.status_code == 400
+    assert "Payment 1" in response.json()["detail"]
+    assert "batch ok" not in _merchants(client, auth_headers)
+
+
+def test_batch_reports_duplicates_by_index(client, auth_headers):
+    first = _batch_payment("batch first")
+    payments = [first, _batch_payment("batch second"), first]
+    response = client.post(
+        "/api/payments/batch", json={"payments": payments}, headers=auth_headers
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert [p["merchant"] for p in body["added"]] == ["batch first", "batch second"]
+    assert body["duplicates"] == [2]
+
+    response = client.post(
+        "/api/payments/batch", json={"payments": payments[:2]}, headers=auth_headers
+    )
+    assert response.json() == {"added": [], "duplicates": [0, 1]}
+
+
+def test_changes_return_writes_since_the_cursor(client, auth_headers):
+    def changes(since):
+        response = client.get(
+            "/api/payments/changes", params={"since": since}, headers=auth_headers
+        )
+        assert response.status_code == 200
+        body = response.json()
+        return body["cursor"], body["upserted"], body["deleted"]
+
+    tree = {"tree": {"Food": {"Lunch": None}}}
+    client.put("/api/payments/categories/tree", json=tree, headers=auth_headers)
+    start = client.get("/api/payments/changes", headers=auth_headers).json()["cursor"]
+    ids = {}
+    for merchant in ("changes kept", "changes edited", "changes deleted"):
+        payment = _batch_payment(merchant)
+        response = client.post("/api/payments", json=payment, headers=auth_headers)
+        ids[merchant] = response.json()["id"]
+
+    inserted, upserted, deleted = changes(start)
+    assert inserted == start + 3
+    assert sorted(p["id"] for p in upserted) == sorted(ids.values())
+    assert deleted == []
+
+    client.patch(
+        f"/api/payments/{ids['changes edited']}/category",
+        json={"cust_category": "Lunch"},
+        headers=auth_headers,
+    )
+    client.post(
+        "/api/payments/delete",
+        json={"ids": [ids["changes deleted"]]},
+        headers=auth_headers,
+    )
+    cursor, upserted, deleted = changes(inserted)
+    assert cursor == inserted + 2
+    edited = [(p["id"], p["cust_category"]) for p in upserted]
+    assert edited == [(ids["changes edited"], "Lunch")]
+    assert deleted == [ids["changes deleted"]]
+    # The range is (since, until]: nothing is repeated for the latest cursor
+    assert changes(cursor) == (cursor, [], [])
+    response = client.get(
+        "/api/payments/changes", params={"since": cursor + 1}, headers=auth_headers
+    )
+    assert response.status_code == 400
+
+
+def test_search_follows_next_cursor(client, auth_headers):
+    for hour in range(5):
+        payment = _batch_payment(
+            "search cursor", date=f"2025-05-01T{hour:02d}:00:00", amount=hour + 1
+        )
+        client.post("/api/payments", json=payment, headers=auth_headers)
+    params = {"q": "search cursor", "limit": 2}
+    amounts = []
+    while True:
+        body = client.get(
+            "/api/payments/search", params=params, headers=auth_headers
+        ).json()
+        amounts += [p["amount"] for p in body["items"]]
+        if not body["next_cursor"]:
+            break
+        params["cursor"] = body["next_cursor"]
+    assert amounts == [5, 4, 3, 2, 1]
+    params["cursor"] = "not a cursor"
+    response = client.get("/api/payments/search", params=params, headers=auth_headers)
+    assert response.status_code == 400
+
+
+def test_get_revalidates_with_etag_until_a_write(client, auth_headers):
+    etag = client.get("/api/payments", headers=auth_headers).headers["ETag"]
+    conditional = {**auth_headers, "If-None-Match": etag}
+    assert client.get("/api/payments", headers=conditional).status_code == 304
+    # POST reads always answer in full
+    response = client.post("/api/payments/aggregate", json={}, headers=conditional)
+    assert response.status_code == 200 and "ETag" not in response.headers
+
+    client.post("/api/payments", json=_batch_payment("etag"), headers=auth_headers)
+    response = client.get("/api/payments", headers=conditional)
+    assert response.status_code == 200 and response.headers["ETag"] != etag
+
+
+def test_write_invalidates_cached_aggregate(client, auth_headers):
+    from app.domain.services.payment_service import aggregation_cache
+
+    window = {"start_date": "2030-01-01T00:00:00", "end_date": "2030-12-31T00:00:00"}
+
+    def total():
+        response = client.post(
+            "/api/payments/aggregate", json=window, headers=auth_headers
+        )
+        return response.json()[1]["total sum"]
+
+    assert total() == 0
+    hits = aggregation_cache.hits
+    assert total() == 0 and aggregation_cache.hits == hits + 1
+
+    payment = _batch_payment("cached", amount=7.0, date="2030-06-01T12:00:00")
+    client.post("/api/payments", json=payment, headers=auth_headers)
+    assert total() == -7.0
+    metrics = client.get("/metrics").text
+    assert 'result_cache_hits_total{cache="aggregation"}' in metrics
+
+
+def test_reads_use_replica_except_right_after_a_write(
+    client, auth_headers, tmp_path, monkeypatch
+):
+    from sqlalchemy import create_engine
+
+    from app.data import base
+
+    # An empty replica stands in for one that has not caught up yet
+    replica = create_engine(f"sqlite:///{tmp_path}/replica.db")
+    base.Base.metadata.create_all(bind=replica)
+    monkeypatch.setitem(base._engines, "replica", replica)
+    payment = {
+        "date": "2025-06-01T12:00:00",
+        "amount": 3.0,
+        "currency": "CNY",
+        "merchant": "replica test",
+        "type": "expense",
+    }
+    assert client.post("/api/payments", json=payment, headers=auth_headers).is_success
+
+    def merchants():
+        response = client.get("/api/payments", headers=auth_headers)
+        return [p["merchant"] for p in response.json()]
+
+    assert "replica test" in merchants()
+    monkeypatch.setattr(base, "REPLICA_STICKY_SECONDS", 0)
+    assert merchants() == []
+    for path in ("aggregate", "aggregate/sankey", "series", "sums"):
+        response = client.post(f"/api/payments/{path}", json={}, headers=auth_headers)
+        assert response.status_code == 200
+    # Endpoints that are not on the read path still use the primary
+    response = client.get("/api/payments/changes", headers=auth_headers)
+    assert "replica test" in [p["merchant"] for p in response.json()["upserted"]]
+
+
+def test_responses_carry_server_timing(client, auth_headers):
+    client.post("/api/payments", json=_batch_payment("timing"), headers=auth_headers)
+    response = client.get("/api/payments", headers=auth_headers)
+    metrics = dict(
+        part.strip().split(";", 1)
+        for part in response.headers["Server-Timing"].split(",")
+    )
+    assert metrics["total"].startswith("dur=")
+    assert metrics["db"].startswith("dur=") and "queries" in metrics["db"]
+    assert "serialize" in metrics
+    count = len(response.json())
+    assert metrics["rows"] == f'desc="{count} rows"'
+
+
+def test_metrics_label_requests_by_route_template(client, auth_headers):
+    response = client.post(
+        "/api/payments", json=_batch_payment("metrics"), headers=auth_headers
+    )
+    payment_id = response.json()["id"]
+    client.patch(
+        f"/api/payments/{payment_id}/category",
+        json={"cust_category": ""},
+        headers=auth_headers,
+    )
+    metrics = client.get("/metrics").text
+    assert (
+        'http_request_duration_seconds_count{method="PATCH",'
+        'route="/api/payments/{payment_id}/category",status="200"}'
+    ) in metrics
+    assert f"/api/payments/{payment_id}/" not in metrics
+
+
+def test_exports_round_trip_with_archived_payments(client, tmp_path, monkeypatch):
+    import csv
+    import io
+
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    from app.data.base import SessionLocal
+    from app.data.repositories import archive_repository
+    from app.data.repositories.payment_repository import (
+        archive_payments,
+        get_all_payments,
+        get_payment_rows,
+    )
+    from app.data.repositories.user_repository import get_user_by_username
+    from app.domain.helpers.money import to_yuan
+
+    monkeypatch.setattr(archive_repository, "PAYMENT_ARCHIVE_DIR", str(tmp_path))
+    credentials = {"username": "exporter", "password": "secret"}
+    client.post("/api/auth/register", json=credentials)
+    token = client.post("/api/auth/token", data=credentials).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    for month in range(1, 7):
+        payment = _batch_payment(
+            f"export {month}",
+            amount=month + 0.25,
+            date=f"2024-{month:02d}-15T08:30:00",
+            note='a, "quoted" note' if month % 2 else "",
+            transaction_id=f"E{month}",
+        )
+        client.post("/api/payments", json=payment, headers=headers)
+
+    db = SessionLocal()
+    try:
+        user_id = get_user_by_username(db, "exporter").id
+        assert archive_payments(db, user_id, datetime(2024, 4, 1)) == 3
+        transaction_ids = {
+            p.id: p.transaction_id for p in get_all_payments(db, user_id)
+        }
+        rows = sorted(get_payment_rows(db, user_id), key=lambda row: row.id)
+        expected = [
+            {
+                "id": row.id,
+                "date": row.date,
+                "amount_fen": row.amount_fen,
+                "currency": row.currency,
+                "merchant": row.merchant,
+                "auto_category": row.auto_category or "",
+                "source": row.source.value,
+                "type": row.type.value,
+                "note": row.note or "",
+                "cust_category": row.category or "",
+                "transaction_id": transaction_ids[row.id],
+            }
+            for row in rows
+        ]
+    finally:
+        db.close()
+    assert len(expected) == 6
+
+    def read_ndjson(content):
+        payments = [json.loads(line) for line in content.splitlines()]
+        for payment in payments:
+            payment["date"] = datetime.fromisoformat(payment["date"])
+        return payments
+
+    readers = {
+        "parquet": lambda content: pq.read_table(io.BytesIO(content)).to_pylist(),
+        "arrow": lambda content: pa.ipc.open_stream(content).read_all().to_pylist(),
+        "ndjson": read_ndjson,
+    }
+    for export_format, read in readers.items():
+        response = client.get(
+            "/api/payments/export", params={"format": export_format}, headers=headers
+        )
+        assert response.status_code == 200
+        exported = read(response.content)
+        assert sorted(exported, key=lambda p: p["id"]) == expected
+
+    response = client.get("/api/payments/download", headers=headers)
+    assert response.status_code == 200
+    as_text = [
+        {key: str(value) for key, value in payment.items()} for payment in expected
+    ]
+    for payment, row in zip(as_text, expected):
+        payment["date"] = row["date"].isoformat()
+        # The CSV download keeps amounts in yuan
+        payment["amount"] = str(to_yuan(int(payment.pop("amount_fen"))))
+    downloaded = list(csv.DictReader(io.StringIO(response.text)))
+    assert sorted(downloaded, key=lambda p: int(p["id"])) == as_text
+
+
+def _echo_app(max_bytes):
+    echo = FastAPI()
+
+    @echo.post("/upload")
+    async def upload(request: Request):
+        return {"received": len(await request.body())}
+
+    echo.add_middleware(
+        UploadSizeLimitMiddleware, max_bytes=max_bytes, path_prefix="/upload"
+    )
+    return TestClient(echo)
+
+
+def test_upload_limit_rejects_large_content_length():
+    response = _echo_app(10).post("/upload", content=b"x" * 11)
+    assert response.status_code == 413
+
+
+def test_upload_limit_rejects_large_streamed_body():
+    def chunks():
+        for _ in range(5):
+            yield b"x" * 4
+
+    # A generator body is sent chunked, without Content-Length
+    response = _echo_app(10).post("/upload", content=chunks())
+    assert response.status_code == 413
+
+
+def test_upload_limit_allows_small_body():
+    response = _echo_app(10).post("/upload", content=b"x" * 10)
+    assert response.json() == {"received": 10}